@@ -1,19 +1,13 @@
-import sys
-import shutil
+import time
+import argparse
 from conf import Config
-from matool import Tool
+from fsutil import safe_move, display_path
+from context import get_context
+from shard import add_shard_argument, filter_shard, use_shard_state_files, save_shard_summary
+from usage_index import apply_usage
+from used_store import used_png_stems
 
 config = Config()
-try:
-    matool = Tool(
-        primary_exe_path=config.MATOOL_EXE_PRIMARY,
-        cwd=config.BASE_DIR,
-        alternative_exe_path=config.MATOOL_EXE_ALT
-    )
-except FileNotFoundError as e:
-    print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}")
-    print("Работа скрипта прервана из-за отсутствия matool.exe.")
-    sys.exit(1)
 
 def setup_directories():
     """Создает все необходимые директории для работы скрипта."""
@@ -32,7 +26,7 @@ def get_processed_bases():
     """Собирает набор базовых имен файлов, которые уже обработаны или отложены."""
     print("\n2. Сбор информации об уже обработанных/отложенных файлах...")
     processed_result_stems_raw = set()
-    processed_result_stems_raw.update(f.stem for f in config.USED_DIR.glob('*.png'))
+    processed_result_stems_raw.update(used_png_stems())
 
     processed_result_bases_normalized = set()
     for stem in processed_result_stems_raw:
@@ -57,7 +51,7 @@ def handle_multi_texture_mat(mat_path):
     moved = False
     try:
         if not target_path.exists():
-            shutil.move(str(mat_path), str(target_path))
+            safe_move(mat_path, target_path)
             print(f"  Успешно перемещен.")
             moved = True
         else:
@@ -79,11 +73,11 @@ def cleanup_previous_output(base_name, std_format):
     expected_output_png = config.EXTRACTED_DIR / f"{base_name}.png"
 
     if final_png_path.exists():
-        print(f"  Удаление старого PNG в папке формата: {final_png_path.relative_to(config.BASE_DIR)}")
+        print(f"  Удаление старого PNG в папке формата: {display_path(final_png_path)}")
         try: final_png_path.unlink()
         except Exception as e: print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось удалить {final_png_path.name}: {e}")
     if expected_output_png.exists():
-        print(f"  Удаление предыдущего извлеченного PNG: {expected_output_png.relative_to(config.BASE_DIR)}")
+        print(f"  Удаление предыдущего извлеченного PNG: {display_path(expected_output_png)}")
         try: expected_output_png.unlink()
         except Exception as e: print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось удалить {expected_output_png.name}: {e}")
 
@@ -93,7 +87,7 @@ def move_extracted_png(expected_output_png, target_format_dir, final_png_path):
     try:
         print(f"  Перемещение PNG из {expected_output_png.parent.name}/{expected_output_png.name} -> {target_format_dir.name}/{final_png_path.name}")
         target_format_dir.mkdir(parents=True, exist_ok=True)
-        shutil.move(str(expected_output_png), str(final_png_path))
+        safe_move(expected_output_png, final_png_path)
         print(f"  Успешно перемещено PNG.")
         png_moved = True
     except Exception as e:
@@ -107,7 +101,7 @@ def move_processed_mat(mat_path):
         used_mat_target_path = config.USED_MAT_DIR / mat_path.name
         if not used_mat_target_path.exists():
             print(f"  Перемещение исходного MAT файла -> {config.USED_MAT_DIR.name}")
-            shutil.move(str(mat_path), str(used_mat_target_path))
+            safe_move(mat_path, used_mat_target_path)
             print(f"  Исходный MAT успешно перемещен.")
             mat_moved_or_deleted = True
         else:
@@ -132,7 +126,11 @@ def handle_single_texture_mat(mat_path, base_name, std_format):
     cleanup_previous_output(base_name, std_format)
 
     print(f"  Извлечение PNG файла...")
-    extract_successful = matool.extract(mat_path)
+    if std_format == "indexed":
+        from indexed_mat import extract_indexed_mat  # NumPy нужен только для палитровых MAT
+        extract_successful = extract_indexed_mat(mat_path, config.EXTRACTED_DIR)
+    else:
+        extract_successful = get_context().tool.extract(mat_path)
 
     if not extract_successful:
         # matool.extract() уже выводит информацию об ошибке через run_command
@@ -190,10 +188,18 @@ def print_summary_report(total_files, skipped_count, processed_count, files_to_u
         print(f"Проверьте папки {config.MAT_DIR.name}, {config.USED_DIR.name}, {config.USED_MAT_DIR.name}, {config.MANUAL_CEL_DIR.name} и лог выше.")
 
 
-def main():
+def parse_args_phase1(argv=None):
+    parser = argparse.ArgumentParser(description="Скрипт 1: Извлечение MAT в PNG и сортировка по форматам.")
+    add_shard_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args_phase1(argv)
+    use_shard_state_files(args.shard)
+    start_time = time.time()
     setup_directories()
     processed_bases = get_processed_bases()
-    mat_files = sorted(list(config.MAT_DIR.glob('*.mat')))
+    mat_files = apply_usage(filter_shard(sorted(config.MAT_DIR.glob('*.mat')), args.shard, "MAT"), "MAT")
     total_mat_files = len(mat_files)
     print(f"\n3. Найдено {total_mat_files} .mat файлов для проверки в {config.MAT_DIR.name}")
 
@@ -215,8 +221,9 @@ def main():
         processed_count += 1
         processed_bases_in_run.add(base_name)
         print(f"\n[{i + 1}/{total_mat_files} | Обработка {processed_count}] Файл: {mat_path.name}")
+        get_context().track_asset(mat_path.name)
 
-        info_result = matool.info(mat_path)
+        info_result = get_context().mat_info(mat_path)
 
         if info_result['error']:
             print(f"  Пропуск: Ошибка получения информации для {mat_path.name}.")
@@ -242,6 +249,14 @@ def main():
              print(f"  ПРЕДУПРЕЖДЕНИЕ: Количество текстур {texture_count}. Неожиданное значение. Пропускаем.")
 
     print_summary_report(total_mat_files, skipped_count, processed_count, files_to_upscale_paths)
+    save_shard_summary("extract", args.shard, {
+        'total_files': total_mat_files, 'skipped_count': skipped_count,
+        'processed_count': processed_count, 'files_to_upscale_paths': files_to_upscale_paths,
+    })
+    get_context().record_phase("extract", {
+        'total': total_mat_files, 'skipped': skipped_count,
+        'processed': processed_count, 'success': len(files_to_upscale_paths),
+    }, time.time() - start_time, items=processed_count)
 
 # def check_matool_exists(): - Эта функция больше не нужна, Tool.__init__ обрабатывает это.
 
@@ -1,25 +1,135 @@
+import io
+import os
+import queue
 import sys
 import time
+import random
+import argparse
+import tempfile
+import threading
+import importlib.util
 from pathlib import Path
-from PIL import Image
-from gradio_client import Client, handle_file
 from conf import Config
-from matool import Tool
+from context import get_context
+from quota import QuotaState, sleep_until_reset
+from mat_format import read_mat_header
+from endpoint_pool import Endpoint, EndpointPool, HedgeBudget
+from png_header import read_png_size
+from admission import MemoryAdmission, estimate_image_job_bytes, total_physical_memory
+from shard import add_shard_argument, filter_shard, use_shard_state_files, save_shard_summary
+from usage_index import apply_usage
+from upscale_routing import route_for_png, max_scale, validate_routes
+from concurrent.futures import ThreadPoolExecutor
 
 config = Config()
-try:
-    matool = Tool(
-        primary_exe_path=config.MATOOL_EXE_PRIMARY,
-        cwd=config.BASE_DIR,
-        alternative_exe_path=config.MATOOL_EXE_ALT
-    )
-except FileNotFoundError as e:
-    print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}")
-    print("Работа скрипта прервана из-за отсутствия matool.exe.")
-    sys.exit(1)
-
-def restore_alpha(original_png_path, upscaled_png_path):
-    """Восстанавливает альфа-канал из оригинала в апскейленный PNG."""
+
+quota_state = QuotaState(config.QUOTA_STATE_FILE, config.QUOTA_DEFAULT_WAIT)
+# Статистика вызовов API за запуск (для истории производительности и планировщика)
+api_stats = {'calls': 0, 'seconds': 0.0, 'megapixels': 0.0, 'upload_bytes': 0, 'download_bytes': 0}
+api_stats_lock = threading.Lock()
+hedge_budget = HedgeBudget(config.HEDGE_BUDGET_FRACTION)
+route_counts = {}  # Текстур по маршрутам апскейла (upscale_routing)
+route_counts_lock = threading.Lock()
+numpy_available = importlib.util.find_spec('numpy') is not None  # Нужен только для локального пути простых текстур
+
+def reset_run_state():
+    """
+    Обнуляет счетчики запуска перед main(): watch_mats и jones.py запускают фазу повторно
+    в том же процессе, и без этого отчет и история производительности получали бы суммы прошлых запусков.
+    Состояние квоты перечитывается из файла.
+    """
+    global quota_state
+    with api_stats_lock:
+        api_stats.update(calls=0, seconds=0.0, megapixels=0.0, upload_bytes=0, download_bytes=0)
+    with route_counts_lock:
+        route_counts.clear()
+    with hedge_budget.lock:
+        hedge_budget.stats.update(requests=0, hedges=0, hedge_wins=0, cancelled=0)
+    quota_state = QuotaState(config.QUOTA_STATE_FILE, config.QUOTA_DEFAULT_WAIT)
+
+def encode_payload(original_png_path, drop_alpha):
+    """
+    Кодирует изображение для отправки на апскейл в самый компактный формат без потерь
+    из Config.PAYLOAD_FORMATS (lossless WebP / оптимизированный PNG). При drop_alpha
+    отправляется только RGB (альфа апскейлится локально).
+    Возвращает (путь к payload, временный ли это файл).
+    """
+    from PIL import Image
+    with Image.open(original_png_path) as img:
+        img.load()
+        converted = drop_alpha and 'A' in img.getbands()
+        payload_img = img.convert('RGB') if converted else img.copy()
+    if payload_img.mode not in ('RGB', 'RGBA'):
+        payload_img = payload_img.convert('RGBA' if 'A' in payload_img.getbands() else 'RGB')
+
+    best_size, best_format, best_data = None, None, None
+    if not converted:
+        best_size = original_png_path.stat().st_size  # Исходный файл - тоже кандидат
+    for payload_format in config.PAYLOAD_FORMATS:
+        buffer = io.BytesIO()
+        if payload_format == "webp":
+            # exact - сохранить RGB под прозрачными пикселями (иначе WebP их обнуляет)
+            payload_img.save(buffer, "WEBP", lossless=True, quality=100, method=6, exact=True)
+        else:
+            payload_img.save(buffer, "PNG", optimize=True)
+        if best_size is None or buffer.tell() < best_size:
+            best_size, best_format, best_data = buffer.tell(), payload_format, buffer.getvalue()
+
+    if best_data is None:
+        return original_png_path, False
+    handle, payload_path = tempfile.mkstemp(prefix=f"{original_png_path.stem}_", suffix=f".{best_format}")
+    with open(handle, 'wb') as f:
+        f.write(best_data)
+    return Path(payload_path), True
+
+def try_trivial_fast_path(original_png_path, target_png_path, scale):
+    """
+    Простые текстуры (заливки, крошечные образцы, градиенты) апскейлятся локально, без API.
+    Возвращает тип текстуры, если она обработана локально, иначе None.
+    """
+    if not config.TRIVIAL_FAST_PATH or not numpy_available:
+        return None
+    import numpy as np
+    from PIL import Image
+    from imageutil import classify_trivial_texture, upscale_trivial_png
+    with Image.open(original_png_path) as img:
+        pixels = np.asarray(img.convert('RGBA' if 'A' in img.getbands() else 'RGB'))
+    kind = classify_trivial_texture(pixels, config.TRIVIAL_MAX_SIZE, config.TRIVIAL_SOLID_TOLERANCE,
+                                    config.TRIVIAL_GRADIENT_MAX_RESIDUAL)
+    if kind:
+        upscale_trivial_png(original_png_path, target_png_path, scale, kind)
+    return kind
+
+def upscale_interpolated(original_png_path, target_png_path, scale):
+    """Апскейл без API для маршрута с backend "local": Lanczos, только RGB (альфа - отдельно, как после API)."""
+    from PIL import Image
+    with Image.open(original_png_path) as img:
+        rgb = img.convert('RGB')
+    rgb.resize((rgb.width * scale, rgb.height * scale), Image.Resampling.LANCZOS).save(target_png_path, "PNG")
+
+def fit_to_scale(original_png_path, upscaled_png_path, scale):
+    """
+    Приводит результат API к размеру исходника x scale маршрута (модель могла увеличить в другое число раз).
+    Возвращает True, если размер пришлось менять.
+    """
+    from PIL import Image
+    with Image.open(original_png_path) as img:
+        expected = (img.width * scale, img.height * scale)
+    with Image.open(upscaled_png_path) as img:
+        if img.size == expected:
+            return False
+        print(f"    Результат {img.width}x{img.height} вместо {expected[0]}x{expected[1]} (x{scale}), приводим размер.")
+        resized = img.resize(expected, Image.Resampling.LANCZOS)
+    resized.save(upscaled_png_path, "PNG")
+    return True
+
+def upscale_alpha_locally(original_png_path, upscaled_png_path, format_name):
+    """
+    Добавляет к апскейленному RGB альфа-канал оригинала, увеличенный локально:
+    для 1-битной альфы (rgba5551, прозрачный индекс палитры) - сглаженное увеличение с жестким порогом (ровные края без лесенки),
+    для остальных форматов (rgba4444 и др.) - плавная интерполяция.
+    """
+    from PIL import Image
     try:
         if not original_png_path.exists():
              print(f"    ОШИБКА: Оригинальный PNG {original_png_path.name} не найден в {original_png_path.parent}. Невозможно восстановить альфу.")
@@ -30,16 +140,14 @@ def restore_alpha(original_png_path, upscaled_png_path):
                      print("    В апскейле обнаружен альфа-канал, хотя в оригинале его не было. Конвертируем в RGB.")
                      rgb_img = img_upscaled.convert('RGB'); rgb_img.save(upscaled_png_path, "PNG"); rgb_img.close()
                 return True
-            if 'A' not in img_upscaled.getbands():
-                 print("    Апскейл не содержит альфа-канал, конвертируем в RGBA.")
-                 img_upscaled = img_upscaled.convert("RGBA")
-            elif img_upscaled.mode != 'RGBA':
-                 print(f"    Апскейл имеет режим {img_upscaled.mode}, но не RGBA. Конвертируем в RGBA.")
-                 img_upscaled = img_upscaled.convert("RGBA")
-            alpha_orig = img_orig.getchannel('A')
-            alpha_resized = alpha_orig.resize(img_upscaled.size, Image.Resampling.NEAREST)
-            img_upscaled.putalpha(alpha_resized); img_upscaled.save(upscaled_png_path, "PNG")
-            print("    Альфа-канал успешно восстановлен и сохранен.")
+            result = img_upscaled.convert("RGB")
+            alpha = img_orig.getchannel('A').resize(result.size, Image.Resampling.BICUBIC)
+            if format_name in ("rgba5551", "indexed"):
+                threshold = config.ALPHA_BINARY_THRESHOLD
+                alpha = alpha.point(lambda value: 255 if value >= threshold else 0)
+            result.putalpha(alpha)
+            result.save(upscaled_png_path, "PNG")
+            print(f"    Альфа-канал увеличен локально ({'порог' if format_name in ('rgba5551', 'indexed') else 'плавно'}) и сохранен.")
             return True
     except FileNotFoundError: print(f"    ОШИБКА: Файл не найден при попытке восстановления альфы ({original_png_path} или {upscaled_png_path})."); return False
     except Exception as e: print(f"    ОШИБКА: Не удалось восстановить альфа-канал для {upscaled_png_path.name}: {e}"); return False
@@ -69,16 +177,221 @@ def find_original_pngs():
     print(f"   Найдено {len(original_png_files)} извлеченных PNG файлов для обработки.")
     return sorted(original_png_files)
 
-def initialize_gradio_client(url):
-    """Инициализирует и возвращает клиент Gradio."""
+def initialize_gradio_client(url, fatal=True, token=None):
+    """Инициализирует и возвращает клиент Gradio. При fatal=False возвращает None вместо выхода."""
+    from standin_upscaler import STANDIN_URL_PREFIX, StandInHttpClient
+    if url.startswith(STANDIN_URL_PREFIX):
+        print(f"\n3. Подключение к локальной замене API: {url}")
+        return StandInHttpClient(url)
+    from gradio_client import Client
     print(f"\n3. Подключение к Hugging Face Space: {url}...")
     try:
-        client = Client(url, verbose=False)
+        client = Client(url, hf_token=token, verbose=False) if token else Client(url, verbose=False)
         print("   Подключение успешно.")
         return client
     except Exception as e:
         print(f"КРИТИЧЕСКАЯ ОШИБКА: Не удалось подключиться к {url}. Ошибка: {e}")
+        if fatal:
+            sys.exit(1)
+        return None
+
+def get_upscale_endpoints():
+    """
+    Возвращает список эндпоинтов апскейла [{"url", "token", "weight"}]:
+    Config.UPSCALE_ENDPOINTS или основной и резервные Space (без повторов).
+    """
+    default_token = os.environ.get(config.HF_TOKEN_ENV)
+    if config.UPSCALE_ENDPOINTS:
+        return [{'url': ep['url'], 'token': ep.get('token') or default_token, 'weight': ep.get('weight', 1.0),
+                 'predict_args': ep.get('predict_args', [])}
+                for ep in config.UPSCALE_ENDPOINTS]
+    urls = [config.HF_SPACE_URL]
+    for url in config.HF_SPACE_FALLBACK_URLS:
+        if url not in urls:
+            urls.append(url)
+    return [{'url': url, 'token': default_token, 'weight': 1.0, 'predict_args': []} for url in urls]
+
+def make_endpoint_pool(endpoints):
+    """Создает пул из [Endpoint]; эндпоинты с исчерпанной по сохраненному состоянию квотой сразу выводятся из ротации."""
+    if not any(endpoint.weight > 0 for endpoint in endpoints):
+        print("КРИТИЧЕСКАЯ ОШИБКА: Нет эндпоинтов апскейла с весом > 0 (проверьте UPSCALE_ENDPOINTS).")
         sys.exit(1)
+    pool = EndpointPool(endpoints, failure_threshold=config.ENDPOINT_FAILURE_THRESHOLD,
+                        open_seconds=config.ENDPOINT_OPEN_SECONDS, latency_alpha=config.ENDPOINT_LATENCY_ALPHA)
+    for endpoint in endpoints:
+        wait = quota_state.seconds_until_reset(endpoint.url)
+        if wait > 0:
+            print(f"   Квота {endpoint.url} по сохраненному состоянию восстановится через {wait / 60:.1f} мин.")
+            pool.open_for(endpoint, wait)
+    return pool
+
+def build_endpoint_pool():
+    """Пул эндпоинтов Hugging Face Space; подключение к каждому - при первом запросе."""
+    endpoints = []
+    for ep in get_upscale_endpoints():
+        connect = lambda url=ep['url'], token=ep['token']: initialize_gradio_client(url, fatal=False, token=token)
+        endpoints.append(Endpoint(ep['url'], connect=connect, weight=ep['weight'], predict_args=ep['predict_args']))
+    print(f"\n3. Пул эндпоинтов апскейла: {', '.join(ep.url for ep in endpoints)}")
+    return make_endpoint_pool(endpoints)
+
+def call_endpoint(pool, endpoint, png_path_to_upscale, target_png_path, handle=None, model=None):
+    """Один запрос к эндпоинту: освобождает эндпоинт и учитывает задержку успешного ответа."""
+    start_time = time.time()
+    error_code = None
+    try:
+        upscaled_path, error_code = upscale_image_via_api(endpoint.client, png_path_to_upscale, target_png_path,
+                                                          endpoint.url, endpoint.predict_args, handle, model)
+    finally:
+        pool.release(endpoint, used=error_code != "cancelled")
+    if not error_code:
+        pool.record_success(endpoint, time.time() - start_time)
+    return upscaled_path, error_code
+
+def record_call_error(pool, endpoint, error_code):
+    if error_code == "quota_exceeded":
+        pool.record_quota(endpoint, quota_state.seconds_until_reset(endpoint.url))
+    elif error_code and error_code != "cancelled":
+        pool.record_failure(endpoint)
+
+def hedged_call(pool, endpoint, png_path_to_upscale, target_png_path, model=None):
+    """
+    Запрос с хеджированием: если ответ не пришел за HEDGE_PERCENTILE недавних задержек пула,
+    тот же файл отправляется на другой эндпоинт (в пределах бюджета). Побеждает первый успешный
+    ответ, проигравший запрос отменяется. Каждый запрос пишет во временный файл, победитель
+    переименовывается в target_png_path.
+    Возвращает (путь, код ошибки, эндпоинт) - ошибку эндпоинта, которую должен учесть вызывающий.
+    """
+    hedge_budget.record_request()
+    hedge_delay = pool.latency_percentile(config.HEDGE_PERCENTILE, config.HEDGE_MIN_SAMPLES)
+    if not config.HEDGE_ENABLED or hedge_delay is None or len(pool.endpoints) < 2:
+        upscaled_path, error_code = call_endpoint(pool, endpoint, png_path_to_upscale, target_png_path, model=model)
+        return upscaled_path, error_code, endpoint
+
+    results = queue.Queue()
+    attempts = []
+
+    def launch(attempt_endpoint):
+        index = len(attempts)
+        handle = CallHandle()
+        attempt_path = target_png_path.with_name(f"{target_png_path.name}.hedge{index}")
+        attempts.append((attempt_endpoint, handle, attempt_path))
+
+        def run():
+            upscaled_path, error_code = call_endpoint(pool, attempt_endpoint, png_path_to_upscale, attempt_path, handle, model)
+            with handle.lock:
+                handle.finished = True
+                orphaned = handle.cancelled
+            if orphaned and upscaled_path:
+                upscaled_path.unlink(missing_ok=True)  # Проигравший успел завершиться после отмены
+            results.put((index, upscaled_path, error_code))
+
+        threading.Thread(target=run, name=f"hedge-{png_path_to_upscale.stem}-{index}", daemon=True).start()
+
+    launch(endpoint)
+    outcomes = []
+    try:
+        outcomes.append(results.get(timeout=max(hedge_delay, config.HEDGE_MIN_DELAY)))
+    except queue.Empty:
+        hedge_endpoint = pool.acquire(exclude=endpoint)
+        if hedge_endpoint is not None and not hedge_budget.try_spend():
+            pool.release(hedge_endpoint, used=False)
+            hedge_endpoint = None
+        if hedge_endpoint is not None:
+            print(f"  {png_path_to_upscale.name}: нет ответа за {max(hedge_delay, config.HEDGE_MIN_DELAY):.1f} сек., "
+                  f"дубликат на {hedge_endpoint.url}")
+            launch(hedge_endpoint)
+    while not any(not error_code for _, _, error_code in outcomes) and len(outcomes) < len(attempts):
+        outcomes.append(results.get())
+
+    winner = next((outcome for outcome in outcomes if not outcome[2]), None)
+    if winner is not None:
+        received = {index for index, _, _ in outcomes}
+        for index, (_, handle, attempt_path) in enumerate(attempts):
+            if index not in received:
+                if handle.cancel():
+                    attempt_path.unlink(missing_ok=True)
+                hedge_budget.record('cancelled')
+        os.replace(winner[1], target_png_path)
+        if winner[0] > 0:
+            hedge_budget.record('hedge_wins')
+        for index, _, error_code in outcomes:
+            if index != winner[0]:
+                record_call_error(pool, attempts[index][0], error_code)
+        return target_png_path, None, attempts[winner[0]][0]
+
+    # Все запросы завершились ошибкой: последнюю учтет вызывающий, остальные - здесь
+    for index, _, error_code in outcomes[:-1]:
+        record_call_error(pool, attempts[index][0], error_code)
+    last_index, _, last_error = outcomes[-1]
+    return None, last_error, attempts[last_index][0]
+
+def upscale_with_pool(pool, png_path_to_upscale, target_png_path, wait_on_quota=False, model=None):
+    """
+    Апскейл через пул эндпоинтов: при ошибке повтор на другом (или том же) эндпоинте
+    с нарастающей паузой, при исчерпании квоты - переход на другой эндпоинт.
+    Если все эндпоинты выведены из ротации, ждет их возвращения (для квоты - только при wait_on_quota).
+    model - модель маршрута (по умолчанию TARGET_MODEL_NAME).
+    Возвращает (путь, код ошибки) как upscale_image_via_api.
+    """
+    attempt = 0
+    error_code = "api_other_error"
+    while attempt < config.ENDPOINT_MAX_ATTEMPTS:
+        endpoint = pool.acquire()
+        if endpoint is None:
+            wait = pool.seconds_until_available()
+            reopening = pool.next_reopening()
+            if reopening is None:
+                raise ValueError("В пуле нет эндпоинтов апскейла с весом > 0 (проверьте UPSCALE_ENDPOINTS).")
+            quota_blocked = quota_state.seconds_until_reset(reopening.url) > 0
+            if quota_blocked and not wait_on_quota:
+                print(f"\n   ПРЕДУПРЕЖДЕНИЕ: Квота GPU всех эндпоинтов исчерпана, ближайшее восстановление через {wait / 60:.1f} мин.")
+                return None, "quota_exceeded"
+            if quota_blocked:
+                sleep_until_reset(wait, config.QUOTA_WAIT_MARGIN)
+            else:
+                if wait > pool.probe_poll_seconds:  # Короткое ожидание - завершение пробного запроса, без сообщения
+                    print(f"  Все эндпоинты временно выведены из ротации, ожидание {wait:.0f} сек...")
+                time.sleep(wait)
+            continue
+
+        upscaled_path, error_code, endpoint = hedged_call(pool, endpoint, png_path_to_upscale, target_png_path, model)
+        if not error_code:
+            return upscaled_path, None
+        if error_code == "quota_exceeded":
+            pool.record_quota(endpoint, quota_state.seconds_until_reset(endpoint.url))
+            continue  # Квота не считается попыткой: файл уходит на другой эндпоинт
+
+        pool.record_failure(endpoint)
+        attempt += 1
+        if attempt < config.ENDPOINT_MAX_ATTEMPTS:
+            backoff = min(config.ENDPOINT_BACKOFF_MAX, config.ENDPOINT_BACKOFF_BASE * 2 ** (attempt - 1))
+            backoff *= random.uniform(0.5, 1.0)  # Разброс, чтобы потоки не повторяли запросы одновременно
+            print(f"  Повтор {png_path_to_upscale.name} через {backoff:.1f} сек. (попытка {attempt + 1}/{config.ENDPOINT_MAX_ATTEMPTS})")
+            time.sleep(backoff)
+    return None, error_code
+
+def print_endpoint_stats(pool):
+    print("\nЭндпоинты апскейла:")
+    for endpoint in pool.endpoints:
+        latency = f"{endpoint.latency:.2f} сек." if endpoint.latency is not None else "нет данных"
+        stats = endpoint.stats
+        print(f"  {endpoint.url}: успешно {stats['calls']}, ошибок {stats['failures']}, квота {stats['quota_hits']}, "
+              f"выводов из ротации {stats['opened']}, средняя задержка {latency}")
+    hedges = hedge_budget.stats
+    if hedges['hedges']:
+        print(f"  Дубликатов (хеджирование): {hedges['hedges']} на {hedges['requests']} запросов, "
+              f"выиграли {hedges['hedge_wins']}, отменено проигравших {hedges['cancelled']}")
+
+def get_resume_index(png_files):
+    """Находит позицию в очереди, на которой остановился предыдущий запуск (по сохраненному состоянию)."""
+    if not quota_state.next_file:
+        return 0
+    for i, png_path in enumerate(png_files):
+        if png_path.name == quota_state.next_file:
+            print(f"   Продолжение с сохраненной позиции: {png_path.name} ({i + 1}/{len(png_files)})")
+            return i
+    print(f"   Сохраненная позиция ({quota_state.next_file}) не найдена среди PNG, начинаем сначала.")
+    return 0
 
 def get_original_mat_path(png_stem):
     """Определяет путь к соответствующему исходному MAT файлу."""
@@ -92,15 +405,72 @@ def get_original_mat_path(png_stem):
         original_mat_path = config.USED_MAT_DIR / mat_file_name_to_find
     return original_mat_path, mat_file_name_to_find
 
-def upscale_image_via_api(client, png_path_to_upscale, target_png_path):
-    """Отправляет изображение на апскейл через API, обрабатывает результат."""
+class CallHandle:
+    """
+    Отмена запроса API, проигравшего в хеджировании. Если клиент умеет submit (gradio_client),
+    задача снимается из очереди Space; иначе результат просто отбрасывается.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.job = None
+        self.cancelled = False
+        self.finished = False
+
+    def attach(self, job):
+        with self.lock:
+            self.job = job
+            cancelled = self.cancelled
+        if cancelled:
+            job.cancel()
+
+    def cancel(self) -> bool:
+        """Отменяет запрос. Возвращает True, если он уже завершился (результат нужно удалить вызывающему)."""
+        with self.lock:
+            self.cancelled = True
+            job, finished = self.job, self.finished
+        if job is not None and not finished:
+            try:
+                job.cancel()
+            except Exception:
+                pass
+        return finished
+
+def upscale_image_via_api(client, png_path_to_upscale, target_png_path, endpoint=config.HF_SPACE_URL, predict_args=(),
+                          handle=None, model=None):
+    """
+    Отправляет изображение на апскейл через API, обрабатывает результат.
+    predict_args - дополнительные аргументы API эндпоинта (например, формат результата).
+    model - модель маршрута апскейла (по умолчанию TARGET_MODEL_NAME).
+    handle - CallHandle для отмены запроса (хеджирование); отмененный запрос возвращает код "cancelled".
+    """
+    from PIL import Image
     temp_result_path_str = None
+    model = model or config.TARGET_MODEL_NAME
     try:
         print(f"  Отправка {png_path_to_upscale.name} на апскейл...")
+        if getattr(client, 'accepts_plain_paths', False):
+            file_arg = str(png_path_to_upscale)  # Локальная замена API (standin_upscaler)
+        else:
+            from gradio_client import handle_file
+            file_arg = handle_file(str(png_path_to_upscale))
         start_time = time.time()
-        api_result = client.predict(handle_file(str(png_path_to_upscale)), config.TARGET_MODEL_NAME, api_name=config.API_NAME)
+        if handle is not None and hasattr(client, 'submit'):
+            job = client.submit(file_arg, model, *predict_args, api_name=config.API_NAME)
+            handle.attach(job)
+            api_result = job.result()
+        else:
+            api_result = client.predict(file_arg, model, *predict_args, api_name=config.API_NAME)
         end_time = time.time()
+        if handle is not None and handle.cancelled:
+            return None, "cancelled"
         print(f"  Апскейл завершен за {end_time - start_time:.2f} сек.")
+        with Image.open(png_path_to_upscale) as img:  # Читается только заголовок
+            input_size = img.size
+        with api_stats_lock:
+            api_stats['calls'] += 1
+            api_stats['seconds'] += end_time - start_time
+            api_stats['megapixels'] += input_size[0] * input_size[1] / 1e6
+            api_stats['upload_bytes'] += png_path_to_upscale.stat().st_size
 
         if isinstance(api_result, list) and len(api_result) >= 2 and isinstance(api_result[1], str):
             temp_result_path_str = api_result[1]
@@ -119,6 +489,8 @@ def upscale_image_via_api(client, png_path_to_upscale, target_png_path):
             print(f"  ОШИБКА: API вернул путь ({temp_result_path_str}), но файл не найден.")
             return None, "api_file_not_found"
 
+        with api_stats_lock:
+            api_stats['download_bytes'] += temp_result_path.stat().st_size
         print(f"  Конвертация результата в PNG: {target_png_path.name}")
         with Image.open(temp_result_path) as img:
             img.save(target_png_path, "PNG")
@@ -133,22 +505,31 @@ def upscale_image_via_api(client, png_path_to_upscale, target_png_path):
 
     except Exception as e:
         error_message_lower = str(e).lower()
+        if handle is not None and handle.cancelled:
+            return None, "cancelled"
         if config.QUOTA_ERROR_PHRASE in error_message_lower:
             print(f"\nОШИБКА: Обнаружена проблема с квотой GPU на Hugging Face Space!")
             print(f"  Сообщение API: {e}")
+            reset_at = quota_state.record_hit(endpoint, str(e))
+            print(f"  Ожидаемое восстановление квоты {endpoint}: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reset_at))}")
             return None, "quota_exceeded"
         else:
-            print(f"  ОШИБКА при взаимодействии с API {config.HF_SPACE_URL} или конвертации:")
+            print(f"  ОШИБКА при взаимодействии с API {endpoint} или конвертации:")
             print(f"    {e}")
             if target_png_path.exists():
                 try: target_png_path.unlink()
                 except OSError: pass
             return None, "api_other_error"
 
-def process_single_png(original_extracted_png_path, client):
-    """Полный цикл обработки одного PNG: апскейл, восстановление альфы."""
+def process_single_png(original_extracted_png_path, pool, processed_png_dir=None, wait_on_quota=False):
+    """
+    Полный цикл обработки одного PNG: апскейл, восстановление альфы.
+    processed_png_dir - куда писать результат (по умолчанию PROCESSED_PNG_DIR;
+    воркеры очереди пишут во временную папку и затем атомарно переносят файл).
+    """
+    get_context().track_asset(original_extracted_png_path.name)
     png_stem = original_extracted_png_path.stem
-    processed_png_path = config.PROCESSED_PNG_DIR / f"{png_stem}.png"
+    processed_png_path = (processed_png_dir or config.PROCESSED_PNG_DIR) / f"{png_stem}.png"
     print(f"\nОбработка: {original_extracted_png_path.relative_to(config.EXTRACTED_DIR)}")
 
     if processed_png_path.exists():
@@ -160,44 +541,134 @@ def process_single_png(original_extracted_png_path, client):
         print(f"  ОШИБКА: Исходный файл {mat_file_name_to_find} не найден в {original_mat_path.parent.name}.")
         return "error_mat_not_found"
 
-    upscaled_path, api_error_code = upscale_image_via_api(client, original_extracted_png_path, processed_png_path)
+    # Формат и наличие альфы берем из заголовка MAT (без запуска matool) до отправки на апскейл
+    info_result = read_mat_header(original_mat_path)
+    if info_result['error']:
+        print(f"  ОШИБКА: Не удалось получить инфо из MAT {original_mat_path.name}: {info_result['error']}.")
+        return "error_mat_info_failed"
+    has_alpha = info_result['has_alpha']
+    route = route_for_png(original_extracted_png_path, info_result)
+    with route_counts_lock:
+        route_counts[route['name']] = route_counts.get(route['name'], 0) + 1
+
+    trivial_kind = try_trivial_fast_path(original_extracted_png_path, processed_png_path, route['scale'])
+    if trivial_kind:
+        print(f"  Простая текстура ({trivial_kind}): апскейл выполнен локально, без API.")
+        upscaled_path = processed_png_path
+    elif route['backend'] == "local":
+        print(f"  Маршрут {route['name']}: локальный апскейл x{route['scale']}, без API.")
+        upscale_interpolated(original_extracted_png_path, processed_png_path, route['scale'])
+        upscaled_path = processed_png_path
+    else:
+        if route['name'] != "default":
+            print(f"  Маршрут {route['name']}: модель {route['model']}, x{route['scale']}.")
+        # Для текстур с альфой отправляем только RGB: альфа апскейлится локально
+        payload_path, payload_is_temp = encode_payload(original_extracted_png_path, drop_alpha=has_alpha)
+        try:
+            upscaled_path, api_error_code = upscale_with_pool(pool, payload_path, processed_png_path, wait_on_quota,
+                                                              route['model'])
+        finally:
+            if payload_is_temp:
+                payload_path.unlink(missing_ok=True)
 
-    if api_error_code == "quota_exceeded":
-        return "quota_exceeded"
-    if api_error_code:
-        return "error_api"
+        if api_error_code == "quota_exceeded":
+            return "quota_exceeded"
+        if api_error_code:
+            return "error_api"
 
     if not upscaled_path:
         print("  Критическая ошибка: upscale_image_via_api не вернула путь, но и не код ошибки.")
         return "error_internal"
-
-    # Используем matool.info
-    info_result = matool.info(original_mat_path)
-    if info_result['error']:
-        print(f"  ОШИБКА: Не удалось получить инфо из MAT {original_mat_path.name} после апскейла: {info_result['error']}.")
-        return "error_mat_info_failed"
-
-    has_alpha = info_result['has_alpha']
+    if not trivial_kind and route['backend'] == "api":
+        fit_to_scale(original_extracted_png_path, upscaled_path, route['scale'])
 
     if has_alpha:
         print("  Требуется восстановление альфа-канала...")
-        alpha_restored_ok = restore_alpha(original_extracted_png_path, upscaled_path)
+        alpha_restored_ok = upscale_alpha_locally(original_extracted_png_path, upscaled_path, info_result['format_standardized'])
         if not alpha_restored_ok:
             print(f"  ОШИБКА: Не удалось восстановить альфа-канал для {upscaled_path.name}.")
             return "error_alpha_restore"
 
+    if trivial_kind:
+        return "success_local"
+    if route['backend'] == "local":
+        return "success_routed_local"
+
     if config.API_PAUSE_DURATION > 0:
         print(f"  Пауза {config.API_PAUSE_DURATION} сек...")
         time.sleep(config.API_PAUSE_DURATION)
 
     return "success"
 
+def build_memory_admission():
+    """Допуск задач по памяти: бюджет из Config.MEMORY_BUDGET_MB или доля физической памяти."""
+    if config.MEMORY_BUDGET_MB is not None:
+        budget_bytes = int(config.MEMORY_BUDGET_MB * 2**20)
+    else:
+        total_bytes = total_physical_memory()
+        budget_bytes = int(total_bytes * config.MEMORY_BUDGET_RAM_FRACTION) if total_bytes else None
+    if budget_bytes is None:
+        print("   Бюджет памяти: не ограничен (объем памяти не определен).")
+    else:
+        print(f"   Бюджет памяти для параллельной обработки: {budget_bytes / 2**20:.0f} МБ")
+    return MemoryAdmission(budget_bytes, config.MEMORY_MAX_BYPASS_SECONDS)
+
+def estimate_png_job_bytes(png_path):
+    """Оценка памяти на апскейл PNG по размерам из заголовка (без декодирования)."""
+    size = read_png_size(png_path)
+    if not size:
+        return 0
+    return estimate_image_job_bytes(size[0], size[1], max_scale(), config.MEMORY_COPIES_FACTOR)
+
+def run_upscale_queue(png_queue, pool, workers, wait_on_quota, admission=None):
+    """
+    Обрабатывает очередь PNG в workers потоков. При исчерпании квоты всех эндпоинтов
+    (без wait_on_quota) новые файлы не начинаются. admission ограничивает суммарную
+    оценку памяти одновременно обрабатываемых текстур.
+    Возвращает (status_counts, первый необработанный файл или None).
+    """
+    stop_event = threading.Event()
+    admission = admission or MemoryAdmission(None)
+
+    def work(png_path):
+        if stop_event.is_set():
+            return None
+        footprint = estimate_png_job_bytes(png_path)
+        with admission.reserve(footprint):
+            if stop_event.is_set():
+                return None
+            status = process_single_png(png_path, pool, wait_on_quota=wait_on_quota)
+        if status == "quota_exceeded":
+            stop_event.set()
+        return status
+
+    status_counts = {}
+    stopped_at = None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for png_path, status in zip(png_queue, executor.map(work, png_queue)):
+            if status in (None, "quota_exceeded") and stopped_at is None:
+                stopped_at = png_path
+            if status is not None:
+                status_counts[status] = status_counts.get(status, 0) + 1
+    return status_counts, stopped_at
+
 def print_summary_report_phase2(total_files, status_counts):
     """Печатает итоговый отчет для фазы 2."""
     print("\n--- Скрипт 2 Завершен ---")
     print(f"Всего найдено извлеченных PNG для обработки: {total_files}")
     print(f"Успешно обработано (апскейл+конвертация+альфа): {status_counts.get('success', 0)}")
+    if status_counts.get('success_local', 0) > 0:
+        print(f"Простые текстуры обработаны локально (сэкономлено вызовов API): {status_counts['success_local']}")
+    if status_counts.get('success_routed_local', 0) > 0:
+        print(f"Обработано локально по маршрутам UPSCALE_ROUTES (без API): {status_counts['success_routed_local']}")
+    if len(route_counts) > 1 or (route_counts and "default" not in route_counts):
+        print("Маршруты апскейла: " + ", ".join(f"{name} {count}" for name, count in sorted(route_counts.items())))
     print(f"Пропущено (уже существовали в {config.PROCESSED_PNG_DIR.name}): {status_counts.get('skipped', 0)}")
+    if status_counts.get('quota_exceeded', 0) > 0:
+        print(f"Срабатываний лимита квоты GPU: {status_counts['quota_exceeded']}")
+    if api_stats['calls']:
+        print(f"Трафик API: отправлено {api_stats['upload_bytes'] / 1024:.1f} КБ, получено {api_stats['download_bytes'] / 1024:.1f} КБ "
+              f"за {api_stats['calls']} запросов")
 
     errors_total = sum(v for k, v in status_counts.items() if k.startswith("error_"))
     print(f"Возникло ошибок при обработке: {errors_total}")
@@ -208,7 +679,7 @@ def print_summary_report_phase2(total_files, status_counts):
                  error_desc = {
                      "error_mat_not_found": "Не найден исходный MAT",
                      "error_api": "Ошибка API Hugging Face / Конвертации",
-                     "error_mat_info_failed": "Не удалось получить инфо из MAT после апскейла",
+                     "error_mat_info_failed": "Не удалось прочитать заголовок исходного MAT",
                      "error_alpha_restore": "Ошибка восстановления альфа-канала",
                      "error_internal": "Внутренняя ошибка логики"
                  }.get(status, status)
@@ -217,52 +688,83 @@ def print_summary_report_phase2(total_files, status_counts):
 
     print(f"\nТеперь можно запустить Скрипт для запаковки обработанных PNG из папки {config.PROCESSED_PNG_DIR.name}.")
 
-def main():
+def parse_args_phase2(argv=None):
+    parser = argparse.ArgumentParser(description="Скрипт 2: Апскейл извлеченных PNG через Hugging Face API.")
+    parser.add_argument("--wait-on-quota", action="store_true",
+                        help="При исчерпании квоты GPU всех эндпоинтов ждать её восстановления и продолжать.")
+    parser.add_argument("--workers", type=int, default=config.UPSCALE_WORKERS,
+                        help="Сколько файлов обрабатывать параллельно (запросы распределяются по пулу эндпоинтов).")
+    add_shard_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args_phase2(argv)
+    use_shard_state_files(args.shard)  # Позиция и квота - свои у шарда
+    reset_run_state()
+    if not check_dependencies():
+        print("\nРабота скрипта прервана из-за отсутствия необходимых Python библиотек.")
+        sys.exit(1)
+    route_problems = validate_routes()
+    if route_problems:
+        print("КРИТИЧЕСКАЯ ОШИБКА: Некорректные правила UPSCALE_ROUTES:")
+        for problem in route_problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    start_time = time.time()
     print("\n--- Скрипт 2: Апскейл (Hugging Face API), Конвертация, Альфа ---")
 
     setup_directories_phase2()
-    original_png_files = find_original_pngs()
+    original_png_files = apply_usage(filter_shard(find_original_pngs(), args.shard, "PNG"), "PNG")
     if not original_png_files:
         print("\nРабота скрипта завершена, так как нет файлов для обработки.")
+        save_shard_summary("upscale", args.shard, {'total_files': 0, 'status_counts': {}})
         return
 
-    client = initialize_gradio_client(config.HF_SPACE_URL)
-    if not client:
-        return
-
-    print("\n4. Начало обработки PNG файлов...")
-    status_counts = {}
-
-    for png_path in original_png_files:
-        status = process_single_png(png_path, client)
-        status_counts[status] = status_counts.get(status, 0) + 1
+    start_index = get_resume_index(original_png_files)
+    png_queue = original_png_files[start_index:] + original_png_files[:start_index]
+    pool = build_endpoint_pool()
+    admission = build_memory_admission() if args.workers > 1 else None
 
-        if status == "quota_exceeded":
-            print("\nРабота скрипта прервана из-за ошибки квоты GPU.")
-            break
+    print(f"\n4. Начало обработки PNG файлов (параллельно: {args.workers})...")
+    status_counts, stopped_at = run_upscale_queue(png_queue, pool, args.workers, args.wait_on_quota, admission)
 
+    if stopped_at is None:
+        quota_state.set_position(None)
+    else:
+        quota_state.set_position(stopped_at.name)
+        print("\nРабота скрипта прервана из-за ошибки квоты GPU.")
+        print(f"  Позиция в очереди сохранена ({stopped_at.name}). Запустите скрипт с --wait-on-quota для автоматического продолжения.")
+
+    print_endpoint_stats(pool)
+    if admission is not None and admission.stats['waited_jobs']:
+        stats = admission.stats
+        print(f"Ожидали свободной памяти: {stats['waited_jobs']} задач ({stats['wait_seconds']:.1f} сек.), "
+              f"пик оценки памяти {stats['peak_reserved'] / 2**20:.0f} МБ, крупнее бюджета: {stats['oversized_jobs']}, "
+              f"обогнали ожидающие крупные: {stats['bypassed_jobs']}")
     print_summary_report_phase2(len(original_png_files), status_counts)
+    save_shard_summary("upscale", args.shard, {'total_files': len(original_png_files), 'status_counts': status_counts},
+                       module_state={'api_stats': api_stats, 'route_counts': route_counts})
+    get_context().record_phase("upscale", status_counts, time.time() - start_time)
+    get_context().history.record("upscale_api", api_stats['calls'], api_stats['seconds'], api_stats['megapixels'])
 
 
 def check_dependencies():
-    """Проверяет наличие matool.exe и необходимых библиотек."""
+    """Проверяет наличие matool.exe и необходимых библиотек (без их импорта)."""
     print("Проверка зависимостей...")
-    # matool.exe проверяется при инициализации объекта Tool
-    # Просто выведем сообщение, что он должен быть найден к этому моменту или скрипт бы уже завершился.
-    print(f"  [OK] Matool должен был быть найден (используется {matool.executable_path})")
+    # Если matool.exe не найден, get_context().tool завершит скрипт
+    print(f"  [OK] Matool найден (используется {get_context().tool.executable_path})")
 
-    pillow_ok = 'PIL' in sys.modules
-    gradio_ok = 'gradio_client' in sys.modules
+    from standin_upscaler import STANDIN_URL_PREFIX
+    pillow_ok = importlib.util.find_spec('PIL') is not None
+    needs_gradio = any(not ep['url'].startswith(STANDIN_URL_PREFIX) for ep in get_upscale_endpoints())
+    gradio_ok = importlib.util.find_spec('gradio_client') is not None or not needs_gradio
     if pillow_ok: print("  [OK] Библиотека Pillow найдена.")
     else: print("  [ОШИБКА] Библиотека Pillow не найдена.")
-    if gradio_ok: print("  [OK] Библиотека gradio_client найдена.")
+    if not needs_gradio: print("  [OK] gradio_client не нужен (все эндпоинты - локальная замена API).")
+    elif gradio_ok: print("  [OK] Библиотека gradio_client найдена.")
     else: print("  [ОШИБКА] Библиотека gradio_client не найдена.")
 
     return pillow_ok and gradio_ok
 
 if __name__ == "__main__":
-     if check_dependencies():
-        main()
-     else:
-        print("\nРабота скрипта прервана из-за отсутствия необходимых Python библиотек.")
-        sys.exit(1)
\ No newline at end of file
+     main()
\ No newline at end of file
@@ -1,20 +1,18 @@
 import sys
-import shutil
 import time
+import argparse
 from conf import Config
-from matool import Tool
+from fsutil import display_path
+from context import get_context
+from shard import add_shard_argument, filter_shard, use_shard_state_files, save_shard_summary
+from usage_index import apply_usage
+from used_store import move_to_used
+from mat_format import read_mat_header, has_mip_levels, FORMATS_16BIT
+from verify_mat import compare_mat_to_original
+from upscale_routing import routed_scale
+from texture_budget import prepare_texture_budget, load_texture_plan, planned_size
 
 config = Config()
-try:
-    matool = Tool(
-        primary_exe_path=config.MATOOL_EXE_PRIMARY,
-        cwd=config.BASE_DIR,
-        alternative_exe_path=config.MATOOL_EXE_ALT
-    )
-except FileNotFoundError as e:
-    print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}")
-    print("Работа скрипта прервана из-за отсутствия matool.exe.")
-    sys.exit(1)
 
 def setup_directories_phase3():
     """Проверяет и создает необходимые директории для фазы 3."""
@@ -33,11 +31,11 @@ def setup_directories_phase3():
          sys.exit(1)
     print("   Папки проверены/созданы.")
 
-def find_processed_pngs():
-    """Находит PNG файлы в папке PROCESSED_PNG_DIR."""
+def find_processed_pngs(shard=None):
+    """Находит PNG файлы в папке PROCESSED_PNG_DIR (только своего шарда, если задан)."""
     print(f"\n2. Поиск обработанных PNG файлов в {config.PROCESSED_PNG_DIR.name}...")
     # Ищем PNG, т.к. скрипт 2 сохраняет в PNG. config.VALID_EXTENSIONS может быть шире.
-    processed_png_files = sorted(list(config.PROCESSED_PNG_DIR.glob('*.png')))
+    processed_png_files = apply_usage(filter_shard(sorted(config.PROCESSED_PNG_DIR.glob('*.png')), shard, "PNG"), "PNG")
     if not processed_png_files:
         print(f"   Папка {config.PROCESSED_PNG_DIR.name} пуста. Нет PNG файлов для запаковки.")
         return []
@@ -50,9 +48,9 @@ def check_if_already_packed(final_mat_path, processed_png_path, used_png_target_
         print(f"  Пропуск: Финальный файл {final_mat_path.name} уже существует в {config.FINAL_MAT_DIR.name}.")
         if processed_png_path.exists():
             try:
-                print(f"    Перемещение существующего PNG {processed_png_path.name} -> {used_png_target_path.relative_to(config.BASE_DIR)}...")
+                print(f"    Перемещение существующего PNG {processed_png_path.name} -> {display_path(used_png_target_path)}...")
                 config.USED_DIR.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(processed_png_path), str(used_png_target_path))
+                move_to_used(processed_png_path)
             except OSError as e:
                 print(f"    ПРЕДУПРЕЖДЕНИЕ: Не удалось переместить PNG {processed_png_path.name}: {e}")
         return True
@@ -66,7 +64,7 @@ def get_packing_format_from_original(original_mat_path):
         return None
 
     print(f"  Получение формата из {original_mat_path.name}...")
-    info_result = matool.info(original_mat_path) # Используем matool.info
+    info_result = get_context().mat_info(original_mat_path)
 
     if info_result['error']:
         print(f"  ОШИБКА: Не удалось получить информацию из {original_mat_path.name} для определения формата запаковки.")
@@ -90,7 +88,7 @@ def pack_png_to_mat(std_format, final_mat_path, processed_png_path):
 
     # Используем matool.create
     # matool.create выводит информацию о запуске и stdout/stderr
-    success_flag = matool.create(std_format, final_mat_path, processed_png_path)
+    success_flag = get_context().tool.create(std_format, final_mat_path, processed_png_path)
 
     if not success_flag:
         return False
@@ -108,15 +106,31 @@ def pack_png_to_mat(std_format, final_mat_path, processed_png_path):
     return pack_successful
 
 
+def verify_packed_mat(final_mat_path, original_mat_path):
+    """Сверяет заголовок созданного MAT с исходным (формат, кол-во текстур, размеры)."""
+    final_info = read_mat_header(final_mat_path)
+    original_info = read_mat_header(original_mat_path)
+    problems = [info['error'] for info in (final_info, original_info) if info['error']]
+    if not problems:
+        problems = compare_mat_to_original(final_info, original_info, scale=routed_scale(final_mat_path.stem),
+                                           allowed_size=planned_size(load_texture_plan(), final_mat_path.stem))
+    if problems:
+        print(f"  ОШИБКА: Созданный {final_mat_path.name} не прошел проверку: {'; '.join(problems)}")
+        try: final_mat_path.unlink(missing_ok=True); print(f"    Некорректный файл {final_mat_path.name} удален.")
+        except OSError: pass
+        return False
+    print(f"    Проверка заголовка нового MAT пройдена.")
+    return True
+
 def cleanup_after_packing(processed_png_path, used_png_target_path, std_format, base_name):
     """Перемещает использованный PNG и удаляет оригинальный извлеченный PNG."""
     print("  Запаковка и перемещение нового файла прошли успешно. Начинаем очистку...")
     cleanup_error = False
     try:
         if processed_png_path.exists():
-            print(f"    Перемещение обработанного PNG: {processed_png_path.name} -> {used_png_target_path.relative_to(config.BASE_DIR)}...")
+            print(f"    Перемещение обработанного PNG: {processed_png_path.name} -> {display_path(used_png_target_path)}...")
             config.USED_DIR.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(processed_png_path), str(used_png_target_path))
+            move_to_used(processed_png_path)
         else:
             print(f"    ПРЕДУПРЕЖДЕНИЕ: Обработанный PNG {processed_png_path.name} не найден для перемещения.")
 
@@ -125,7 +139,7 @@ def cleanup_after_packing(processed_png_path, used_png_target_path, std_format,
             if original_format_dir and original_format_dir.exists():
                 original_extracted_png_path = original_format_dir / f"{base_name}.png"
                 if original_extracted_png_path.exists():
-                    print(f"    Удаление оригинального извлеченного PNG: {original_extracted_png_path.relative_to(config.BASE_DIR)}...")
+                    print(f"    Удаление оригинального извлеченного PNG: {display_path(original_extracted_png_path)}...")
                     try:
                         original_extracted_png_path.unlink()
                     except OSError as e:
@@ -157,7 +171,14 @@ def process_single_png_for_packing(processed_png_path):
     if std_format is None:
         return "error_format"
 
-    pack_ok = pack_png_to_mat(std_format, final_mat_path, processed_png_path)
+    if std_format == "indexed":
+        from indexed_mat import write_indexed_mat  # NumPy нужен только для палитровых MAT
+        pack_ok = write_indexed_mat(original_mat_path, final_mat_path, [processed_png_path])
+    elif std_format in FORMATS_16BIT and config.PACK_LOCAL_MIPMAPS and has_mip_levels(read_mat_header(original_mat_path)):
+        from native_pack import write_mat_with_mips  # Mip-уровни строятся из одного апскейленного уровня
+        pack_ok = write_mat_with_mips(original_mat_path, final_mat_path, [processed_png_path])
+    else:
+        pack_ok = pack_png_to_mat(std_format, final_mat_path, processed_png_path)
 
     if not pack_ok:
         # Проверяем, не остался ли .mat в config.BASE_DIR (маловероятно с прямым путем в matool.create)
@@ -166,6 +187,9 @@ def process_single_png_for_packing(processed_png_path):
             print(f"  ПРЕДУПРЕЖДЕНИЕ: Обнаружен MAT файл ({lingering_mat_in_base.name}) в {config.BASE_DIR.name} после неудачной запаковки. Возможно, его стоит удалить или переместить вручную.")
         return "error_packing"
 
+    if not verify_packed_mat(final_mat_path, original_mat_path):
+        return "error_verification"
+
     cleanup_ok = cleanup_after_packing(processed_png_path, used_png_target_path, std_format, base_name)
     if not cleanup_ok:
         return "success_with_cleanup_issue"
@@ -182,7 +206,8 @@ def print_summary_report_phase3(total_files, status_counts):
     skipped_count = status_counts.get('skipped', 0)
     error_format_count = status_counts.get('error_format', 0)
     error_packing_count = status_counts.get('error_packing', 0)
-    total_errors = error_format_count + error_packing_count
+    error_verification_count = status_counts.get('error_verification', 0)
+    total_errors = error_format_count + error_packing_count + error_verification_count
 
     print(f"Успешно запаковано и очищено: {success_count}")
     if success_cleanup_issue > 0:
@@ -193,6 +218,7 @@ def print_summary_report_phase3(total_files, status_counts):
         print("  Детали ошибок:")
         if error_format_count > 0: print(f"    - Ошибка получения/валидации формата: {error_format_count}")
         if error_packing_count > 0: print(f"    - Ошибка запаковки/перемещения нового MAT: {error_packing_count}")
+        if error_verification_count > 0: print(f"    - Ошибка проверки созданного MAT (файл удален): {error_verification_count}")
         print("  Просмотрите лог выше для информации по конкретным файлам.")
 
     print(f"\nФинальные MAT файлы находятся в: {config.FINAL_MAT_DIR.name}")
@@ -210,22 +236,35 @@ def print_summary_report_phase3(total_files, status_counts):
         print(f"  Примеры: {[f.name for f in lingering_mats[:5]]}")
 
 
-def main():
+def parse_args_phase3(argv=None):
+    parser = argparse.ArgumentParser(description="Скрипт 3: Запаковка PNG в MAT.")
+    add_shard_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args_phase3(argv)
+    use_shard_state_files(args.shard)
+    start_time = time.time()
     print("\n--- Скрипт 3: Запаковка PNG в MAT ---")
     setup_directories_phase3()
-    processed_png_files = find_processed_pngs()
+    prepare_texture_budget(args.shard)
+    processed_png_files = find_processed_pngs(args.shard)
     if not processed_png_files:
         print("\nРабота скрипта завершена, так как нет файлов для обработки.")
+        save_shard_summary("pack", args.shard, {'total_files': 0, 'status_counts': {}})
         return
 
     print("\n3. Начало запаковки файлов...")
     status_counts = {}
 
     for png_path in processed_png_files:
+        get_context().track_asset(png_path.name)
         status = process_single_png_for_packing(png_path)
         status_counts[status] = status_counts.get(status, 0) + 1
 
     print_summary_report_phase3(len(processed_png_files), status_counts)
+    save_shard_summary("pack", args.shard, {'total_files': len(processed_png_files), 'status_counts': status_counts})
+    get_context().record_phase("pack", status_counts, time.time() - start_time)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
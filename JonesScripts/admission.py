@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+
+def total_physical_memory() -> int | None:
+    """Объем физической памяти в байтах (None, если определить не удалось)."""
+    if sys.platform == 'win32':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+        return None
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def estimate_image_job_bytes(width: int, height: int, scale: int, copies: float) -> int:
+    """
+    Оценка пиковой памяти обработки одной текстуры: исходник и результат апскейла в RGBA
+    (4 байта на пиксель), умноженные на число одновременных копий (декодирование, convert, альфа, кодирование).
+    """
+    source_bytes = width * height * 4
+    result_bytes = source_bytes * scale * scale
+    return int((source_bytes + result_bytes) * copies)
+
+
+class MemoryAdmission:
+    """
+    Допуск задач по памяти: задача с оценкой footprint байт начинается, только если
+    она помещается в бюджет вместе с уже выполняющимися. Мелкая задача, которая помещается
+    в свободную память, обгоняет ожидающие впереди крупные, пока самая старая из них ждет
+    меньше max_bypass_seconds; после этого обгоны прекращаются и память освобождается
+    под нее (крупная задача не голодает). Задача больше всего бюджета выполняется одна.
+    budget_bytes=None - без ограничений.
+    """
+    def __init__(self, budget_bytes: int | None, max_bypass_seconds: float = 30.0):
+        self.budget_bytes = budget_bytes
+        self.max_bypass_seconds = max_bypass_seconds
+        self.condition = threading.Condition()
+        self.reserved = 0
+        self.running = 0
+        self.waiting = []  # [билет, время постановки] ожидающих задач в порядке поступления
+        self.next_ticket = 0
+        self.stats = {'jobs': 0, 'waited_jobs': 0, 'wait_seconds': 0.0, 'peak_reserved': 0, 'oversized_jobs': 0,
+                      'bypassed_jobs': 0}
+
+    def _fits(self, footprint):
+        return self.running == 0 or self.reserved + footprint <= self.budget_bytes
+
+    def _may_start(self, ticket, footprint):
+        if not self._fits(footprint):
+            return False
+        oldest_ticket, oldest_since = self.waiting[0]
+        return oldest_ticket == ticket or time.perf_counter() - oldest_since < self.max_bypass_seconds
+
+    def acquire(self, footprint: int):
+        with self.condition:
+            self.stats['jobs'] += 1
+            if self.budget_bytes is not None:
+                if footprint > self.budget_bytes:
+                    self.stats['oversized_jobs'] += 1
+                ticket = self.next_ticket
+                self.next_ticket += 1
+                start_time = time.perf_counter()
+                self.waiting.append((ticket, start_time))
+                while not self._may_start(ticket, footprint):
+                    self.condition.wait()
+                if self.waiting[0][0] != ticket:
+                    self.stats['bypassed_jobs'] += 1
+                self.waiting.remove((ticket, start_time))
+                waited = time.perf_counter() - start_time
+                if waited > 0.001:
+                    self.stats['waited_jobs'] += 1
+                    self.stats['wait_seconds'] += waited
+                self.condition.notify_all()  # Следующий в очереди может тоже поместиться
+            self.reserved += footprint
+            self.running += 1
+            self.stats['peak_reserved'] = max(self.stats['peak_reserved'], self.reserved)
+
+    def release(self, footprint: int):
+        with self.condition:
+            self.reserved -= footprint
+            self.running -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, footprint: int):
+        self.acquire(footprint)
+        try:
+            yield
+        finally:
+            self.release(footprint)
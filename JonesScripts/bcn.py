@@ -0,0 +1,208 @@
+import numpy as np
+
+# Блочное сжатие BCn (BC1, BC3, BC7) на NumPy: все блоки 4x4 изображения кодируются одной
+# серией векторных операций. Конечные точки - по главной оси цветов блока (PCA степенным методом)
+# с одним уточнением методом наименьших квадратов, индексы - ближайший цвет палитры.
+# BC7 кодируется только в режиме 6 (одна пара RGBA конечных точек, 4-битные индексы):
+# это корректный BC7, который читают все декодеры, без перебора режимов и разбиений.
+
+BLOCK_BYTES = {"bc1": 8, "bc3": 16, "bc7": 16}
+
+_BC1_WEIGHTS = np.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=np.float32)  # Вес color0 для индексов 0..3
+_BC3_ALPHA_WEIGHTS = np.array([7, 0, 6, 5, 4, 3, 2, 1], dtype=np.float32) / 7.0  # Вес alpha0 для индексов 0..7
+_BC7_WEIGHTS = np.array([0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64], dtype=np.int32)
+_CHUNK_BLOCKS = 8192  # Блоков за шаг при поиске индексов (ограничивает память)
+
+
+def image_to_blocks(pixels: np.ndarray) -> tuple[np.ndarray, int, int]:
+    """RGBA (H x W x 4, uint8) -> блоки (N x 16 x 4) построчно; края дополняются повтором пикселей."""
+    height, width = pixels.shape[:2]
+    blocks_y, blocks_x = (height + 3) // 4, (width + 3) // 4
+    padded = np.pad(pixels, ((0, blocks_y * 4 - height), (0, blocks_x * 4 - width), (0, 0)), mode='edge')
+    blocks = padded.reshape(blocks_y, 4, blocks_x, 4, 4).transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4)
+    return blocks, blocks_x, blocks_y
+
+
+def _principal_endpoints(values: np.ndarray, iterations: int = 4) -> tuple[np.ndarray, np.ndarray]:
+    """Концы отрезка главной оси значений блока (N x 16 x C) -> (N x C, N x C)."""
+    mean = values.mean(axis=1, keepdims=True)
+    centered = values - mean
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    axis = values.max(axis=1) - values.min(axis=1)
+    axis[~axis.any(axis=1)] = 1.0
+    for _ in range(iterations):
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        norm = np.linalg.norm(axis, axis=1, keepdims=True)
+        axis = np.where(norm > 1e-6, axis / np.maximum(norm, 1e-6), 1.0 / np.sqrt(values.shape[2]))
+    projection = np.einsum('nki,ni->nk', centered, axis)
+    start = mean[:, 0] + axis * projection.max(axis=1, keepdims=True)
+    end = mean[:, 0] + axis * projection.min(axis=1, keepdims=True)
+    return np.clip(start, 0, 255), np.clip(end, 0, 255)
+
+
+def _nearest(values: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    """Индекс ближайшего цвета палитры (N x P x C) для каждого значения (N x 16 x C), по частям."""
+    indices = np.empty(values.shape[:2], dtype=np.int64)
+    for start in range(0, values.shape[0], _CHUNK_BLOCKS):
+        part = slice(start, start + _CHUNK_BLOCKS)
+        distances = ((values[part, :, None, :] - palette[part, None, :, :]) ** 2).sum(axis=3)
+        indices[part] = distances.argmin(axis=2)
+    return indices
+
+
+def _refit(values: np.ndarray, weights: np.ndarray, start: np.ndarray, end: np.ndarray):
+    """Наименьшие квадраты для концов: value ~ w * start + (1 - w) * end при известных весах w (N x 16)."""
+    w, v = weights, 1.0 - weights
+    ww, vv, wv = (w * w).sum(1), (v * v).sum(1), (w * v).sum(1)
+    wx, vx = np.einsum('nk,nkc->nc', w, values), np.einsum('nk,nkc->nc', v, values)
+    det = ww * vv - wv * wv
+    ok = np.abs(det) > 1e-6
+    safe = np.where(ok, det, 1.0)[:, None]
+    new_start = (vv[:, None] * wx - wv[:, None] * vx) / safe
+    new_end = (ww[:, None] * vx - wv[:, None] * wx) / safe
+    return (np.where(ok[:, None], np.clip(new_start, 0, 255), start),
+            np.where(ok[:, None], np.clip(new_end, 0, 255), end))
+
+
+def _to_565(colors: np.ndarray) -> np.ndarray:
+    r = np.rint(colors[:, 0] * 31 / 255).astype(np.uint16)
+    g = np.rint(colors[:, 1] * 63 / 255).astype(np.uint16)
+    b = np.rint(colors[:, 2] * 31 / 255).astype(np.uint16)
+    return (r << 11) | (g << 5) | b
+
+
+def _from_565(packed: np.ndarray) -> np.ndarray:
+    r, g, b = (packed >> 11) & 31, (packed >> 5) & 63, packed & 31
+    return np.stack([(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=1).astype(np.float32)
+
+
+def _color_block(rgb: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Цветовая часть BC1/BC3 (4-цветный режим): (color0, color1, 32-битные индексы)."""
+    start, end = _principal_endpoints(rgb)
+    for refine in range(2):
+        color0, color1 = _to_565(start), _to_565(end)
+        swap = color0 < color1
+        color0, color1 = np.where(swap, color1, color0), np.where(swap, color0, color1)
+        c0, c1 = _from_565(color0), _from_565(color1)
+        palette = c0[:, None, :] * _BC1_WEIGHTS[None, :, None] + c1[:, None, :] * (1 - _BC1_WEIGHTS)[None, :, None]
+        indices = _nearest(rgb, palette)
+        if refine == 0:
+            start, end = _refit(rgb, _BC1_WEIGHTS[indices], c0, c1)
+    indices[color0 == color1] = 0  # Один цвет: 3-цветный режим, индекс 0 - сам цвет
+    shifts = (2 * np.arange(16)).astype(np.uint32)
+    packed_indices = (indices.astype(np.uint32) << shifts).sum(axis=1, dtype=np.uint64).astype(np.uint32)
+    return color0, color1, packed_indices
+
+
+def encode_bc1(pixels: np.ndarray) -> bytes:
+    """RGB(A) (H x W x C, uint8) -> данные BC1 (альфа не сохраняется)."""
+    blocks, _, _ = image_to_blocks(_as_rgba(pixels))
+    color0, color1, indices = _color_block(blocks[..., :3].astype(np.float32))
+    out = np.empty(blocks.shape[0], dtype=[('c0', '<u2'), ('c1', '<u2'), ('i', '<u4')])
+    out['c0'], out['c1'], out['i'] = color0, color1, indices
+    return out.tobytes()
+
+
+def encode_bc3(pixels: np.ndarray) -> bytes:
+    """RGBA (H x W x 4, uint8) -> данные BC3: 8-уровневый блок альфы и цвет как в BC1."""
+    blocks, _, _ = image_to_blocks(_as_rgba(pixels))
+    alpha = blocks[..., 3].astype(np.float32)
+    alpha0, alpha1 = alpha.max(axis=1), alpha.min(axis=1)
+    palette = alpha0[:, None] * _BC3_ALPHA_WEIGHTS[None, :] + alpha1[:, None] * (1 - _BC3_ALPHA_WEIGHTS)[None, :]
+    alpha_indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=2).astype(np.uint64)
+    alpha_indices[alpha0 == alpha1] = 0
+    alpha_bits = (alpha_indices << (3 * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    color0, color1, indices = _color_block(blocks[..., :3].astype(np.float32))
+
+    out = np.empty(blocks.shape[0], dtype=[('a0', 'u1'), ('a1', 'u1'), ('ai', 'u1', 6),
+                                           ('c0', '<u2'), ('c1', '<u2'), ('i', '<u4')])
+    out['a0'], out['a1'] = alpha0.astype(np.uint8), alpha1.astype(np.uint8)
+    out['ai'] = ((alpha_bits[:, None] >> (8 * np.arange(6, dtype=np.uint64))) & 0xFF).astype(np.uint8)
+    out['c0'], out['c1'], out['i'] = color0, color1, indices
+    return out.tobytes()
+
+
+def _put_bits(low, high, offset, width, values):
+    """Записывает поле width бит со смещением offset в 128-битные блоки (low, high)."""
+    values = values.astype(np.uint64)
+    if offset + width <= 64:
+        low |= values << np.uint64(offset)
+    elif offset >= 64:
+        high |= values << np.uint64(offset - 64)
+    else:
+        low_width = 64 - offset
+        low |= (values & np.uint64((1 << low_width) - 1)) << np.uint64(offset)
+        high |= values >> np.uint64(low_width)
+
+
+def _quantize_bc7_endpoint(endpoint: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Конечная точка RGBA (N x 4) -> (7-битные значения N x 4, p-бит N) с минимальной ошибкой."""
+    best_q, best_p, best_error = None, None, None
+    for p in (0, 1):
+        q = np.clip(np.rint((endpoint - p) / 2), 0, 127)
+        error = ((q * 2 + p - endpoint) ** 2).sum(axis=1)
+        if best_error is None:
+            best_q, best_p, best_error = q, np.zeros(len(q), dtype=np.int32), error
+        else:
+            better = error < best_error
+            best_q = np.where(better[:, None], q, best_q)
+            best_p = np.where(better, 1, best_p)
+            best_error = np.minimum(error, best_error)
+    return best_q.astype(np.int32), best_p
+
+
+def encode_bc7(pixels: np.ndarray) -> bytes:
+    """RGBA (H x W x 4, uint8) -> данные BC7 (режим 6)."""
+    blocks, _, _ = image_to_blocks(_as_rgba(pixels))
+    values = blocks.astype(np.float32)
+    start, end = _principal_endpoints(values)
+    weights = _BC7_WEIGHTS.astype(np.float32) / 64.0
+    for refine in range(2):
+        q0, p0 = _quantize_bc7_endpoint(start)
+        q1, p1 = _quantize_bc7_endpoint(end)
+        e0, e1 = (q0 << 1) | p0[:, None], (q1 << 1) | p1[:, None]
+        palette = (((64 - _BC7_WEIGHTS)[None, :, None] * e0[:, None, :]
+                    + _BC7_WEIGHTS[None, :, None] * e1[:, None, :] + 32) >> 6).astype(np.float32)
+        indices = _nearest(values, palette)
+        if refine == 0:
+            # _refit подбирает value ~ w * start + (1 - w) * end, здесь вес у конца 0 - (1 - weight)
+            start, end = _refit(values, 1.0 - weights[indices], e0.astype(np.float32), e1.astype(np.float32))
+
+    # Старший бит индекса первого пикселя не хранится (должен быть 0): иначе меняем концы местами
+    flip = indices[:, 0] >= 8
+    q0, q1 = np.where(flip[:, None], q1, q0), np.where(flip[:, None], q0, q1)
+    p0, p1 = np.where(flip, p1, p0), np.where(flip, p0, p1)
+    indices = np.where(flip[:, None], 15 - indices, indices)
+
+    count = blocks.shape[0]
+    low, high = np.zeros(count, dtype=np.uint64), np.zeros(count, dtype=np.uint64)
+    _put_bits(low, high, 0, 7, np.full(count, 1 << 6))  # Режим 6: шесть нулевых бит и единица
+    offset = 7
+    for channel in range(4):
+        for q in (q0, q1):
+            _put_bits(low, high, offset, 7, q[:, channel])
+            offset += 7
+    _put_bits(low, high, offset, 1, p0)
+    _put_bits(low, high, offset + 1, 1, p1)
+    offset += 2
+    _put_bits(low, high, offset, 3, indices[:, 0])
+    offset += 3
+    for pixel in range(1, 16):
+        _put_bits(low, high, offset, 4, indices[:, pixel])
+        offset += 4
+    return np.stack([low, high], axis=1).astype('<u8').tobytes()
+
+
+def _as_rgba(pixels: np.ndarray) -> np.ndarray:
+    if pixels.ndim == 2:
+        pixels = np.repeat(pixels[..., None], 3, axis=2)
+    if pixels.shape[2] == 3:
+        pixels = np.concatenate([pixels, np.full(pixels.shape[:2] + (1,), 255, dtype=np.uint8)], axis=2)
+    return pixels
+
+
+ENCODERS = {"bc1": encode_bc1, "bc3": encode_bc3, "bc7": encode_bc7}
+
+
+def encode_blocks(pixels: np.ndarray, fmt: str) -> bytes:
+    return ENCODERS[fmt](pixels)
@@ -0,0 +1,268 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from conf import Config
+
+config = Config()
+
+# Сквозной замер производительности конвейера без сети, matool и Windows:
+# генерируется корпус MAT (16-битные и палитровые, часть - CEL и с mip-уровнями), поднимаются локальные
+# HTTP-замены API (standin_upscaler.StandInServer) с задержкой, разбросом, ошибками и ошибками квоты,
+# и все фазы выполняются в отдельном процессе с MAT_TOOL_BACKEND = "python" (native_tool.NativeTool).
+# Результат (ассетов/сек., вызовов API на ассет, пик RSS процесса конвейера) сравнивается с базовым
+# замером BENCH_BASELINE_PATH; ухудшение больше BENCH_TOLERANCE - код выхода 1.
+
+CORPUS_FORMATS = ("rgb565", "rgba4444", "rgba5551", "indexed")
+CORPUS_SIZES = ((8, 0.1), (16, 0.3), (32, 0.4), (64, 0.2))  # сторона текстуры, доля
+PIPELINE_STEPS = ["extract", "cel-extract", "upscale", "--wait-on-quota", "--workers", "{workers}",
+                  "pack", "cel-pack", "verify"]
+# Метрика -> лучше "higher" или "lower"
+METRICS = {'assets_per_sec': 'higher', 'api_calls_per_asset': 'lower', 'peak_rss_mb': 'lower'}
+CHILD_FLAG = "--child"
+
+
+def texture_pixels(rng, width, height, solid):
+    """RGBA текстура: плавный шум (не проходит как простая текстура) или заливка (локальный апскейл)."""
+    import numpy as np
+    from PIL import Image
+    if solid:
+        return np.broadcast_to(rng.integers(0, 256, 4, dtype=np.uint8), (height, width, 4)).copy()
+    coarse = rng.integers(0, 256, (max(2, height // 4), max(2, width // 4), 4), dtype=np.uint8)
+    pixels = np.asarray(Image.fromarray(coarse, "RGBA").resize((width, height), Image.Resampling.BILINEAR)).astype(np.int16)
+    pixels += rng.integers(-12, 13, pixels.shape, dtype=np.int16)
+    pixels[..., 3] = np.where(pixels[..., 3] > 64, 255, 0)  # Альфа: отдельные прозрачные участки
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def encode_corpus_texture(rng, std_format, width, height, mipmap_count, solid):
+    """(width, height, [данные mip-уровней]) текстуры корпуса в формате std_format."""
+    import numpy as np
+    from imageutil import build_mip_chain
+    from mat_format import mip_sizes, new_color_format
+    from native_pack import encode_pixels_16
+    sizes = mip_sizes(width, height, mipmap_count)
+    if std_format == "indexed":
+        indices = np.full((height, width), rng.integers(1, 256), np.uint8) if solid else \
+            rng.integers(1, 256, (height, width), dtype=np.uint8)
+        return width, height, [np.ascontiguousarray(indices[::height // h, ::width // w]).tobytes() for w, h in sizes]
+    levels = build_mip_chain(texture_pixels(rng, width, height, solid), sizes)
+    return width, height, [encode_pixels_16(level, new_color_format(std_format)) for level in levels]
+
+
+def generate_corpus(mat_dir: Path, count: int, cel_fraction: float, seed: int) -> dict:
+    """Пишет count MAT и палитру palette.cmp в mat_dir. Возвращает состав корпуса."""
+    import numpy as np
+    from mat_format import write_new_mat
+    rng = np.random.default_rng(seed)
+    mat_dir.mkdir(parents=True, exist_ok=True)
+    palette = rng.integers(0, 256, (256, 3), dtype=np.uint8)
+    (mat_dir / "palette.cmp").write_bytes(b'CMP ' + bytes(60) + palette.tobytes() + bytes(256 * 64))
+
+    sides, weights = zip(*CORPUS_SIZES)
+    stats = {'mats': count, 'cel_mats': 0, 'textures': 0, 'formats': {}}
+    for index in range(count):
+        std_format = CORPUS_FORMATS[index % len(CORPUS_FORMATS)]
+        width = int(rng.choice(sides, p=weights))
+        height = width // 2 if rng.random() < 0.25 and width > 8 else width
+        frames = int(rng.integers(2, 6)) if rng.random() < cel_fraction else 1
+        mipmap_count = int(rng.integers(2, 4)) if std_format != "indexed" and height >= 16 and rng.random() < 0.3 else 1
+        solid = rng.random() < 0.05
+        textures = [encode_corpus_texture(rng, std_format, width, height, mipmap_count, solid) for _ in range(frames)]
+        write_new_mat(mat_dir / f"bench_{index:05d}.mat", std_format, textures, transparent=std_format in ("rgba4444", "rgba5551"))
+        stats['cel_mats'] += frames > 1
+        stats['textures'] += frames
+        stats['formats'][std_format] = stats['formats'].get(std_format, 0) + 1
+    return stats
+
+
+def start_standin_servers(count: int, spec: str) -> list:
+    from standin_upscaler import StandInServer, make_standin_client
+    servers = []
+    for index in range(count):
+        # У каждого эндпоинта свой генератор случайных чисел, но воспроизводимый при заданном seed
+        client = make_standin_client(spec)
+        client.random.seed(f"{spec}/{index}")
+        client.name = f"stand-in #{index + 1}"
+        servers.append(StandInServer(client).start())
+    return servers
+
+
+def run_child(steps: list[str]):
+    """Процесс конвейера: настройки для замены API и встроенного MAT tool, затем фазы как в jones.py."""
+    Config.MAT_TOOL_BACKEND = "python"
+    Config.UPSCALE_ENDPOINTS = [{'url': url} for url in os.environ["JONES_BENCH_ENDPOINTS"].split(',')]
+    Config.API_PAUSE_DURATION = 0
+    Config.QUOTA_WAIT_MARGIN = 0
+    Config.ENDPOINT_BACKOFF_BASE = 0.05
+    Config.ENDPOINT_BACKOFF_MAX = 1.0
+    Config.ENDPOINT_OPEN_SECONDS = 1
+    import jones
+    jones.main(steps)
+
+
+def run_pipeline(work_dir: Path, endpoints: list[str], workers: int) -> tuple[int, float, float]:
+    """Запускает фазы в отдельном процессе. Возвращает (код выхода, время, пик RSS в МБ)."""
+    env = dict(os.environ, JONES_BASE_DIR=str(work_dir / "mat"), JONES_SCRATCH_DIR=str(work_dir / "scratch"),
+               JONES_DURABLE_DIR=str(work_dir / "durable"), JONES_MAT_TOOL="python",
+               JONES_BENCH_ENDPOINTS=",".join(endpoints))
+    steps = [step.format(workers=workers) for step in PIPELINE_STEPS]
+    log_path = work_dir / "pipeline.log"
+    start_time = time.time()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        returncode = subprocess.run([sys.executable, str(Path(__file__).resolve()), CHILD_FLAG, *steps],
+                                    stdout=log, stderr=subprocess.STDOUT, env=env, cwd=Path(__file__).parent).returncode
+    elapsed = time.time() - start_time
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024  # На Linux - в КБ
+    return returncode, elapsed, peak_rss_mb
+
+
+def read_phase_times(work_dir: Path) -> dict:
+    try:
+        manifest = json.loads((work_dir / "durable" / "run_manifest.json").read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    return {phase['phase']: phase['elapsed_seconds'] for phase in manifest.get('phases', [])}
+
+
+def compare_to_baseline(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Ухудшения относительно базового замера больше tolerance (пустой список - регрессии нет)."""
+    problems = []
+    for metric, better in METRICS.items():
+        old, new = baseline['metrics'].get(metric), result['metrics'][metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        if (better == 'higher' and change < -tolerance) or (better == 'lower' and change > tolerance):
+            problems.append(f"{metric}: {new:.3f} против {old:.3f} в базовом замере ({change:+.1%}, допуск {tolerance:.0%})")
+    if result['completed'] < baseline.get('completed', result['completed']):
+        problems.append(f"готовых MAT {result['completed']} против {baseline['completed']} в базовом замере")
+    return problems
+
+
+def print_summary_report_bench(result, baseline, problems):
+    metrics = result['metrics']
+    corpus = result['corpus']
+    print("\n--- Сквозной замер конвейера ---")
+    print(f"Корпус: {corpus['mats']} MAT ({corpus['cel_mats']} CEL, текстур {corpus['textures']}), "
+          f"форматы: {', '.join(f'{name} {count}' for name, count in sorted(corpus['formats'].items()))}")
+    print(f"Замена API: {result['params']['standin']}, эндпоинтов {result['params']['endpoints']}, "
+          f"потоков {result['params']['workers']}")
+    print(f"Время: {result['elapsed']:.1f} сек., готовых MAT: {result['completed']} из {corpus['mats']}, "
+          f"код выхода конвейера: {result['returncode']}")
+    for phase, seconds in result['phases'].items():
+        print(f"  {phase:<12} {seconds if seconds is not None else '-'} сек.")
+    api = result['api']
+    print(f"Запросов к API: {api['requests']} (успешных {api['success']}, ошибок {api['error']}, квота {api['quota']})")
+    print(f"Ассетов/сек.: {metrics['assets_per_sec']:.2f}, вызовов API на ассет: {metrics['api_calls_per_asset']:.2f}, "
+          f"пик RSS: {metrics['peak_rss_mb']:.0f} МБ")
+    if baseline is not None:
+        for metric in METRICS:
+            old = baseline['metrics'].get(metric)
+            if old:
+                print(f"  {metric}: базовый {old:.3f}, сейчас {metrics[metric]:.3f} ({(metrics[metric] - old) / old:+.1%})")
+    if problems:
+        print("ПРОБЛЕМЫ:")
+        for problem in problems:
+            print(f"  - {problem}")
+    elif baseline is not None:
+        print("Регрессий относительно базового замера нет.")
+    else:
+        print("СРАВНЕНИЕ НЕ ВЫПОЛНЕНО: нет подходящего базового замера, регрессии по метрикам не проверялись.")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == [CHILD_FLAG]:
+        run_child(argv[1:])
+        return
+    parser = argparse.ArgumentParser(description="Сквозной замер конвейера на сгенерированном корпусе с локальной заменой API.")
+    parser.add_argument("--assets", type=int, default=config.BENCH_ASSETS, help="Сколько MAT сгенерировать.")
+    parser.add_argument("--cel-fraction", type=float, default=config.BENCH_CEL_FRACTION, help="Доля CEL MAT.")
+    parser.add_argument("--standin", default=config.BENCH_STANDIN,
+                        help="Задержки и ошибки замены API (как в upscale_worker --standin).")
+    parser.add_argument("--endpoints", type=int, default=config.BENCH_ENDPOINTS, help="Сколько серверов замены API.")
+    parser.add_argument("--workers", type=int, default=config.BENCH_WORKERS, help="Потоков апскейла (--workers Скрипта 2).")
+    parser.add_argument("--seed", type=int, default=1, help="Seed генерации корпуса.")
+    parser.add_argument("--tolerance", type=float, default=config.BENCH_TOLERANCE, help="Допустимое ухудшение (доля).")
+    parser.add_argument("--baseline", type=Path, default=config.BENCH_BASELINE_PATH, help="Файл базового замера.")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить результат как базовый замер.")
+    parser.add_argument("--require-baseline", action="store_true",
+                        help="Считать отсутствие подходящего базового замера ошибкой (код выхода 1), например в CI.")
+    parser.add_argument("--work-dir", type=Path, default=None, help="Рабочая папка (по умолчанию временная).")
+    parser.add_argument("--keep", action="store_true", help="Не удалять рабочую папку (корпус, результаты, pipeline.log).")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="jones_bench_"))
+    if args.work_dir is not None and work_dir.exists() and any(work_dir.iterdir()):
+        print(f"ОШИБКА: Рабочая папка {work_dir} не пуста.")
+        sys.exit(2)
+    print("\n--- Сквозной замер конвейера (без сети и matool) ---")
+    print(f"1. Генерация корпуса: {args.assets} MAT в {work_dir / 'mat'}...")
+    corpus = generate_corpus(work_dir / "mat", args.assets, args.cel_fraction, args.seed)
+    servers = start_standin_servers(args.endpoints, args.standin)
+    print(f"2. Замена API: {', '.join(server.url for server in servers)}")
+    print(f"3. Фазы: {' '.join(PIPELINE_STEPS).format(workers=args.workers)} (лог: {work_dir / 'pipeline.log'})...")
+    try:
+        returncode, elapsed, peak_rss_mb = run_pipeline(work_dir, [server.url for server in servers], args.workers)
+    finally:
+        for server in servers:
+            server.stop()
+
+    api = {key: sum(server.stats[key] for server in servers) for key in servers[0].stats}
+    completed = sum(1 for _ in (work_dir / "durable" / "final_mat").glob('*.mat'))
+    result = {
+        'measured_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {'assets': args.assets, 'cel_fraction': args.cel_fraction, 'standin': args.standin,
+                   'endpoints': args.endpoints, 'workers': args.workers, 'seed': args.seed},
+        'corpus': corpus,
+        'returncode': returncode,
+        'elapsed': elapsed,
+        'completed': completed,
+        'phases': read_phase_times(work_dir),
+        'api': api,
+        'metrics': {'assets_per_sec': corpus['mats'] / elapsed if elapsed else 0.0,
+                    'api_calls_per_asset': api['requests'] / corpus['mats'],
+                    'peak_rss_mb': peak_rss_mb},
+    }
+
+    baseline = None
+    problems = []
+    if returncode != 0 or completed != corpus['mats']:
+        problems.append(f"конвейер завершился с кодом {returncode}, готовых MAT {completed} из {corpus['mats']}")
+    if not args.save_baseline and args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        if baseline['params'] != result['params']:
+            print(f"ПРЕДУПРЕЖДЕНИЕ: Параметры замера отличаются от базовых ({baseline['params']}), сравнение невозможно.")
+            baseline = None
+        else:
+            problems.extend(compare_to_baseline(result, baseline, args.tolerance))
+    if args.require_baseline and not args.save_baseline and baseline is None:
+        problems.append(f"нет базового замера с такими параметрами ({args.baseline})")
+    print_summary_report_bench(result, baseline, problems)
+
+    if args.save_baseline:
+        if problems:
+            print("Базовый замер не сохранен: конвейер отработал с ошибками.")
+        else:
+            args.baseline.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+            print(f"Базовый замер сохранен: {args.baseline}")
+    elif baseline is None and not args.baseline.exists():
+        print(f"Базового замера нет ({args.baseline}). Он свой для каждой машины и в репозиторий не входит; "
+              f"сохранить: jones.py bench --save-baseline")
+    if args.keep or problems:
+        print(f"Рабочая папка сохранена: {work_dir}")
+    elif args.work_dir is None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,15 @@
-import sys
-import shutil
+import time
+import argparse
 from pathlib import Path
 # --- НОВЫЕ ИМПОРТЫ ---
 from conf import Config
-from matool import Tool
+from fsutil import safe_move
+from context import get_context
+from shard import add_shard_argument, filter_shard, use_shard_state_files, save_shard_summary
+from usage_index import apply_usage
 
-# --- ИНИЦИАЛИЗАЦИЯ CONFIG И MATOOL ---
+# --- ИНИЦИАЛИЗАЦИЯ CONFIG (matool создается при первом использовании, см. context.py) ---
 config = Config()
-try:
-    matool = Tool(
-        primary_exe_path=config.MATOOL_EXE_PRIMARY,
-        cwd=config.BASE_DIR, # Команды matool будут выполняться из BASE_DIR
-        alternative_exe_path=config.MATOOL_EXE_ALT
-    )
-except FileNotFoundError as e:
-    print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}")
-    print("Работа скрипта прервана из-за отсутствия matool.exe.")
-    sys.exit(1)
 # --- КОНЕЦ ИНИЦИАЛИЗАЦИИ ---
 
 # --- Вспомогательные функции (run_matool и get_mat_info УДАЛЕНЫ) ---
@@ -34,10 +27,10 @@ def setup_directories_cel_extract():
     print(f"   Папка для использованных CEL MAT: {config.USED_MANUAL_MAT_DIR.name}")
     print("   Папки проверены/созданы.")
 
-def find_cel_mats_to_extract():
-    """Находит MAT файлы в папке MANUAL_CEL_DIR."""
+def find_cel_mats_to_extract(shard=None):
+    """Находит MAT файлы в папке MANUAL_CEL_DIR (только своего шарда, если задан)."""
     print(f"\n2. Поиск MAT файлов в {config.MANUAL_CEL_DIR.name}...")
-    mat_files = sorted(list(config.MANUAL_CEL_DIR.glob('*.mat')))
+    mat_files = apply_usage(filter_shard(sorted(config.MANUAL_CEL_DIR.glob('*.mat')), shard, "MAT"), "MAT")
     if not mat_files:
         print(f"   Папка {config.MANUAL_CEL_DIR.name} пуста. Нет MAT файлов для извлечения.")
         return []
@@ -64,7 +57,7 @@ def cleanup_previous_cel_pngs(base_name, target_format_dir, actual_extract_outpu
             try: old_png.unlink()
             except OSError as e: print(f"      Не удалось удалить {old_png.name}: {e}")
 
-# extract_cel_mat функция больше не нужна, используется matool.extract()
+# extract_cel_mat функция больше не нужна, используется matool.extract() (через get_context().tool)
 
 def find_and_move_extracted_cels(base_name, actual_extract_output_dir, target_format_dir):
     """Находит извлеченные PNG в actual_extract_output_dir и перемещает их в папку формата."""
@@ -83,7 +76,7 @@ def find_and_move_extracted_cels(base_name, actual_extract_output_dir, target_fo
     for png_path in extracted_pngs_in_root:
         target_png_path = target_format_dir / png_path.name
         try:
-            shutil.move(str(png_path), str(target_png_path))
+            safe_move(png_path, target_png_path)
             moved_count += 1
         except Exception as e:
             print(f"    ОШИБКА при перемещении {png_path.name} -> {target_format_dir.name}: {e}")
@@ -103,7 +96,7 @@ def move_processed_cel_mat(mat_path):
     try:
         if not used_manual_mat_target.exists():
             print(f"  Перемещение исходного MAT {mat_path.name} -> {config.USED_MANUAL_MAT_DIR.name}")
-            shutil.move(str(mat_path), str(used_manual_mat_target))
+            safe_move(mat_path, used_manual_mat_target)
             mat_moved_or_deleted = True
         else:
              print(f"  ПРЕДУПРЕЖДЕНИЕ: MAT {mat_path.name} уже существует в {config.USED_MANUAL_MAT_DIR.name}.")
@@ -126,7 +119,7 @@ def process_single_cel_mat(mat_path, actual_extract_output_dir):
     base_name = mat_path.stem
     print(f"\nОбработка: {mat_path.name}")
 
-    info_result = matool.info(mat_path) # Используем matool.info
+    info_result = get_context().mat_info(mat_path)
     if info_result['error']:
         # matool.info уже вывел подробности ошибки
         print(f"  ОШИБКА: Не удалось получить информацию для {mat_path.name}. Пропускаем.")
@@ -150,7 +143,11 @@ def process_single_cel_mat(mat_path, actual_extract_output_dir):
     cleanup_previous_cel_pngs(base_name, target_format_dir, actual_extract_output_dir)
 
     print(f"  Извлечение PNG из {mat_path.name}...")
-    extract_ok = matool.extract(mat_path) # Используем matool.extract
+    if std_format == "indexed":
+        from indexed_mat import extract_indexed_mat  # NumPy нужен только для палитровых MAT
+        extract_ok = extract_indexed_mat(mat_path, actual_extract_output_dir)
+    else:
+        extract_ok = get_context().tool.extract(mat_path)
     if not extract_ok:
         # matool.extract() уже выводит информацию об ошибке
         return "error_extract"
@@ -196,14 +193,23 @@ def print_summary_report_cel_extract(total_files, status_counts):
     print(f"После этого запустите Скрипт для запаковки результатов CEL MAT (аналог Скрипта 3, но для CEL).")
 
 
-def main():
+def parse_args_cel_extract(argv=None):
+    parser = argparse.ArgumentParser(description="Извлечение CEL MAT (несколько текстур) в PNG.")
+    add_shard_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Фаза 1.5: Извлечение CEL MAT в PNG"""
+    args = parse_args_cel_extract(argv)
+    use_shard_state_files(args.shard)
     print("\n--- Скрипт (извлечение CEL MAT): Извлечение CEL MAT в PNG ---") # Название скрипта условное
+    start_time = time.time()
 
     setup_directories_cel_extract()
-    mat_files = find_cel_mats_to_extract()
+    mat_files = find_cel_mats_to_extract(args.shard)
     if not mat_files:
         print("\nРабота скрипта завершена, так как нет файлов для обработки.")
+        save_shard_summary("cel-extract", args.shard, {'total_files': 0, 'status_counts': {}})
         return
 
     # Предполагаем, что matool.exe, запущенный из config.BASE_DIR,
@@ -216,10 +222,13 @@ def main():
     total_files = len(mat_files)
 
     for i, mat_path in enumerate(mat_files):
+        get_context().track_asset(mat_path.name)
         status = process_single_cel_mat(mat_path, actual_extract_output_dir)
         status_counts[status] = status_counts.get(status, 0) + 1
 
     print_summary_report_cel_extract(total_files, status_counts)
+    save_shard_summary("cel-extract", args.shard, {'total_files': total_files, 'status_counts': status_counts})
+    get_context().record_phase("cel-extract", status_counts, time.time() - start_time)
 
 # def check_matool_exists_cel_extract(): -- Эта функция больше не нужна
 
@@ -1,23 +1,22 @@
+import os
 import sys
-import shutil
 from pathlib import Path
 import time
 import re
+import argparse
 
 from conf import Config
-from matool import Tool
+from context import get_context
+from shard import add_shard_argument, in_shard, use_shard_state_files, save_shard_summary
+from usage_index import apply_usage
+from used_store import move_to_used, read_used_bytes
+from mat_format import read_mat_header, has_mip_levels, spot_check_texture, FORMATS_16BIT
+from png_header import read_png_size
+from texture_budget import prepare_texture_budget, load_texture_plan, planned_size
+from upscale_routing import routed_scale
+from verify_mat import compare_mat_to_original
 
 config = Config()
-try:
-    matool = Tool(
-        primary_exe_path=config.MATOOL_EXE_PRIMARY,
-        cwd=config.BASE_DIR,
-        alternative_exe_path=config.MATOOL_EXE_ALT
-    )
-except FileNotFoundError as e:
-    print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}")
-    print("Работа скрипта прервана из-за отсутствия matool.exe.")
-    sys.exit(1)
 
 def get_cel_index(path: Path) -> int | float:
     """Извлекает числовой индекс из имени файла __cel_N.png"""
@@ -41,8 +40,8 @@ def setup_directories_cel_pack():
          sys.exit(1)
     print("   Папки проверены/созданы.")
 
-def find_and_group_cel_pngs():
-    """Находит CEL PNG в PROCESSED_PNG_DIR и группирует их по базовому имени."""
+def find_and_group_cel_pngs(shard=None):
+    """Находит CEL PNG в PROCESSED_PNG_DIR и группирует их по базовому имени (только группы своего шарда)."""
     print(f"\n2. Поиск и группировка CEL PNG файлов в {config.PROCESSED_PNG_DIR.name}...")
     # Ищем только PNG, так как апскейлер обычно выводит PNG
     cel_png_files = list(config.PROCESSED_PNG_DIR.glob('*__cel_*.png'))
@@ -62,7 +61,10 @@ def find_and_group_cel_pngs():
              print(f"   ПРЕДУПРЕЖДЕНИЕ: Не удалось извлечь базовое имя из {png_path.name}")
 
     print(f"   Найдено {len(cel_png_files)} CEL PNG файлов, сгруппированных по {len(cel_groups)} базовым именам.")
-    return cel_groups
+    if shard is not None:
+        cel_groups = {base_name: group for base_name, group in cel_groups.items() if in_shard(base_name, shard)}
+        print(f"   Шард {shard[0]}/{shard[1]}: отобрано {len(cel_groups)} групп.")
+    return dict(apply_usage(sorted(cel_groups.items()), "групп CEL", key=lambda item: item[0]))
 
 def check_if_cel_packed(final_mat_path, png_group):
     """Проверяет, существует ли финальный MAT, и перемещает PNG, если да."""
@@ -74,14 +76,108 @@ def check_if_cel_packed(final_mat_path, png_group):
         for png_to_move in png_group:
             if png_to_move.exists():
                 try:
-                    used_target = config.USED_DIR / png_to_move.name
-                    shutil.move(str(png_to_move), str(used_target))
+                    move_to_used(png_to_move)
                     moved_png_count += 1
                 except OSError as e: print(f"      Не удалось переместить {png_to_move.name}: {e}")
         print(f"    Перемещено: {moved_png_count} PNG.")
         return True
     return False
 
+def find_changed_cels(png_group):
+    """Новые или измененные кадры: PNG, копий которых нет среди использованных или они отличаются по содержимому."""
+    changed = []
+    for png_path in png_group:
+        used_copy = read_used_bytes(png_path.name)
+        if used_copy is None or used_copy != png_path.read_bytes():
+            changed.append(png_path)
+    return changed
+
+def find_resized_cels(changed, indices, header):
+    """Измененные кадры, размер которых отличается от кадра в финальном MAT (частичная замена невозможна)."""
+    resized = []
+    for png_path in changed:
+        texture = header['textures'][indices[png_path]]
+        size = read_png_size(png_path)
+        if size != (texture['width'], texture['height']):
+            size_str = f"{size[0]}x{size[1]}" if size else "не читается"
+            resized.append(f"{png_path.name} ({size_str}, в MAT {texture['width']}x{texture['height']})")
+    return resized
+
+def verify_spliced_cel_mat(spliced_mat_path, final_header, base_name, frames):
+    """
+    Проверка MAT после замены кадров до того, как он заменит финальный: формат, число и размеры
+    текстур как в прежнем финальном MAT и относительно исходного (как verify_packed_mat Скрипта 3),
+    замененные кадры (frames: индекс -> PNG) выборочно сверяются с PNG кадров.
+    """
+    info = read_mat_header(spliced_mat_path)
+    if info['error']:
+        problems = [info['error']]
+    else:
+        problems = compare_mat_to_original(info, final_header, scale=1)
+        original_mat_path = config.USED_MANUAL_MAT_DIR / f"{base_name}.mat"
+        original_info = read_mat_header(original_mat_path) if original_mat_path.exists() else None
+        if original_info and not original_info['error']:
+            problems += compare_mat_to_original(info, original_info, scale=routed_scale(base_name),
+                                                allowed_size=planned_size(load_texture_plan(), base_name))
+        if not problems:
+            from imageutil import read_rgba_pixels  # NumPy уже загружен заменой кадров
+            problems = [error for index in sorted(frames)
+                        if (error := spot_check_texture(spliced_mat_path, info, index, reference=read_rgba_pixels(frames[index]),
+                                                        alpha_threshold=config.ALPHA_BINARY_THRESHOLD))]
+    if problems:
+        print(f"  ОШИБКА: MAT после замены кадров не прошел проверку: {'; '.join(problems)}")
+        return False
+    print("    Проверка MAT после замены кадров пройдена.")
+    return True
+
+def repack_changed_cels(base_name, png_group, final_mat_path):
+    """
+    Инкрементальная запаковка: финальный MAT уже есть, в PROCESSED_PNG_DIR - часть кадров.
+    Изменившиеся кадры заменяются в финальном MAT, остальные берутся из него без перекодирования.
+    Новый MAT собирается рядом и заменяет финальный только после проверки.
+    """
+    header = read_mat_header(final_mat_path)
+    if header['error']:
+        print(f"  ОШИБКА: Не удалось прочитать финальный {final_mat_path.name}: {header['error']}")
+        return "error_mat_info"
+    expected_count = header['texture_count']
+    indices = {png_path: get_cel_index(png_path) for png_path in png_group}
+    invalid = [png_path.name for png_path, index in indices.items() if not index < expected_count]
+    if invalid:
+        print(f"  ОШИБКА: Индексы кадров вне диапазона 0..{expected_count - 1} (текстур в {final_mat_path.name}): {invalid}")
+        return "error_png_mismatch"
+
+    changed = find_changed_cels(png_group)
+    if not changed:
+        check_if_cel_packed(final_mat_path, png_group)
+        return "skipped"
+    resized = find_resized_cels(changed, indices, header)
+    if resized:
+        print(f"  ОШИБКА: Частичная замена кадров в {final_mat_path.name} невозможна - размер кадров изменился: {resized}")
+        print(f"           Кадры CEL одного MAT должны быть одного размера. Для полной перезапаковки удалите "
+              f"{final_mat_path.name} и положите в {config.PROCESSED_PNG_DIR.name} все кадры.")
+        return "error_png_mismatch"
+    print(f"  Финальный {final_mat_path.name} уже есть: заменяются кадры {len(changed)} из {expected_count}.")
+
+    from native_pack import splice_cel_frames  # NumPy нужен только для перекодирования кадров
+    spliced_mat_path = final_mat_path.with_name(f"{final_mat_path.stem}.splice.mat")
+    frames = {indices[png_path]: png_path for png_path in changed}
+    if not splice_cel_frames(final_mat_path, frames, spliced_mat_path):
+        return "error_packing"
+    if not verify_spliced_cel_mat(spliced_mat_path, header, base_name, frames):
+        spliced_mat_path.unlink(missing_ok=True)
+        return "error_verification"
+    os.replace(spliced_mat_path, final_mat_path)
+
+    cleanup_ok = True
+    for png_path in png_group:
+        try:
+            move_to_used(png_path)
+        except OSError as e:
+            print(f"      Не удалось переместить {png_path.name}: {e}")
+            cleanup_ok = False
+    return "success_partial" if cleanup_ok else "success_with_cleanup_issue"
+
 def get_original_cel_mat_info(original_mat_path):
     """Проверяет наличие исходного MAT и возвращает формат и кол-во текстур."""
     if not original_mat_path.exists():
@@ -89,7 +185,7 @@ def get_original_cel_mat_info(original_mat_path):
         return None, None
 
     print(f"  Получение инфо из {original_mat_path.name}...")
-    info_result = matool.info(original_mat_path) # Используем matool.info
+    info_result = get_context().mat_info(original_mat_path)
 
     if info_result['error']:
         # matool.info уже вывело подробности
@@ -134,7 +230,7 @@ def pack_cel_pngs_to_mat(std_format, final_mat_path, sorted_png_paths):
     """Выполняет matool create для CEL файлов, проверяет результат."""
     # actual_output_path больше не нужен как отдельный параметр, matool.create работает с final_mat_path
     # matool.create выводит информацию о запуске и stdout/stderr
-    success_flag = matool.create(std_format, final_mat_path, *sorted_png_paths)
+    success_flag = get_context().tool.create(std_format, final_mat_path, *sorted_png_paths)
 
     if not success_flag:
         return False
@@ -149,9 +245,9 @@ def pack_cel_pngs_to_mat(std_format, final_mat_path, sorted_png_paths):
         return False
 
 def verify_packed_cel_mat(final_mat_path, expected_count):
-    """Проверяет количество текстур в созданном MAT файле."""
+    """Проверяет количество текстур в созданном MAT файле (по заголовку, без запуска matool)."""
     print(f"  Проверка количества текстур в новом файле {final_mat_path.name}...")
-    info_result = matool.info(final_mat_path) # Используем matool.info
+    info_result = read_mat_header(final_mat_path)
 
     if info_result['error']:
         print(f"  ОШИБКА: Не удалось получить информацию о новом файле {final_mat_path.name}: {info_result['error']}.")
@@ -186,8 +282,7 @@ def cleanup_after_cel_packing(sorted_png_paths, original_mat_path):
     for png_to_move in sorted_png_paths:
         if png_to_move.exists():
             try:
-                used_target = config.USED_DIR / png_to_move.name
-                shutil.move(str(png_to_move), str(used_target))
+                move_to_used(png_to_move)
                 moved_png_count += 1
             except OSError as e:
                 print(f"      Не удалось переместить {png_to_move.name}: {e}")
@@ -220,6 +315,8 @@ def process_cel_group(base_name, png_group):
     original_mat_path = config.USED_MANUAL_MAT_DIR / f"{base_name}.mat"
     final_mat_path = config.FINAL_MAT_DIR / f"{base_name}.mat"
 
+    if final_mat_path.exists() and config.CEL_PARTIAL_REPACK:
+        return repack_changed_cels(base_name, png_group, final_mat_path)
     if check_if_cel_packed(final_mat_path, png_group):
         return "skipped"
 
@@ -231,7 +328,14 @@ def process_cel_group(base_name, png_group):
     if sorted_png_paths is None:
         return "error_png_mismatch"
 
-    pack_ok = pack_cel_pngs_to_mat(std_format, final_mat_path, sorted_png_paths)
+    if std_format == "indexed":
+        from indexed_mat import write_indexed_mat  # NumPy нужен только для палитровых MAT
+        pack_ok = write_indexed_mat(original_mat_path, final_mat_path, sorted_png_paths)
+    elif std_format in FORMATS_16BIT and config.PACK_LOCAL_MIPMAPS and has_mip_levels(read_mat_header(original_mat_path)):
+        from native_pack import write_mat_with_mips  # Mip-уровни строятся из одного апскейленного уровня
+        pack_ok = write_mat_with_mips(original_mat_path, final_mat_path, sorted_png_paths)
+    else:
+        pack_ok = pack_cel_pngs_to_mat(std_format, final_mat_path, sorted_png_paths)
     if not pack_ok:
         lingering_mat_in_base = config.BASE_DIR / f"{base_name}.mat"
         if lingering_mat_in_base.exists() and lingering_mat_in_base.name != config.MATOOL_FILENAME:
@@ -265,6 +369,8 @@ def print_summary_report_cel_pack(total_groups, status_counts):
     print(f"Успешно запаковано, проверено и очищено: {success_count} групп.")
     if success_cleanup_issue > 0:
         print(f"Успешно запаковано, но с ошибками очистки: {success_cleanup_issue} групп.")
+    if status_counts.get('success_partial', 0) > 0:
+        print(f"Заменены только измененные кадры в существующих MAT: {status_counts['success_partial']} групп.")
     print(f"Пропущено (финальный MAT уже существовал): {skipped_count} групп.")
     print(f"Всего ошибок при обработке: {total_errors} групп.")
     if total_errors > 0:
@@ -295,26 +401,40 @@ def print_summary_report_cel_pack(total_groups, status_counts):
         print(f"\nПРЕДУПРЕЖДЕНИЕ: В основной папке ({config.BASE_DIR.name}) обнаружены MAT файлы ({len(lingering_mats_filtered)}), которые могли остаться из-за ошибок перемещения:")
         print(f"  Примеры: {[f.name for f in lingering_mats_filtered[:5]]}")
 
-def main():
+def parse_args_cel_pack(argv=None):
+    parser = argparse.ArgumentParser(description="Запаковка CEL PNG в MAT.")
+    add_shard_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Фаза запаковки CEL PNG в MAT"""
+    args = parse_args_cel_pack(argv)
+    use_shard_state_files(args.shard)
     print("\n--- Скрипт (Запаковка CEL MAT): Запаковка CEL файлов ---") # Условное название
+    start_time = time.time()
 
     setup_directories_cel_pack()
-    cel_groups = find_and_group_cel_pngs()
+    prepare_texture_budget(args.shard)
+    cel_groups = find_and_group_cel_pngs(args.shard)
     if not cel_groups:
         print("\nРабота скрипта завершена, так как нет CEL PNG файлов для обработки.")
+        save_shard_summary("cel-pack", args.shard, {'total_groups': 0, 'status_counts': {}})
         return
 
     print("\n3. Начало запаковки групп...")
     status_counts = {}
     total_groups = len(cel_groups)
-    sorted_group_items = sorted(cel_groups.items())
+    # Группы уже отсортированы по имени, а при наличии индекса использования - по числу ссылок
+    sorted_group_items = list(cel_groups.items())
 
     for i, (base_name, png_group) in enumerate(sorted_group_items):
+        get_context().track_asset(base_name)
         status = process_cel_group(base_name, png_group)
         status_counts[status] = status_counts.get(status, 0) + 1
 
     print_summary_report_cel_pack(total_groups, status_counts)
+    save_shard_summary("cel-pack", args.shard, {'total_groups': total_groups, 'status_counts': status_counts})
+    get_context().record_phase("cel-pack", status_counts, time.time() - start_time)
 
 if __name__ == "__main__":
      main()
\ No newline at end of file
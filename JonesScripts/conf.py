@@ -1,35 +1,205 @@
+import os
+import configparser
 from pathlib import Path
 
+# Размещение папок можно переопределить без правки этого файла:
+# переменными окружения JONES_BASE_DIR / JONES_SCRATCH_DIR / JONES_DURABLE_DIR
+# или секцией [volumes] (base_dir, scratch_dir, durable_dir) в jones.ini рядом с conf.py
+# (другой путь к ini - в переменной JONES_CONFIG). Переменные окружения важнее ini.
+_INI_PATH = Path(os.environ.get("JONES_CONFIG", Path(__file__).with_name("jones.ini")))
+_ini = configparser.ConfigParser()
+_ini.read(_INI_PATH, encoding='utf-8')
+
+def _volume(name: str, default: Path) -> Path:
+    value = os.environ.get(f"JONES_{name.upper()}") or _ini.get("volumes", name, fallback=None)
+    return Path(value) if value else default
+
 class Config:
-    BASE_DIR = Path(r"D:\Test jones\Resource\mat")
+    BASE_DIR = _volume("base_dir", Path(r"D:\Test jones\Resource\mat"))  # Ресурсы игры (исходные MAT)
+    # Промежуточные файлы (extracted, папки форматов, processed_png) - быстрый диск или tmpfs (например, /dev/shm/jones)
+    SCRATCH_DIR = _volume("scratch_dir", BASE_DIR)
+    # Результаты (used*, final_mat, отчеты) - надежный том
+    DURABLE_DIR = _volume("durable_dir", BASE_DIR)
 
     MAT_DIR = BASE_DIR
-    EXTRACTED_DIR = BASE_DIR / "extracted"
-    USED_DIR = BASE_DIR / "used"
-    USED_MAT_DIR = BASE_DIR / "used_mat"
+    EXTRACTED_DIR = SCRATCH_DIR / "extracted"
+    USED_DIR = DURABLE_DIR / "used"
+    USED_MAT_DIR = DURABLE_DIR / "used_mat"
     MANUAL_CEL_DIR = BASE_DIR / "manual_cel_processing"
-    USED_MANUAL_MAT_DIR = BASE_DIR / "used_manual_mat"
-    PROCESSED_PNG_DIR = BASE_DIR / "processed_png"
-    FINAL_MAT_DIR = BASE_DIR / "final_mat"
-    RENAME_TARGET_DIR = BASE_DIR / "cel_ready_scripts"
+    USED_MANUAL_MAT_DIR = DURABLE_DIR / "used_manual_mat"
+    PROCESSED_PNG_DIR = SCRATCH_DIR / "processed_png"
+    FINAL_MAT_DIR = DURABLE_DIR / "final_mat"
+    RENAME_TARGET_DIR = DURABLE_DIR / "cel_ready_scripts"
     RENAME_SUBSTRING_TO_REMOVE = '__cel_0'
 
     # --- Исполняемый файл matool.exe ---
     MATOOL_EXE_PRIMARY = BASE_DIR / "matool.exe"
+    MATOOL_CWD = SCRATCH_DIR  # matool extract пишет PNG в подпапку extracted рабочей папки
     MATOOL_EXE_ALT = EXTRACTED_DIR / "matool.exe"
     MATOOL_FILENAME = "matool.exe"
+    # Реализация info/extract/create: "matool" - matool.exe, "python" - встроенная (native_tool.py,
+    # только 16-битные и палитровые MAT, без Windows и Wine)
+    MAT_TOOL_BACKEND = os.environ.get("JONES_MAT_TOOL", "matool")
+    # Запуск matool: "native" - напрямую, "wine" - через Wine, "auto" - Wine везде, кроме Windows
+    MATOOL_RUNNER = os.environ.get("JONES_MATOOL_RUNNER", "auto")
+    WINE_EXE = "wine"
+    WINESERVER_EXE = "wineserver"
+    WINE_PREFIX = None  # None - WINEPREFIX из окружения (или ~/.wine)
+    WINE_LAUNCHERS = 2  # Предзапущенные wine cmd.exe, через которые выполняются команды matool
+    WINE_SERVER_LINGER = 600  # сек., сколько wineserver живет после последнего клиента (префикс остается "теплым")
+    WINE_COMMAND_TIMEOUT = 300  # сек. на одну команду matool через Wine; зависший matool прерывается (None - без ограничения)
 
     FORMAT_DIRS = {
         "rgb565": EXTRACTED_DIR / "rgb565",
         "rgba4444": EXTRACTED_DIR / "rgba4444",
         "rgba5551": EXTRACTED_DIR / "rgba5551",
         "unknown": EXTRACTED_DIR / "unknown_format",
-        "rgba": EXTRACTED_DIR / "rgba_unknown"
+        "rgba": EXTRACTED_DIR / "rgba_unknown",
+        "indexed": EXTRACTED_DIR / "indexed"
     }
 
+    # --- Запаковка (Скрипт 3, cel_pack): апскейлится только основной уровень ---
+    PACK_LOCAL_MIPMAPS = True  # Mip-уровни 16-битных MAT строятся локально с учетом альфы (без matool)
+    CEL_PARTIAL_REPACK = True  # Если финальный CEL MAT уже есть, заменять в нем только новые/измененные кадры
+
+    # --- Архив использованных PNG (used_store.py): вместо отдельных файлов в USED_DIR ---
+    USED_STORE_ENABLED = True  # Использованные PNG дописываются в архивы ZIP с индексом SQLite
+    USED_STORE_INDEX_PATH = USED_DIR / "used_store.sqlite"
+    USED_STORE_CHUNK_MB = 1024  # Размер архива, после которого начинается следующий (used_NNNN.zip)
+    USED_STORE_COMPRESSION = "stored"  # "stored", "deflated" или "lzma"; PNG уже сжат, deflate почти ничего не дает
+
+    # --- Палитровые (8-bit indexed) MAT: извлекаются и запаковываются без matool ---
+    INDEXED_PALETTE_CMP = BASE_DIR / "palette.cmp"  # MAT не ссылается на палитру, ее задает уровень
+    INDEXED_PALETTE_OVERRIDES = {}  # Маска имени MAT -> CMP, например {"sw_*.mat": BASE_DIR / "cmp" / "sw.cmp"}
+    INDEXED_LUT_BITS = 6  # Точность таблицы ближайшего цвета при запаковке (бит на канал)
+
     HF_SPACE_URL = "Phips/Upscaler"
     TARGET_MODEL_NAME = "4xNomosWebPhoto_RealPLKSR"
     API_NAME = "/upscale_image"
     QUOTA_ERROR_PHRASE = "exceeded your gpu quota" #
     API_PAUSE_DURATION = 1
-    VALID_EXTENSIONS = {".png", ".webp"}
\ No newline at end of file
+
+    # --- Квота GPU: ожидание и продолжение (Скрипт 2, --wait-on-quota) ---
+    HF_SPACE_FALLBACK_URLS = []  # Резервные Space, на которые переключаемся при исчерпании квоты
+    QUOTA_STATE_FILE = EXTRACTED_DIR / "upscale_quota_state.json"
+    QUOTA_DEFAULT_WAIT = 15 * 60  # сек., если время сброса не удалось извлечь из сообщения API
+    QUOTA_WAIT_MARGIN = 30  # сек., запас после расчетного времени сброса
+    VALID_EXTENSIONS = {".png", ".webp"}
+    PAYLOAD_FORMATS = ["webp", "png"]  # Форматы без потерь, которые принимает Space; отправляется самый компактный
+    ALPHA_BINARY_THRESHOLD = 128  # Порог 1-битной альфы (rgba5551) после локального увеличения
+
+    # --- Локальный апскейл простых текстур без API (Скрипт 2, нужен NumPy) ---
+    TRIVIAL_FAST_PATH = True
+    TRIVIAL_MAX_SIZE = 8  # Текстуры не больше N x N пикселей (образцы цвета)
+    TRIVIAL_SOLID_TOLERANCE = 2  # Заливка: разброс каждого канала RGB не больше N
+    TRIVIAL_GRADIENT_MAX_RESIDUAL = 1.5  # Градиент: СКО отклонения от линейной аппроксимации не больше N
+
+    # --- Маршрутизация апскейла по текстурам (upscale_routing.py, Скрипт 2) ---
+    # Правила проверяются по порядку, первое подходящее задает модель, масштаб и бэкенд текстуры:
+    # "api" - пул эндпоинтов с моделью model, "local" - интерполяция Lanczos без API.
+    # Условия (все необязательные): min_side/max_side - большая сторона PNG в пикселях, formats - список
+    # форматов MAT, alpha - есть ли альфа, ui - имя подходит под UPSCALE_UI_PATTERNS,
+    # min_edge_density/max_edge_density - доля пикселей-краев (0..1, считается только если нужна правилу).
+    # Без model/scale/backend - TARGET_MODEL_NAME, UPSCALE_FACTOR и "api", как и для текстур без правила.
+    # Пример: [{"name": "ui-small", "ui": True, "max_side": 64, "backend": "local"},
+    #          {"name": "flat", "max_edge_density": 0.01, "backend": "local"},
+    #          {"name": "world-2x", "max_side": 128, "model": "2xNomosUni_span_multijpg", "scale": 2}]
+    UPSCALE_ROUTES = []
+    UPSCALE_UI_PATTERNS = ["ui_*", "hud*", "menu*", "*icon*", "*font*", "cursor*"]  # Маски имен MAT интерфейса
+    UPSCALE_EDGE_THRESHOLD = 24  # Перепад яркости между соседними пикселями, считающийся краем
+    # Решение фиксируется для базового имени при первом кадре: все кадры CEL получают один масштаб,
+    # а проверка после запаковки знает, во сколько раз увеличена текстура
+    UPSCALE_ROUTING_DB = DURABLE_DIR / "upscale_routes.sqlite"
+
+    # --- Пул эндпоинтов апскейла (Скрипт 2) ---
+    # Список {"url": ..., "token": ..., "weight": ..., "predict_args": [...]}; пустой - HF_SPACE_URL
+    # и HF_SPACE_FALLBACK_URLS с токеном из переменной окружения HF_TOKEN_ENV.
+    # predict_args - дополнительные аргументы API после имени модели (например, формат результата "webp",
+    # если Space его принимает)
+    UPSCALE_ENDPOINTS = []
+    UPSCALE_WORKERS = 1  # Параллельных запросов к пулу (--workers)
+    # Допуск параллельных задач по памяти (оценка по размерам текстуры, апскейл в RGBA)
+    MEMORY_BUDGET_MB = None  # None - доля физической памяти MEMORY_BUDGET_RAM_FRACTION
+    MEMORY_BUDGET_RAM_FRACTION = 0.5
+    MEMORY_COPIES_FACTOR = 3.0  # Одновременных копий изображения при обработке (PIL convert, альфа, кодирование)
+    MEMORY_MAX_BYPASS_SECONDS = 30.0  # сек.: сколько крупная задача может ждать, пока ее обгоняют мелкие
+    ENDPOINT_MAX_ATTEMPTS = 4  # Попыток на один файл (с паузой между попытками)
+    ENDPOINT_BACKOFF_BASE = 2.0  # сек., пауза перед повтором удваивается с каждой попыткой
+    ENDPOINT_BACKOFF_MAX = 60.0
+    ENDPOINT_FAILURE_THRESHOLD = 3  # Ошибок подряд, после которых эндпоинт выводится из ротации
+    ENDPOINT_OPEN_SECONDS = 120  # На сколько секунд выводится эндпоинт
+    ENDPOINT_LATENCY_ALPHA = 0.3  # Коэффициент сглаживания задержки (EWMA)
+    # Хеджирование: запрос, не завершившийся за перцентиль недавних задержек, дублируется на другой эндпоинт
+    HEDGE_ENABLED = True
+    HEDGE_PERCENTILE = 95
+    HEDGE_MIN_SAMPLES = 20  # Без стольких успешных ответов перцентиль не считается и дубликаты не отправляются
+    HEDGE_MIN_DELAY = 5.0  # сек., дубликат не раньше этого
+    HEDGE_BUDGET_FRACTION = 0.1  # Дубликатов не больше этой доли от основных запросов (расход квоты)
+
+    # --- Общая очередь апскейла для нескольких воркеров (upscale_worker.py) ---
+    # Должна лежать на общей для всех машин папке; там же (SCRATCH_DIR внутри DURABLE_DIR) должны быть
+    # EXTRACTED_DIR и PROCESSED_PNG_DIR, иначе upscale_worker.py не запустится (кроме --single-host)
+    WORK_QUEUE_DB = DURABLE_DIR / "upscale_queue.sqlite"
+    WORK_QUEUE_LEASE_SECONDS = 600  # Аренда задачи; продлевается heartbeat'ами, пока воркер жив
+    WORK_QUEUE_MAX_ATTEMPTS = 3  # После стольких неудачных попыток задача помечается 'failed'
+    WORK_QUEUE_POLL_SECONDS = 10  # Пауза, когда свободных задач нет, но другие воркеры еще работают
+    HF_TOKEN_ENV = "HF_TOKEN"  # Переменная окружения с токеном Hugging Face (если токен не задан явно)
+
+    # --- Проверка финальных MAT (verify_mat.py) ---
+    UPSCALE_FACTOR = 4  # Во сколько раз апскейлер увеличивает стороны текстуры (по умолчанию, см. UPSCALE_ROUTES)
+    VERIFY_WORKERS = 8
+    VERIFY_REPORT_PATH = DURABLE_DIR / "verify_report.json"
+
+    # --- Бюджет памяти текстур (texture_budget.py, перед запаковкой) ---
+    TEXTURE_MAX_DIM = None  # Максимальная сторона текстуры в пикселях (None = без ограничения)
+    TEXTURE_POW2 = False  # Округлять стороны вниз до степени двойки
+    TEXTURE_BUDGET_MB = None  # Общий бюджет памяти текселей финального пака в МБ (None = без ограничения)
+    TEXTURE_PRIORITY_PATTERNS = {}  # glob-шаблон имени -> приоритет (меньший приоритет уменьшается первым)
+    TEXTURE_PLAN_PATH = DURABLE_DIR / "texture_plan.json"
+
+    # --- Индекс использования текстур (usage_index.py, jones.py usage) ---
+    USAGE_INDEX_PATH = DURABLE_DIR / "usage_index.json"
+    USAGE_SOURCE_DIRS = [BASE_DIR.parent]  # Папки с уровнями, моделями и скриптами (просматриваются рекурсивно, включая GOB)
+    USAGE_SOURCE_EXTENSIONS = (".jkl", ".ndy", ".cnd", ".3do", ".cog", ".pup", ".dat", ".exe")
+    USAGE_FILTER = True  # Если индекс построен: пропускать неиспользуемые текстуры, используемые - первыми
+    USAGE_KEEP_PATTERNS = []  # glob-шаблоны текстур, которые обрабатываются всегда (например, загружаемые кодом игры)
+
+    # --- Экспорт текстур для GPU (export_gpu.py): BCn в DDS/KTX2 ---
+    EXPORT_DIR = DURABLE_DIR / "export_gpu"
+    EXPORT_FORMAT = "auto"  # "bc1", "bc3", "bc7" или "auto" (BC1 без альфы, BC3 с альфой)
+    EXPORT_CONTAINERS = ("dds",)  # "dds" и/или "ktx2"
+    EXPORT_SRGB = True  # Помечать данные как sRGB (DDS с заголовком DX10, KTX2 с передаточной функцией sRGB)
+    EXPORT_MIPMAPS = True  # Полная цепочка mip-уровней до 1x1 (иначе только основной уровень)
+    EXPORT_WORKERS = 4  # Текстур, сжимаемых параллельно
+
+    # --- Сквозной замер производительности (bench_e2e.py, jones.py bench) ---
+    # Базовый замер: свой для каждой машины, поэтому в репозиторий не входит. Без него bench только печатает
+    # метрики - сначала jones.py bench --save-baseline; --require-baseline делает его отсутствие ошибкой
+    BENCH_BASELINE_PATH = Path(__file__).with_name("bench_baseline.json")
+    BENCH_ASSETS = 2000  # MAT в сгенерированном корпусе
+    BENCH_CEL_FRACTION = 0.1  # Доля CEL MAT (2-5 кадров)
+    # Замена API: задержка и разброс (сек.), доля ошибок и ошибок квоты GPU, время до сброса квоты (сек.)
+    BENCH_STANDIN = "latency=0.02,jitter=0.01,failure_rate=0.02,quota_rate=0.005,quota_reset_seconds=1,seed=1"
+    BENCH_ENDPOINTS = 2
+    BENCH_WORKERS = 4
+    BENCH_TOLERANCE = 0.2  # Допустимое ухудшение метрики относительно базового замера (доля)
+
+    # --- Общий запуск фаз (jones.py) ---
+    RUN_MANIFEST_PATH = DURABLE_DIR / "run_manifest.json"
+    SHARD_SUMMARY_DIR = DURABLE_DIR / "shards"  # Итоги фаз, запущенных с --shard i/n
+    PROFILE_DIR = DURABLE_DIR / "profiles"  # Результаты jones.py --profile
+    PROFILE_INTERVAL = 0.005  # сек. между сэмплами стеков
+    PROFILE_TOP_N = 20  # Сколько самых медленных ассетов печатать
+
+    # --- Режим наблюдения (jones.py watch) ---
+    WATCH_DEBOUNCE_SECONDS = 2.0  # Пакет запускается, когда в папках нет новых событий столько секунд
+    WATCH_MAX_DELAY_SECONDS = 30.0  # ...но не позже, чем через столько секунд после первого события
+    WATCH_POLL_SECONDS = 2.0  # Интервал опроса папок, если watchdog не установлен
+    THROUGHPUT_HISTORY_PATH = DURABLE_DIR / "throughput_history.json"
+
+    # --- Планировщик запуска (plan_run.py) ---
+    RUN_PLAN_PATH = DURABLE_DIR / "run_plan.json"
+    # Оценки по умолчанию, пока нет истории производительности (сек. на элемент / на мегапиксель)
+    PLAN_DEFAULT_STAGE_SECONDS = {"extract": 0.5, "cel-extract": 1.0, "pack": 0.5, "cel-pack": 1.5}
+    PLAN_DEFAULT_UPSCALE_SECONDS_PER_MP = 60.0
+    GPU_QUOTA_SECONDS_PER_WINDOW = None  # Секунд GPU в одном окне квоты (None = неизвестно)
@@ -0,0 +1,140 @@
+import sys
+import json
+import time
+from pathlib import Path
+from conf import Config
+from matool import Tool
+from mat_format import read_mat_header
+from throughput import ThroughputHistory
+
+
+class RunContext:
+    """
+    Общее состояние процесса для всех фаз: один Tool (создается при первом обращении),
+    кэш результатов matool info и манифест запуска. Несколько фаз, запущенных
+    из jones.py в одном процессе, используют один и тот же контекст.
+    """
+    def __init__(self, config: Config):
+        self.config = config
+        self._tool = None
+        self.info_cache = {}
+        self.info_cache_hits = 0
+        self._history = None
+        self.profiler = None  # PhaseProfiler при запуске jones.py --profile
+        self.manifest = {
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'argv': sys.argv,
+            'phases': [],
+        }
+
+    @property
+    def history(self) -> ThroughputHistory:
+        """История производительности; файл меняется, если фаза включила файлы состояния шарда."""
+        if self._history is None or self._history.history_path != self.config.THROUGHPUT_HISTORY_PATH:
+            self._history = ThroughputHistory(self.config.THROUGHPUT_HISTORY_PATH)
+        return self._history
+
+    @property
+    def tool(self) -> Tool:
+        if self._tool is None and self.config.MAT_TOOL_BACKEND == "python":
+            from native_tool import NativeTool
+            self._tool = NativeTool(self.config.EXTRACTED_DIR)
+        if self._tool is None:
+            try:
+                self.config.MATOOL_CWD.mkdir(parents=True, exist_ok=True)
+                self._tool = Tool(
+                    primary_exe_path=self.config.MATOOL_EXE_PRIMARY,
+                    cwd=self.config.MATOOL_CWD,
+                    alternative_exe_path=self.config.MATOOL_EXE_ALT
+                )
+                self._tool.runner = self._make_runner()
+            except FileNotFoundError as e:
+                print(f"\nКРИТИЧЕСКАЯ ОШИБКА: {e}")
+                print("Работа скрипта прервана из-за отсутствия matool.exe.")
+                sys.exit(1)
+        return self._tool
+
+    def _make_runner(self):
+        """WineRunner, если matool нужно запускать через Wine (MATOOL_RUNNER), иначе None."""
+        mode = self.config.MATOOL_RUNNER
+        if mode == "native" or (mode == "auto" and sys.platform == 'win32'):
+            return None
+        from wine_runner import WineRunner
+        if not WineRunner.available(self.config.WINE_EXE):
+            if mode == "wine":
+                raise FileNotFoundError(f"Wine ({self.config.WINE_EXE}) не найден, а MATOOL_RUNNER = 'wine'")
+            print(f"Matool: ПРЕДУПРЕЖДЕНИЕ: {self.config.WINE_EXE} не найден, matool запускается напрямую.")
+            return None
+        runner = WineRunner(self.config.WINE_EXE, self.config.WINESERVER_EXE, self.config.WINE_PREFIX,
+                            self.config.WINE_LAUNCHERS, self.config.WINE_SERVER_LINGER, self.config.MATOOL_CWD,
+                            self.config.WINE_COMMAND_TIMEOUT)
+        runner.start()
+        return runner
+
+    def mat_info(self, mat_path: Path) -> dict:
+        """
+        Tool.info с кэшем. Ключ - имя, размер и время изменения файла, поэтому
+        результат переживает перемещение MAT между папками (MAT_DIR -> USED_MAT_DIR).
+        """
+        try:
+            stat = mat_path.stat()
+            cache_key = (mat_path.name.lower(), stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return self.tool.info(mat_path)
+
+        cached = self.info_cache.get(cache_key)
+        if cached is not None:
+            self.info_cache_hits += 1
+            print(f"  Matool info (кэш): {mat_path.name}")
+            return cached
+
+        header = read_mat_header(mat_path)
+        if not header['error'] and header['format_standardized'] == 'indexed':
+            info_result = header  # matool не различает палитровые MAT, заголовка достаточно
+        else:
+            info_result = self.tool.info(mat_path)
+        if not info_result['error']:
+            self.info_cache[cache_key] = info_result
+        return info_result
+
+    def track_asset(self, name: str):
+        """Отмечает начало обработки ассета текущим потоком (для профиля --profile; без профиля ничего не делает)."""
+        if self.profiler is not None:
+            self.profiler.track_asset(name)
+
+    def record_phase(self, phase: str, status_counts: dict, elapsed: float | None = None, items: int | None = None):
+        """
+        Добавляет итог фазы в манифест запуска и сохраняет его.
+        items - кол-во реально обработанных элементов для истории производительности
+        (по умолчанию - все статусы, кроме пропусков).
+        """
+        self.manifest['phases'].append({
+            'phase': phase,
+            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'elapsed_seconds': round(elapsed, 3) if elapsed is not None else None,
+            'status_counts': dict(status_counts),
+        })
+        self.manifest['info_cache'] = {'entries': len(self.info_cache), 'hits': self.info_cache_hits}
+        self.save_manifest()
+        if items is None:
+            items = sum(count for status, count in status_counts.items() if not status.startswith('skipped'))
+        if elapsed is not None:
+            self.history.record(phase, items, elapsed)
+
+    def save_manifest(self):
+        try:
+            self.config.RUN_MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+            self.config.RUN_MANIFEST_PATH.write_text(
+                json.dumps(self.manifest, ensure_ascii=False, indent=2, default=str), encoding='utf-8')
+        except OSError as e:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось сохранить манифест запуска {self.config.RUN_MANIFEST_PATH}: {e}")
+
+
+_context = None
+
+def get_context() -> RunContext:
+    """Возвращает общий для процесса RunContext (создается при первом вызове)."""
+    global _context
+    if _context is None:
+        _context = RunContext(Config())
+    return _context
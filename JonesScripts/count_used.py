@@ -2,6 +2,7 @@ from pathlib import Path
 import re
 import sys
 from conf import Config
+from used_store import used_file_names
 
 config = Config()
 
@@ -36,7 +37,9 @@ def get_accounted_bases(directory: Path, valid_extensions: set) -> set | None:
     print(f"\nСканирование папки с результатами: {directory}")
     all_files = list(directory.iterdir())
     files_to_check = [f for f in all_files if f.is_file()]
-    print(f"Найдено {len(files_to_check)} файлов для проверки.")
+    archived_files = [Path(name) for name in used_file_names()]
+    print(f"Найдено {len(files_to_check)} файлов для проверки (и {len(archived_files)} в архиве использованных).")
+    files_to_check.extend(archived_files)
 
     for file_path in files_to_check:
         filename_lower = file_path.name.lower()
@@ -61,7 +64,7 @@ def get_accounted_bases(directory: Path, valid_extensions: set) -> set | None:
     return accounted_bases
 
 # --- Запуск и сравнение ---
-if __name__ == "__main__":
+def main():
     # Используем пути и константы из config
     mat_bases = get_mat_bases(config.MAT_DIR) # MAT_DIR из config
     if mat_bases is None:
@@ -82,4 +85,7 @@ if __name__ == "__main__":
         for base in sorted(list(missing_bases)):
             print(f"- {base}.mat")
     else:
-        print(f"\nВсе .mat файлы из папки '{config.MAT_DIR.name}' имеют соответствующую запись в папке '{config.USED_DIR.name}' (согласно правилам подсчета).")
\ No newline at end of file
+        print(f"\nВсе .mat файлы из папки '{config.MAT_DIR.name}' имеют соответствующую запись в папке '{config.USED_DIR.name}' (согласно правилам подсчета).")
+
+if __name__ == "__main__":
+    main()
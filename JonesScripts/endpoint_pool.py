@@ -0,0 +1,201 @@
+import time
+import random
+import threading
+from collections import deque
+
+
+class Endpoint:
+    """
+    Один апскейлер (Space или зеркало) в пуле: вес, клиент (со своим токеном),
+    скользящее среднее задержки и состояние автомата (circuit breaker).
+    connect - функция без аргументов, возвращающая клиент (или None при ошибке);
+    вызывается при первом обращении. predict_args - дополнительные аргументы API
+    этого эндпоинта (например, запрос компактного формата результата).
+    """
+    def __init__(self, url: str, connect=None, weight: float = 1.0, client=None, predict_args=()):
+        self.url = url
+        self.connect = connect
+        self.weight = weight
+        self.client = client
+        self.predict_args = tuple(predict_args)
+        self.latency = None  # EWMA времени ответа, сек.
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # До этого времени эндпоинт выведен из ротации; после - полуоткрыт до первого успеха
+        self.probe_started = None  # Время отправки пробного запроса полуоткрытому эндпоинту
+        self.in_flight = 0
+        self.stats = {'calls': 0, 'failures': 0, 'quota_hits': 0, 'opened': 0}
+        self.connect_lock = threading.Lock()
+
+    def is_open(self, now: float) -> bool:
+        return self.open_until > now
+
+    def is_half_open(self, now: float) -> bool:
+        return 0 < self.open_until <= now
+
+
+class EndpointPool:
+    """
+    Пул эндпоинтов апскейла с маршрутизацией по весу и наблюдаемой задержке.
+    После failure_threshold ошибок подряд эндпоинт выводится из ротации на open_seconds;
+    по окончании паузы он полуоткрыт: получает один пробный запрос, остальные запросы его
+    не выбирают. Успех пробы возвращает эндпоинт в ротацию, ошибка снова выводит.
+    Проба без результата (отменена или потеряна) через open_seconds заменяется новой.
+    Ошибка квоты выводит эндпоинт до восстановления квоты.
+    Потокобезопасен: используется несколькими потоками фазы 2 (--workers).
+    """
+    def __init__(self, endpoints: list[Endpoint], failure_threshold: int = 3, open_seconds: float = 120.0,
+                 latency_alpha: float = 0.3, seed: int | None = None, latency_window: int = 200,
+                 probe_poll_seconds: float = 1.0):
+        self.endpoints = endpoints
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.probe_poll_seconds = probe_poll_seconds  # Как часто проверять, завершилась ли проба
+        self.latency_alpha = latency_alpha
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent_latencies = deque(maxlen=latency_window)  # Последние успешные ответы всех эндпоинтов
+
+    def _score(self, endpoint, known_latencies):
+        # Новый эндпоинт оцениваем по лучшей известной задержке, чтобы он получил запросы и был измерен
+        latency = endpoint.latency if endpoint.latency is not None else min(known_latencies, default=1.0)
+        return endpoint.weight / max(latency, 0.001) / (1 + endpoint.in_flight)
+
+    def _probe_busy(self, endpoint, now):
+        return endpoint.probe_started is not None and now - endpoint.probe_started < self.open_seconds
+
+    def _selectable(self, endpoint, now):
+        if endpoint.is_open(now) or endpoint.weight <= 0:
+            return False
+        return not (endpoint.is_half_open(now) and self._probe_busy(endpoint, now))
+
+    def acquire(self, exclude: Endpoint | None = None) -> Endpoint | None:
+        """Выбирает эндпоинт для запроса (или None, если все выведены из ротации). exclude - кроме этого."""
+        with self.lock:
+            now = time.time()
+            available = [ep for ep in self.endpoints if self._selectable(ep, now) and ep is not exclude]
+            if not available:
+                return None
+            known_latencies = [ep.latency for ep in available if ep.latency is not None]
+            scores = [self._score(ep, known_latencies) for ep in available]
+            endpoint = self.random.choices(available, weights=scores)[0]
+            endpoint.in_flight += 1
+            if endpoint.is_half_open(now):
+                endpoint.probe_started = now
+        if endpoint.client is None:
+            with endpoint.connect_lock:
+                if endpoint.client is None and endpoint.connect:
+                    endpoint.client = endpoint.connect()
+            if endpoint.client is None:
+                self.release(endpoint)
+                with self.lock:
+                    endpoint.stats['failures'] += 1
+                    self._open(endpoint, self.open_seconds)
+                return self.acquire(exclude)
+        return endpoint
+
+    def release(self, endpoint: Endpoint, used: bool = True):
+        """
+        Освобождает эндпоинт после запроса. used=False - запрос не отправлялся (или отменен
+        без результата): проба полуоткрытого эндпоинта освобождается для следующего запроса.
+        """
+        with self.lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            if not used:
+                endpoint.probe_started = None
+
+    def record_success(self, endpoint: Endpoint, seconds: float):
+        with self.lock:
+            endpoint.stats['calls'] += 1
+            endpoint.consecutive_failures = 0
+            if endpoint.open_until:
+                print(f"  Эндпоинт {endpoint.url} возвращен в ротацию (пробный запрос успешен).")
+            endpoint.open_until = 0.0
+            endpoint.probe_started = None
+            self.recent_latencies.append(seconds)
+            if endpoint.latency is None:
+                endpoint.latency = seconds
+            else:
+                endpoint.latency += self.latency_alpha * (seconds - endpoint.latency)
+
+    def latency_percentile(self, percentile: float, min_samples: int) -> float | None:
+        """Перцентиль задержки последних успешных ответов (None, пока ответов меньше min_samples)."""
+        with self.lock:
+            samples = sorted(self.recent_latencies)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def record_failure(self, endpoint: Endpoint):
+        with self.lock:
+            endpoint.stats['failures'] += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.is_half_open(time.time()):
+                self._open(endpoint, self.open_seconds)
+                print(f"  Эндпоинт {endpoint.url}: пробный запрос не удался, выведен из ротации на {self.open_seconds:.0f} сек.")
+            elif endpoint.consecutive_failures >= self.failure_threshold:
+                self._open(endpoint, self.open_seconds)
+                print(f"  Эндпоинт {endpoint.url} выведен из ротации на {self.open_seconds:.0f} сек. "
+                      f"({endpoint.consecutive_failures} ошибок подряд).")
+
+    def record_quota(self, endpoint: Endpoint, wait_seconds: float):
+        with self.lock:
+            endpoint.stats['quota_hits'] += 1
+            self._open(endpoint, wait_seconds)
+            print(f"  Эндпоинт {endpoint.url} выведен из ротации до восстановления квоты ({wait_seconds / 60:.1f} мин).")
+
+    def open_for(self, endpoint: Endpoint, seconds: float):
+        """Выводит эндпоинт из ротации (например, по сохраненному состоянию квоты при запуске)."""
+        with self.lock:
+            self._open(endpoint, seconds)
+
+    def _open(self, endpoint, seconds):
+        endpoint.open_until = max(endpoint.open_until, time.time() + seconds)
+        endpoint.probe_started = None
+        endpoint.stats['opened'] += 1
+
+    def seconds_until_available(self) -> float:
+        """Через сколько секунд хотя бы один эндпоинт вернется в ротацию (0 - уже доступен)."""
+        with self.lock:
+            now = time.time()
+            candidates = []
+            for ep in self.endpoints:
+                if ep.weight <= 0:
+                    continue
+                if ep.is_half_open(now) and self._probe_busy(ep, now):
+                    # Результат пробы неизвестен заранее: проверяем снова через probe_poll_seconds
+                    candidates.append(min(self.probe_poll_seconds, ep.probe_started + self.open_seconds - now))
+                else:
+                    candidates.append(ep.open_until - now)
+            return max(0.0, min(candidates, default=0.0))
+
+    def next_reopening(self) -> Endpoint | None:
+        """Эндпоинт, раньше других возвращающийся в ротацию (None, если в пуле нет эндпоинтов с весом > 0)."""
+        with self.lock:
+            candidates = [ep for ep in self.endpoints if ep.weight > 0]
+            return min(candidates, key=lambda ep: ep.open_until, default=None)
+
+
+class HedgeBudget:
+    """
+    Бюджет дублирующих (hedged) запросов: дубликатов не больше fraction от основных запросов
+    (плюс один, чтобы хеджирование работало и в начале запуска). Ограничивает расход квоты.
+    """
+    def __init__(self, fraction: float):
+        self.fraction = fraction
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'cancelled': 0}
+
+    def record_request(self):
+        with self.lock:
+            self.stats['requests'] += 1
+
+    def try_spend(self) -> bool:
+        with self.lock:
+            if self.stats['hedges'] + 1 > self.fraction * self.stats['requests'] + 1:
+                return False
+            self.stats['hedges'] += 1
+            return True
+
+    def record(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
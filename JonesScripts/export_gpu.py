@@ -0,0 +1,233 @@
+import re
+import sys
+import time
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from conf import Config
+from fsutil import display_path
+from context import get_context
+from shard import add_shard_argument, in_shard, use_shard_state_files, save_shard_summary
+from usage_index import apply_usage
+from mat_format import mip_sizes
+from used_store import used_png_sources, open_used_source, used_source_mtime
+
+config = Config()
+
+# Экспорт финальных RGBA текстур в блочно-сжатые форматы GPU (BC1/BC3/BC7) в контейнерах DDS и KTX2
+# с полной цепочкой mip-уровней. Группы CEL ({имя}__cel_N) экспортируются одним массивом текстур.
+# Источник - PNG в PROCESSED_PNG_DIR (до запаковки) или использованный (после запаковки, в том числе из архива USED_DIR).
+
+CEL_NAME = re.compile(r'^(.*)__cel_(\d+)$', re.IGNORECASE)
+
+# Формат -> (DXGI UNORM, DXGI SRGB, FourCC без DX10 или None)
+DDS_FORMATS = {"bc1": (71, 72, b'DXT1'), "bc3": (77, 78, b'DXT5'), "bc7": (98, 99, None)}
+# Формат -> (VkFormat UNORM, VkFormat SRGB, цветовая модель KHR_DF, [(смещение бит, длина бит, канал)])
+KTX2_FORMATS = {
+    "bc1": (131, 132, 128, [(0, 64, 0)]),
+    "bc3": (137, 138, 130, [(0, 64, 15), (64, 64, 0)]),
+    "bc7": (145, 146, 134, [(0, 128, 0)]),
+}
+KTX2_IDENTIFIER = b'\xabKTX 20\xbb\r\n\x1a\n'
+
+_DDS_HEADER = struct.Struct('<4s7I44x2I4s5I5I')  # 'DDS ', DDS_HEADER (124 байта) с DDS_PIXELFORMAT
+_DDS_HEADER_DX10 = struct.Struct('<5I')
+_KTX2_HEADER = struct.Struct('<12s9I4I2Q')
+_KTX2_LEVEL = struct.Struct('<3Q')
+
+
+def collect_export_groups():
+    """Имя текстуры -> [PNG] (один PNG или кадры CEL по порядку). PROCESSED_PNG_DIR важнее использованных."""
+    sources = {png_path.stem.lower(): png_path for png_path in used_png_sources()}
+    if config.PROCESSED_PNG_DIR.is_dir():
+        for png_path in config.PROCESSED_PNG_DIR.glob('*.png'):
+            sources[png_path.stem.lower()] = png_path
+    groups = {}
+    for png_path in sources.values():
+        match = CEL_NAME.match(png_path.stem)
+        base, index = (match.group(1), int(match.group(2))) if match else (png_path.stem, None)
+        groups.setdefault(base, []).append((index if index is not None else -1, png_path))
+    return {base: [path for _, path in sorted(frames)] for base, frames in sorted(groups.items())}
+
+
+def choose_format(layers) -> str:
+    if config.EXPORT_FORMAT != "auto":
+        return config.EXPORT_FORMAT
+    has_alpha = any(pixels.shape[2] == 4 and (pixels[..., 3] < 255).any() for pixels in layers)
+    return "bc3" if has_alpha else "bc1"
+
+
+def export_mip_sizes(width, height):
+    """Размеры уровней от основного до 1x1 (или только основной, если EXPORT_MIPMAPS выключен)."""
+    count = max(width, height).bit_length() if config.EXPORT_MIPMAPS else 1
+    return mip_sizes(width, height, count)
+
+
+def dds_bytes(fmt, width, height, layers_levels, array) -> bytes:
+    """
+    DDS: для BC1/BC3 без sRGB и массивов - классический FourCC (читают старые загрузчики),
+    иначе расширенный заголовок DX10. Данные: для каждого слоя все mip-уровни подряд.
+    """
+    dxgi_unorm, dxgi_srgb, fourcc = DDS_FORMATS[fmt]
+    use_dx10 = fourcc is None or array or config.EXPORT_SRGB
+    level_count = len(layers_levels[0])
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000 | (0x20000 if level_count > 1 else 0)
+    caps = 0x1000 | (0x8 | 0x400000 if level_count > 1 else 0)
+    header = _DDS_HEADER.pack(b'DDS ', 124, flags, height, width, len(layers_levels[0][0]), 0, level_count,
+                              32, 0x4, b'DX10' if use_dx10 else fourcc, 0, 0, 0, 0, 0,
+                              caps, 0, 0, 0, 0)
+    parts = [header]
+    if use_dx10:
+        parts.append(_DDS_HEADER_DX10.pack(dxgi_srgb if config.EXPORT_SRGB else dxgi_unorm, 3, 0, len(layers_levels), 0))
+    for levels in layers_levels:
+        parts.extend(levels)
+    return b''.join(parts)
+
+
+def _ktx2_dfd(fmt) -> bytes:
+    """Data Format Descriptor KTX2: один базовый блок с образцами блочного формата."""
+    _, _, color_model, samples = KTX2_FORMATS[fmt]
+    block_bytes = samples[-1][0] // 8 + samples[-1][1] // 8
+    transfer = 2 if config.EXPORT_SRGB else 1
+    body = struct.pack('<4B4B8B', color_model, 1, transfer, 0, 3, 3, 0, 0, block_bytes, 0, 0, 0, 0, 0, 0, 0)
+    for bit_offset, bit_length, channel in samples:
+        # Альфа хранится линейно даже в sRGB текстуре (квалификатор KHR_DF_SAMPLE_DATATYPE_LINEAR)
+        qualifiers = 0x10 if channel == 15 and config.EXPORT_SRGB else 0
+        body += struct.pack('<HBB4BII', bit_offset, bit_length - 1, channel | qualifiers, 0, 0, 0, 0, 0, 0xFFFFFFFF)
+    block = struct.pack('<IHH', 0, 2, 8 + len(body)) + body
+    return struct.pack('<I', 4 + len(block)) + block
+
+
+def ktx2_bytes(fmt, width, height, layers_levels, array) -> bytes:
+    """KTX2 без суперсжатия: уровни в файле от меньшего к большему, внутри уровня - все слои."""
+    from bcn import BLOCK_BYTES
+    vk_unorm, vk_srgb, _, _ = KTX2_FORMATS[fmt]
+    level_count = len(layers_levels[0])
+    dfd = _ktx2_dfd(fmt)
+    dfd_offset = _KTX2_HEADER.size + _KTX2_LEVEL.size * level_count
+    data_start = dfd_offset + len(dfd)
+    alignment = BLOCK_BYTES[fmt]  # НОК размера блока (8/16 байт) и 4
+
+    levels_data = [b''.join(levels[level] for levels in layers_levels) for level in range(level_count)]
+    offsets = [0] * level_count
+    position = data_start
+    chunks = []
+    for level in reversed(range(level_count)):
+        padding = -position % alignment
+        chunks.append(b'\0' * padding + levels_data[level])
+        offsets[level] = position + padding
+        position = offsets[level] + len(levels_data[level])
+
+    header = _KTX2_HEADER.pack(KTX2_IDENTIFIER, vk_srgb if config.EXPORT_SRGB else vk_unorm, 1, width, height, 0,
+                               len(layers_levels) if array else 0, 1, level_count, 0,
+                               dfd_offset, len(dfd), 0, 0, 0, 0)
+    level_index = b''.join(_KTX2_LEVEL.pack(offsets[level], len(levels_data[level]), len(levels_data[level]))
+                           for level in range(level_count))
+    return header + level_index + dfd + b''.join(chunks)
+
+
+CONTAINER_WRITERS = {"dds": dds_bytes, "ktx2": ktx2_bytes}
+
+
+def export_texture(base_name, png_paths):
+    """Сжимает текстуру (или массив кадров CEL) во все контейнеры EXPORT_CONTAINERS. Возвращает статус."""
+    import numpy as np
+    from PIL import Image
+    from bcn import encode_blocks
+    from imageutil import build_mip_chain
+
+    get_context().track_asset(base_name)
+    array = CEL_NAME.match(png_paths[0].stem) is not None
+    targets = [config.EXPORT_DIR / f"{base_name}.{container}" for container in config.EXPORT_CONTAINERS]
+    newest_source = max(used_source_mtime(path) for path in png_paths)
+    if all(target.exists() and target.stat().st_mtime >= newest_source for target in targets):
+        return 'skipped'
+
+    try:
+        layers = []
+        for png_path in png_paths:
+            with Image.open(open_used_source(png_path)) as img:
+                layers.append(np.asarray(img.convert("RGBA" if img.mode in ('RGBA', 'LA', 'P', 'PA') else "RGB")))
+    except OSError as e:
+        print(f"  ОШИБКА: Не удалось прочитать {base_name}: {e}")
+        return 'error_read'
+    height, width = layers[0].shape[:2]
+    if any(layer.shape[:2] != (height, width) for layer in layers):
+        print(f"  ОШИБКА: {base_name}: кадры CEL разного размера, массив текстур невозможен.")
+        return 'error_size_mismatch'
+
+    fmt = choose_format(layers)
+    sizes = export_mip_sizes(width, height)
+    layers_levels = [[encode_blocks(level, fmt) for level in build_mip_chain(pixels, sizes)] for pixels in layers]
+    try:
+        for container, target in zip(config.EXPORT_CONTAINERS, targets):
+            part_path = target.with_name(target.name + ".part")
+            part_path.write_bytes(CONTAINER_WRITERS[container](fmt, width, height, layers_levels, array))
+            part_path.replace(target)
+    except OSError as e:
+        print(f"  ОШИБКА: Не удалось записать {base_name}: {e}")
+        return 'error_write'
+    layer_note = f", массив из {len(layers)}" if array else ""
+    print(f"  {base_name}: {width}x{height} {fmt.upper()}, mip-уровней {len(layers_levels[0])}{layer_note}")
+    return 'success'
+
+
+def print_summary_report_export(total_textures, status_counts, elapsed):
+    print("\n--- Экспорт текстур для GPU Завершен ---")
+    print(f"Всего текстур (массивы CEL считаются одной): {total_textures} за {elapsed:.2f} сек.")
+    print(f"Экспортировано: {status_counts.get('success', 0)}")
+    if status_counts.get('skipped', 0) > 0:
+        print(f"Пропущено (экспорт новее PNG): {status_counts['skipped']}")
+    errors = sum(count for status, count in status_counts.items() if status.startswith('error_'))
+    print(f"Ошибок: {errors}")
+    for status, count in sorted(status_counts.items()):
+        if status.startswith('error_'):
+            print(f"  - {status}: {count}")
+    print(f"\nРезультаты: {config.EXPORT_DIR}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Экспорт финальных текстур в BC1/BC3/BC7 (DDS/KTX2) с mip-уровнями.")
+    parser.add_argument("--format", choices=["auto", "bc1", "bc3", "bc7"], default=None,
+                        help=f"Формат сжатия (по умолчанию {config.EXPORT_FORMAT}).")
+    parser.add_argument("--container", choices=list(CONTAINER_WRITERS), nargs="+", default=None,
+                        help=f"Контейнеры (по умолчанию {' '.join(config.EXPORT_CONTAINERS)}).")
+    parser.add_argument("--workers", type=int, default=config.EXPORT_WORKERS, help="Текстур, сжимаемых параллельно.")
+    add_shard_argument(parser)
+    args = parser.parse_args(argv)
+    use_shard_state_files(args.shard)
+    if args.format:
+        Config.EXPORT_FORMAT = args.format
+    if args.container:
+        Config.EXPORT_CONTAINERS = tuple(args.container)
+
+    print("\n--- Экспорт текстур для GPU (блочное сжатие BCn) ---")
+    groups = collect_export_groups()
+    if args.shard is not None:
+        selected = {base: paths for base, paths in groups.items() if in_shard(base, args.shard)}
+        print(f"   Шард {args.shard[0]}/{args.shard[1]}: отобрано {len(selected)} из {len(groups)} текстур.")
+        groups = selected
+    groups = dict(apply_usage(groups.items(), "текстур", key=lambda item: item[0]))
+    if not groups:
+        print(f"Нет PNG для экспорта в {display_path(config.PROCESSED_PNG_DIR)} и {display_path(config.USED_DIR)}.")
+        save_shard_summary("export", args.shard, {'total_textures': 0, 'status_counts': {}, 'elapsed': 0.0})
+        sys.exit(0)
+
+    config.EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"Текстур: {len(groups)}, формат: {config.EXPORT_FORMAT}, контейнеры: {', '.join(config.EXPORT_CONTAINERS)}, "
+          f"потоков: {args.workers}")
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        statuses = list(executor.map(lambda item: export_texture(*item), groups.items()))
+    elapsed = time.time() - start_time
+
+    status_counts = {}
+    for status in statuses:
+        status_counts[status] = status_counts.get(status, 0) + 1
+    print_summary_report_export(len(groups), status_counts, elapsed)
+    save_shard_summary("export", args.shard, {'total_textures': len(groups), 'status_counts': status_counts, 'elapsed': elapsed})
+    get_context().record_phase("export", status_counts, elapsed)
+
+
+if __name__ == "__main__":
+    main()
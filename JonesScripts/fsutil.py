@@ -0,0 +1,59 @@
+import os
+import errno
+import shutil
+from pathlib import Path
+from conf import Config
+
+config = Config()
+
+
+def _fsync_directory(directory: Path):
+    """Сбрасывает на диск запись каталога (новое имя файла). На Windows каталоги так не открываются."""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def safe_move(src, dst):
+    """
+    Перемещает файл, в том числе между томами (scratch -> durable).
+    В пределах тома - атомарное переименование. Между томами - копия во временный файл
+    рядом с целью, fsync, переименование в цель и только затем удаление исходного:
+    при сбое на любом шаге файл остается хотя бы в одном месте целиком.
+    Существующий файл назначения перезаписывается (как shutil.move).
+    """
+    src, dst = Path(src), Path(dst)
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    part_path = dst.with_name(dst.name + ".part")
+    try:
+        with open(src, 'rb') as fsrc, open(part_path, 'wb') as fdst:
+            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+        shutil.copystat(src, part_path)
+        os.replace(part_path, dst)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    _fsync_directory(dst.parent)
+    src.unlink()
+
+
+def display_path(path: Path) -> Path:
+    """Путь для лога: относительно папки промежуточных файлов, результатов или ресурсов (или полный)."""
+    for root in (config.SCRATCH_DIR, config.DURABLE_DIR, config.BASE_DIR):
+        try:
+            return path.relative_to(root)
+        except ValueError:
+            continue
+    return path
@@ -0,0 +1,149 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+def downscale_pixels(pixels: np.ndarray, width: int, height: int, binary_alpha: bool = False) -> np.ndarray:
+    """
+    Уменьшает изображение (H x W x C, uint8) до width x height.
+    При целом коэффициенте - усреднение блоков одной операцией NumPy с учетом альфы
+    (premultiplied), иначе - Lanczos из PIL. binary_alpha оставляет альфу 0/255 (rgba5551).
+    """
+    src_height, src_width = pixels.shape[:2]
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    has_alpha = channels == 4
+
+    if src_width % width == 0 and src_height % height == 0:
+        factor_y, factor_x = src_height // height, src_width // width
+        data = pixels.reshape(src_height, src_width, channels).astype(np.float32)
+        if has_alpha:
+            data[..., :3] *= data[..., 3:4] / 255.0
+        blocks = data.reshape(height, factor_y, width, factor_x, channels).mean(axis=(1, 3))
+        if has_alpha:
+            alpha = blocks[..., 3:4]
+            np.divide(blocks[..., :3] * 255.0, alpha, out=blocks[..., :3], where=alpha > 0)
+        result = np.clip(np.rint(blocks), 0, 255).astype(np.uint8)
+        if pixels.ndim == 2:
+            result = result[..., 0]
+    else:
+        result = np.asarray(Image.fromarray(pixels).resize((width, height), Image.Resampling.LANCZOS))
+
+    if has_alpha and binary_alpha:
+        result = result.copy()
+        result[..., 3] = np.where(result[..., 3] >= 128, 255, 0)
+    return result
+
+
+def preserve_alpha_coverage(levels: list[np.ndarray], threshold: int) -> list[np.ndarray]:
+    """
+    Бинаризует альфу mip-уровней так, чтобы доля непрозрачных пикселей на каждом уровне совпадала
+    с долей на основном уровне (порог alpha >= threshold). Простой порог на уменьшенных уровнях
+    съедает тонкие детали (решетки, листва) и они исчезают с расстоянием.
+    """
+    coverage = float((levels[0][..., 3] >= threshold).mean())
+    result = []
+    for index, level in enumerate(levels):
+        alpha = level[..., 3].ravel()
+        if index == 0:
+            opaque = alpha >= threshold
+        else:
+            # Непрозрачными становятся keep пикселей с наибольшей альфой (при равной альфе - любые из них)
+            keep = int(round(coverage * alpha.size))
+            opaque = np.zeros(alpha.size, dtype=bool)
+            if keep:
+                opaque[np.argpartition(alpha, alpha.size - keep)[alpha.size - keep:]] = True
+        level = level.copy()
+        level[..., 3] = np.where(opaque, 255, 0).reshape(level.shape[:2])
+        result.append(level)
+    return result
+
+
+def build_mip_chain(pixels: np.ndarray, sizes: list[tuple[int, int]], coverage_threshold: int | None = None) -> list[np.ndarray]:
+    """
+    Цепочка mip-уровней (от большего к меньшему, как в MAT и DDS) из одного основного уровня:
+    каждый уровень уменьшается из предыдущего с учетом альфы. coverage_threshold - для 1-битной
+    альфы (rgba5551, прозрачные палитровые): альфа бинаризуется с сохранением покрытия.
+    """
+    levels = [pixels]
+    for width, height in sizes[1:]:
+        levels.append(downscale_pixels(levels[-1], width, height))
+    if coverage_threshold is not None and pixels.ndim == 3 and pixels.shape[2] == 4:
+        levels = preserve_alpha_coverage(levels, coverage_threshold)
+    return levels
+
+
+def resize_png_file(png_path: Path, width: int, height: int, binary_alpha: bool = False):
+    """Уменьшает PNG на месте до указанного размера."""
+    with Image.open(png_path) as img:
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA')
+        pixels = np.asarray(img)
+    resized = downscale_pixels(pixels, width, height, binary_alpha)
+    Image.fromarray(resized).save(png_path, "PNG")
+
+
+def read_rgba_pixels(png_source) -> np.ndarray:
+    """PNG (путь или файловый объект) -> RGBA (H x W x 4, uint8), например эталон для mat_format.spot_check_texture."""
+    with Image.open(png_source) as img:
+        return np.asarray(img.convert('RGBA'))
+
+
+def classify_trivial_texture(pixels: np.ndarray, max_tiny_size: int, solid_tolerance: int,
+                             gradient_max_residual: float, sample_pixels: int = 65536) -> str | None:
+    """
+    Определяет простые текстуры, которым не нужен нейросетевой апскейл (только RGB, альфа отдельно):
+    'tiny' - маленькие образцы цвета, 'solid' - заливка одним цветом (с допуском),
+    'gradient' - почти линейный градиент (остаток аппроксимации плоскостью мал).
+    Возвращает тип или None. Большие изображения оцениваются по равномерной выборке пикселей.
+    """
+    height, width = pixels.shape[:2]
+    if max(width, height) <= max_tiny_size:
+        return 'tiny'
+    rgb = pixels[..., :3] if pixels.ndim == 3 else pixels[..., None]
+    step = max(1, int(np.sqrt(width * height / sample_pixels)))
+    sample = rgb[::step, ::step].astype(np.float32)
+
+    # Оценка по выборке, подтверждение - по всем пикселям (тонкие детали могут не попасть в выборку)
+    if np.ptp(sample, axis=(0, 1)).max() <= solid_tolerance:
+        if np.ptp(rgb, axis=(0, 1)).max() <= solid_tolerance:
+            return 'solid'
+        return None
+
+    ys, xs = np.mgrid[0:sample.shape[0], 0:sample.shape[1]] * step
+    design = np.stack([xs.ravel(), ys.ravel(), np.ones(xs.size)], axis=1).astype(np.float32)
+    values = sample.reshape(-1, sample.shape[2])
+    coefficients, residuals, _, _ = np.linalg.lstsq(design, values, rcond=None)
+    if not residuals.size or np.sqrt(residuals.max() / values.shape[0]) > gradient_max_residual:
+        return None
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    fitted = xs[..., None] * coefficients[0] + ys[..., None] * coefficients[1] + coefficients[2]
+    residual = np.sqrt(np.mean((rgb - fitted) ** 2, axis=(0, 1))).max()
+    return 'gradient' if residual <= gradient_max_residual else None
+
+
+def upscale_trivial_png(src_path: Path, dst_path: Path, scale: int, kind: str):
+    """Локальный апскейл простой текстуры: заливки и образцы - NEAREST, градиенты - BICUBIC."""
+    with Image.open(src_path) as img:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        resample = Image.Resampling.BICUBIC if kind == 'gradient' else Image.Resampling.NEAREST
+        img.resize((img.width * scale, img.height * scale), resample).save(dst_path, "PNG")
+
+
+def edge_density(pixels: np.ndarray, threshold: float, max_side: int = 256) -> float:
+    """
+    Доля пикселей-краев: перепад яркости с соседом по горизонтали или вертикали больше threshold.
+    Большие изображения оцениваются по прореженной копии (не больше max_side по стороне).
+    """
+    rgb = pixels[..., :3] if pixels.ndim == 3 else pixels[..., None]
+    step = max(1, -(-max(rgb.shape[:2]) // max_side))
+    sample = rgb[::step, ::step].astype(np.float32)
+    luma = sample @ np.array([0.299, 0.587, 0.114], dtype=np.float32) if sample.shape[2] == 3 else sample[..., 0]
+    if luma.shape[0] < 2 or luma.shape[1] < 2:
+        return 0.0
+    edges = np.zeros(luma.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(luma, axis=1)) > threshold
+    edges[1:, :] |= np.abs(np.diff(luma, axis=0)) > threshold
+    return float(edges.mean())
+
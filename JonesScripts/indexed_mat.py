@@ -0,0 +1,198 @@
+import fnmatch
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from conf import Config
+from imageutil import build_mip_chain
+from mat_format import read_mat_header, mip_sizes, write_mat, INDEXED_TRANSPARENT_INDEX
+
+config = Config()
+
+# Палитровые (8-bit indexed) MAT: пиксель - индекс в палитре CMP файла.
+# Сам MAT не ссылается на палитру (ее задает уровень), поэтому CMP выбирается по настройкам
+# INDEXED_PALETTE_CMP / INDEXED_PALETTE_OVERRIDES.
+# CMP: заголовок (64 байта): 'CMP ', version, transparency, заполнение; палитра 256 x RGB (768 байт);
+# затем таблицы освещения и прозрачности (не используются).
+CMP_MAGIC = b'CMP '
+CMP_HEADER_SIZE = 64
+PALETTE_SIZE = 256
+TRANSPARENT_INDEX = INDEXED_TRANSPARENT_INDEX
+
+_cache_lock = threading.Lock()
+_palette_cache = {}  # (путь, размер, mtime) -> палитра 256 x 3
+_quantizer_cache = {}  # (палитра, прозрачность, бит LUT) -> PaletteQuantizer
+
+
+def load_cmp_palette(cmp_path: Path) -> np.ndarray:
+    """Читает палитру CMP (256 x 3, uint8). Палитра кэшируется, пока файл не изменится."""
+    stat = cmp_path.stat()
+    cache_key = (str(cmp_path.resolve()).lower(), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        cached = _palette_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    with open(cmp_path, 'rb') as f:
+        raw = f.read(CMP_HEADER_SIZE + PALETTE_SIZE * 3)
+    if raw[:4] != CMP_MAGIC:
+        raise ValueError(f"Неверная сигнатура CMP в {cmp_path.name}: {raw[:4]!r}")
+    if len(raw) < CMP_HEADER_SIZE + PALETTE_SIZE * 3:
+        raise ValueError(f"Файл {cmp_path.name} обрезан: нет полной палитры")
+    palette = np.frombuffer(raw, dtype=np.uint8, count=PALETTE_SIZE * 3, offset=CMP_HEADER_SIZE).reshape(PALETTE_SIZE, 3)
+    palette.flags.writeable = False
+    with _cache_lock:
+        _palette_cache[cache_key] = palette
+    return palette
+
+
+def palette_path_for(mat_name: str) -> Path:
+    """CMP для MAT: первая подходящая маска из INDEXED_PALETTE_OVERRIDES, иначе INDEXED_PALETTE_CMP."""
+    for pattern, cmp_path in config.INDEXED_PALETTE_OVERRIDES.items():
+        if fnmatch.fnmatch(mat_name.lower(), pattern.lower()):
+            return Path(cmp_path)
+    return Path(config.INDEXED_PALETTE_CMP)
+
+
+def load_palette_for(mat_path: Path) -> np.ndarray | None:
+    cmp_path = palette_path_for(mat_path.name)
+    try:
+        return load_cmp_palette(cmp_path)
+    except (OSError, ValueError) as e:
+        print(f"  ОШИБКА: Не удалось загрузить палитру {cmp_path} для {mat_path.name}: {e}")
+        return None
+
+
+def decode_indexed_texture(mat_path: Path, texture: dict, palette: np.ndarray) -> np.ndarray:
+    """
+    Декодирует верхний mip-уровень палитровой текстуры одной выборкой из таблицы:
+    RGB (H x W x 3) или RGBA (H x W x 4) с прозрачным индексом 0, если у текстуры флаг transparent.
+    """
+    width, height = texture['width'], texture['height']
+    indices = np.fromfile(mat_path, dtype=np.uint8, count=width * height, offset=texture['data_offset'])
+    if indices.size != width * height:
+        raise ValueError(f"данные текстуры обрезаны ({indices.size}/{width * height} байт)")
+    if texture['transparent']:
+        table = np.empty((PALETTE_SIZE, 4), dtype=np.uint8)
+        table[:, :3] = palette
+        table[:, 3] = 255
+        table[TRANSPARENT_INDEX, 3] = 0
+    else:
+        table = palette
+    return table[indices.reshape(height, width)]
+
+
+def extract_indexed_mat(mat_path: Path, output_dir: Path) -> bool:
+    """
+    Извлекает палитровый MAT в PNG без matool, с теми же именами, что и matool extract:
+    {имя}.png для одной текстуры, {имя}__cel_{N}.png для нескольких.
+    """
+    header = read_mat_header(mat_path)
+    if header['error']:
+        print(f"  ОШИБКА: {header['error']}")
+        return False
+    palette = load_palette_for(mat_path)
+    if palette is None:
+        return False
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    textures = header['textures']
+    try:
+        for index, texture in enumerate(textures):
+            name = f"{mat_path.stem}.png" if len(textures) == 1 else f"{mat_path.stem}__cel_{index}.png"
+            Image.fromarray(decode_indexed_texture(mat_path, texture, palette)).save(output_dir / name, "PNG")
+    except (OSError, ValueError) as e:
+        print(f"  ОШИБКА: Не удалось декодировать палитровый {mat_path.name}: {e}")
+        return False
+    print(f"  Палитровый MAT декодирован без matool: {len(textures)} текстур(ы), палитра {palette_path_for(mat_path.name).name}")
+    return True
+
+
+class PaletteQuantizer:
+    """
+    Поиск ближайшего цвета палитры через 3D таблицу: RGB с точностью lut_bits бит на канал -> индекс.
+    Таблица строится один раз полным перебором (центр ячейки против всех цветов палитры),
+    после чего квантование изображения - одна выборка из таблицы.
+    При прозрачности индекс 0 зарезервирован под прозрачные пиксели и для цветов не выбирается.
+    """
+    def __init__(self, palette: np.ndarray, transparent: bool, lut_bits: int = 6):
+        self.transparent = transparent
+        self.lut_bits = lut_bits
+        self.shift = 8 - lut_bits
+        levels = 1 << lut_bits
+        centers = (np.arange(levels, dtype=np.float32) + 0.5) * (1 << self.shift)
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing='ij'), axis=-1).reshape(-1, 3)
+
+        candidates = np.arange(PALETTE_SIZE)
+        if transparent:
+            candidates = candidates[candidates != TRANSPARENT_INDEX]
+        colors = palette[candidates].astype(np.float32)
+        self.lut = np.empty(grid.shape[0], dtype=np.uint8)
+        chunk = 16384
+        for start in range(0, grid.shape[0], chunk):
+            block = grid[start:start + chunk]
+            # |a - b|^2 = |a|^2 - 2ab + |b|^2; |a|^2 одинаков для строки и на argmin не влияет
+            distances = (colors * colors).sum(axis=1) - 2.0 * block @ colors.T
+            self.lut[start:start + chunk] = candidates[distances.argmin(axis=1)]
+
+    def quantize(self, pixels: np.ndarray) -> np.ndarray:
+        """RGB/RGBA (H x W x C, uint8) -> индексы (H x W, uint8)."""
+        rgb = pixels[..., :3] >> self.shift
+        keys = (rgb[..., 0].astype(np.intp) << (2 * self.lut_bits)) | (rgb[..., 1].astype(np.intp) << self.lut_bits) | rgb[..., 2]
+        indices = self.lut[keys]
+        if self.transparent and pixels.shape[-1] == 4:
+            indices[pixels[..., 3] < config.ALPHA_BINARY_THRESHOLD] = TRANSPARENT_INDEX
+        return indices
+
+
+def get_quantizer(palette: np.ndarray, transparent: bool) -> PaletteQuantizer:
+    cache_key = (palette.tobytes(), transparent, config.INDEXED_LUT_BITS)
+    with _cache_lock:
+        quantizer = _quantizer_cache.get(cache_key)
+    if quantizer is None:
+        quantizer = PaletteQuantizer(palette, transparent, config.INDEXED_LUT_BITS)
+        with _cache_lock:
+            _quantizer_cache[cache_key] = quantizer
+    return quantizer
+
+
+def encode_indexed_texture(palette: np.ndarray, texture: dict, png_path: Path) -> tuple[int, int, list[bytes]]:
+    """PNG -> (width, height, [индексы mip-уровней]) с числом уровней и прозрачностью как у texture."""
+    with Image.open(png_path) as img:
+        pixels = np.asarray(img.convert("RGBA" if texture['transparent'] else "RGB"))
+    height, width = pixels.shape[:2]
+    quantizer = get_quantizer(palette, texture['transparent'])
+    levels = build_mip_chain(pixels, mip_sizes(width, height, texture['mipmap_count']),
+                             config.ALPHA_BINARY_THRESHOLD if texture['transparent'] else None)
+    return width, height, [quantizer.quantize(level).tobytes() for level in levels]
+
+
+def write_indexed_mat(original_mat_path: Path, final_mat_path: Path, png_paths: list[Path]) -> bool:
+    """
+    Запаковывает PNG (по одному на текстуру) в палитровый MAT без matool: каждый mip-уровень
+    строится из предыдущего (прозрачность - с сохранением покрытия) и квантуется в палитру
+    исходного MAT. Число mip-уровней - как в исходном.
+    """
+    header = read_mat_header(original_mat_path)
+    if header['error']:
+        print(f"  ОШИБКА: {header['error']}")
+        return False
+    if len(png_paths) != len(header['textures']):
+        print(f"  ОШИБКА: Передано {len(png_paths)} PNG, в исходном {original_mat_path.name} текстур: {len(header['textures'])}.")
+        return False
+    palette = load_palette_for(original_mat_path)
+    if palette is None:
+        return False
+
+    try:
+        textures = [encode_indexed_texture(palette, texture, png_path)
+                    for texture, png_path in zip(header['textures'], png_paths)]
+        final_mat_path.parent.mkdir(parents=True, exist_ok=True)
+        write_mat(final_mat_path, header, original_mat_path, textures)
+    except (OSError, ValueError) as e:
+        print(f"  ОШИБКА: Не удалось запаковать палитровый {final_mat_path.name}: {e}")
+        return False
+    print(f"  Успех: палитровый {final_mat_path.name} запакован без matool в {final_mat_path.parent.name}.")
+    return True
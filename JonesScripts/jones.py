@@ -0,0 +1,109 @@
+import sys
+import time
+import inspect
+import importlib
+from context import get_context
+from shard import use_shard_state_files
+
+# Подкоманда -> (модуль, описание). Модули импортируются только при запуске подкоманды,
+# поэтому тяжелые зависимости (PIL, gradio_client, NumPy) не грузятся для простых команд.
+COMMANDS = {
+    'extract': ('1_extract_sort', "Извлечение MAT в PNG и сортировка по форматам"),
+    'cel-extract': ('cel_extract', "Извлечение CEL MAT (несколько текстур) в PNG"),
+    'upscale': ('2_convert_webp_ai', "Апскейл PNG через Hugging Face API"),
+    'worker': ('upscale_worker', "Воркер общей очереди апскейла (несколько машин/аккаунтов)"),
+    'pack': ('3_repack_mat', "Запаковка PNG в MAT"),
+    'cel-pack': ('cel_pack', "Запаковка CEL PNG в MAT"),
+    'export': ('export_gpu', "Экспорт финальных текстур в BC1/BC3/BC7 (DDS/KTX2) для GPU"),
+    'verify': ('verify_mat', "Проверка финальных MAT относительно исходных"),
+    'budget': ('texture_budget', "План памяти текстур финального пака"),
+    'plan': ('plan_run', "План запуска: оставшиеся стадии, оценка времени и квоты"),
+    'usage': ('usage_index', "Индекс использования текстур по уровням и моделям (пропуск неиспользуемых)"),
+    'bench': ('bench_e2e', "Сквозной замер конвейера на сгенерированном корпусе (без сети и matool)"),
+    'count': ('count_used', "Сравнение MAT с учтенными результатами в used"),
+    'used-store': ('used_store', "Архив использованных PNG: перенос отдельных файлов, статистика, извлечение"),
+    'routes': ('upscale_routing', "Маршруты апскейла по текстурам: предпросмотр правил UPSCALE_ROUTES"),
+    'rename': ('remove_cel_0', "Удаление '__cel_0' из имен файлов"),
+    'watch': ('watch_mats', "Режим наблюдения: новые MAT сразу проходят все стадии"),
+    'shards': ('shard', "Объединение итогов фаз, запущенных с --shard i/n"),
+}
+
+STANDALONE_COMMANDS = {'bench'}  # Не работают с папками конвейера этого процесса
+
+def print_usage():
+    print("Использование: python jones.py [--profile] <команда> [аргументы] [<команда> [аргументы] ...]")
+    print("Несколько команд выполняются последовательно в одном процессе с общими Tool, кэшем info и манифестом.")
+    print("Пример: python jones.py extract cel-extract upscale --wait-on-quota pack cel-pack")
+    print("Шарды: python jones.py extract --shard 1/4 upscale --shard 1/4 ... на каждой машине, затем jones.py shards")
+    print("--profile: профиль CPU (свернутые стеки для flamegraph) и памяти по фазам и ассетам.\n")
+    print("Команды:")
+    for name, (_, description) in COMMANDS.items():
+        print(f"  {name:<12} {description}")
+
+def split_commands(argv):
+    """Разбивает argv на [(команда, [аргументы]), ...] по именам подкоманд."""
+    steps = []
+    for arg in argv:
+        if arg in COMMANDS:
+            steps.append((arg, []))
+        elif steps:
+            steps[-1][1].append(arg)
+        else:
+            return None
+    return steps
+
+def run_command(name, args):
+    module_name, _ = COMMANDS[name]
+    use_shard_state_files(None)  # Каждая фаза начинает с общих файлов состояния; фаза с --shard задаст свои
+    module = importlib.import_module(module_name)
+    if inspect.signature(module.main).parameters:
+        module.main(args)  # Пустой список, а не None: иначе argparse фазы разберет весь sys.argv jones.py
+    else:
+        module.main()
+
+def finish_run(context, steps):
+    # bench запускает конвейер в дочернем процессе со своими папками; манифест этого процесса
+    # с путями Config по умолчанию не нужен (и создал бы BASE_DIR в текущей папке)
+    if any(name not in STANDALONE_COMMANDS for name, _ in steps):
+        context.save_manifest()
+        print(f"\nМанифест запуска: {context.config.RUN_MANIFEST_PATH}")
+    if context.profiler is not None:
+        context.profiler.stop()
+        context.profiler.write_reports(context.config.PROFILE_DIR, context.config.PROFILE_TOP_N)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    profile = '--profile' in argv[:1]
+    if profile:
+        argv = argv[1:]
+    steps = split_commands(argv)
+    if not steps:
+        print_usage()
+        sys.exit(0 if not argv or argv[0] in ('-h', '--help') else 2)
+
+    context = get_context()
+    if profile:
+        from profiler import PhaseProfiler
+        context.profiler = PhaseProfiler(context.config.PROFILE_INTERVAL)
+    for name, args in steps:
+        print(f"\n===== jones.py: {name} {' '.join(args)} =====")
+        start_time = time.time()
+        if context.profiler is not None:
+            context.profiler.start_phase(name)
+        try:
+            run_command(name, args)
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                print(f"\nКоманда '{name}' завершилась с кодом {e.code}. Последующие команды не выполняются.")
+                if context.profiler is not None:
+                    context.profiler.end_phase()
+                finish_run(context, steps)
+                sys.exit(e.code)
+        if context.profiler is not None:
+            context.profiler.end_phase()
+        print(f"===== {name}: {time.time() - start_time:.1f} сек. =====")
+
+    finish_run(context, steps)
+
+if __name__ == "__main__":
+    main()
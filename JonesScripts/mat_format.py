@@ -0,0 +1,326 @@
+import struct
+from pathlib import Path
+
+# Чтение MAT (Sith/Indiana Jones, версия 0x32) без запуска matool.exe.
+# Структура файла:
+#   заголовок (20 байт): 'MAT ', version, type (0 = цвета, 2 = текстуры), record_count, cel_count
+#   формат цвета (56 байт): mode (0 = indexed, 1 = RGB, 2 = RGBA), bpp, битность/сдвиги R,G,B, битность/сдвиги A
+#   record_count записей: 40 байт для текстур, 24 байта для цветов
+#   для каждой текстуры: заголовок (24 байта): width, height, transparent, 2 x unknown, mipmap_count,
+#   затем данные mip-уровней от большего к меньшему (width >> i) x (height >> i) x bpp / 8
+MAT_MAGIC = b'MAT '
+MAT_VERSION = 0x32
+MAT_TYPE_COLOR = 0
+MAT_TYPE_TEXTURE = 2
+
+_HEADER = struct.Struct('<4s4i')
+_COLOR_FORMAT = struct.Struct('<14I')
+_TEXTURE_HEADER = struct.Struct('<6i')
+_COLOR_FORMAT_FIELDS = ('mode', 'bpp', 'red_bpp', 'green_bpp', 'blue_bpp', 'red_shl', 'green_shl', 'blue_shl',
+                        'red_shr', 'green_shr', 'blue_shr', 'alpha_bpp', 'alpha_shl', 'alpha_shr')
+TEXTURE_RECORD_SIZE = 40
+COLOR_RECORD_SIZE = 24
+
+COLOR_MODE_INDEXED = 0
+COLOR_MODE_RGB = 1
+COLOR_MODE_RGBA = 2
+
+INDEXED_TRANSPARENT_INDEX = 0  # Прозрачный индекс палитровых текстур с флагом transparent
+
+# (mode, bpp, red_bpp, green_bpp, blue_bpp, alpha_bpp) -> стандартизированное имя, как в Tool.info
+_KNOWN_FORMATS = {
+    (COLOR_MODE_RGB, 16, 5, 6, 5, 0): "rgb565",
+    (COLOR_MODE_RGBA, 16, 4, 4, 4, 4): "rgba4444",
+    (COLOR_MODE_RGBA, 16, 5, 5, 5, 1): "rgba5551",
+}
+
+FORMATS_16BIT = frozenset(_KNOWN_FORMATS.values())
+
+# Формат цвета новых MAT (write_new_mat): mode, bpp, битность R,G,B, сдвиги влево R,G,B, сдвиги вправо R,G,B,
+# битность, сдвиг влево и вправо альфы - как у MAT, которые создает matool
+_NEW_COLOR_FORMATS = {
+    "rgb565": (COLOR_MODE_RGB, 16, 5, 6, 5, 11, 5, 0, 3, 2, 3, 0, 0, 0),
+    "rgba4444": (COLOR_MODE_RGBA, 16, 4, 4, 4, 12, 8, 4, 4, 4, 4, 4, 0, 4),
+    "rgba5551": (COLOR_MODE_RGBA, 16, 5, 5, 5, 11, 6, 1, 3, 3, 3, 1, 0, 7),
+    "indexed": (COLOR_MODE_INDEXED, 8, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+}
+# Запись текстуры: тип 8 (текстура), цвет, 4 x не используется, 4, 2 x не используется, номер текстуры
+_TEXTURE_RECORD = struct.Struct('<10i')
+
+
+def standardize_color_format(color_format: dict) -> str:
+    """Переводит формат цвета из заголовка MAT в имя формата, используемое скриптами."""
+    key = (color_format['mode'], color_format['bpp'], color_format['red_bpp'],
+           color_format['green_bpp'], color_format['blue_bpp'], color_format['alpha_bpp'])
+    if key in _KNOWN_FORMATS:
+        return _KNOWN_FORMATS[key]
+    if color_format['mode'] == COLOR_MODE_INDEXED:
+        return "indexed"
+    if color_format['mode'] == COLOR_MODE_RGBA:
+        return "rgba"
+    return "unknown"
+
+
+def mip_sizes(width: int, height: int, mipmap_count: int) -> list[tuple[int, int]]:
+    return [(max(1, width >> level), max(1, height >> level)) for level in range(mipmap_count)]
+
+
+def new_color_format(std_format: str) -> dict:
+    """Формат цвета (как header['color_format']) для нового MAT в формате std_format."""
+    return dict(zip(_COLOR_FORMAT_FIELDS, _NEW_COLOR_FORMATS[std_format]))
+
+
+def has_mip_levels(header: dict) -> bool:
+    """Хотя бы у одной текстуры MAT больше одного mip-уровня."""
+    return any(texture['mipmap_count'] > 1 for texture in header['textures'])
+
+
+def read_mat_header(mat_path: Path) -> dict:
+    """
+    Читает заголовки MAT файла (без данных пикселей) и возвращает словарь,
+    совместимый по основным ключам с результатом Tool.info.
+    """
+    result = {
+        'format_standardized': 'unknown',
+        'has_alpha': False,
+        'texture_count': None,
+        'mat_type': None,
+        'color_format': None,
+        'textures': [],
+        'file_size': None,
+        'error': None,
+    }
+    try:
+        file_size = mat_path.stat().st_size
+        result['file_size'] = file_size
+        with open(mat_path, 'rb') as f:
+            header_raw = f.read(_HEADER.size + _COLOR_FORMAT.size)
+            if len(header_raw) < _HEADER.size + _COLOR_FORMAT.size:
+                result['error'] = f"Файл {mat_path.name} слишком мал для заголовка MAT ({file_size} байт)"
+                return result
+
+            magic, version, mat_type, record_count, cel_count = _HEADER.unpack_from(header_raw, 0)
+            if magic != MAT_MAGIC:
+                result['error'] = f"Неверная сигнатура MAT в {mat_path.name}: {magic!r}"
+                return result
+            if version != MAT_VERSION:
+                result['error'] = f"Неподдерживаемая версия MAT в {mat_path.name}: {version:#x}"
+                return result
+
+            fields = _COLOR_FORMAT.unpack_from(header_raw, _HEADER.size)
+            color_format = dict(zip(_COLOR_FORMAT_FIELDS, fields))
+            result['mat_type'] = mat_type
+            result['color_format'] = color_format
+            result['format_standardized'] = standardize_color_format(color_format)
+            result['has_alpha'] = color_format['mode'] == COLOR_MODE_RGBA
+
+            if mat_type != MAT_TYPE_TEXTURE:
+                # Цветовые MAT не содержат пикселей
+                result['texture_count'] = 0
+                return result
+
+            offset = _HEADER.size + _COLOR_FORMAT.size + record_count * TEXTURE_RECORD_SIZE
+            bytes_per_pixel = color_format['bpp'] / 8
+            for index in range(cel_count):
+                f.seek(offset)
+                texture_raw = f.read(_TEXTURE_HEADER.size)
+                if len(texture_raw) < _TEXTURE_HEADER.size:
+                    result['error'] = f"Обрезанный заголовок текстуры #{index} в {mat_path.name}"
+                    return result
+                width, height, transparent, unknown_1, unknown_2, mipmap_count = _TEXTURE_HEADER.unpack(texture_raw)
+                if width <= 0 or height <= 0 or mipmap_count <= 0:
+                    result['error'] = f"Некорректный заголовок текстуры #{index} в {mat_path.name}: {width}x{height}, mip={mipmap_count}"
+                    return result
+                data_offset = offset + _TEXTURE_HEADER.size
+                level_sizes = mip_sizes(width, height, mipmap_count)
+                data_size = int(sum(w * h for w, h in level_sizes) * bytes_per_pixel)
+                result['textures'].append({
+                    'width': width,
+                    'height': height,
+                    'transparent': bool(transparent),
+                    'mipmap_count': mipmap_count,
+                    'unknown_fields': (unknown_1, unknown_2),
+                    'data_offset': data_offset,
+                    'data_size': data_size,
+                })
+                offset = data_offset + data_size
+
+            if offset > file_size:
+                result['error'] = f"Файл {mat_path.name} обрезан: ожидалось {offset} байт, найдено {file_size}"
+                return result
+            result['texture_count'] = cel_count
+            if color_format['mode'] == COLOR_MODE_INDEXED:
+                # В палитровых текстурах прозрачен индекс 0, если у текстуры установлен флаг transparent
+                result['has_alpha'] = any(texture['transparent'] for texture in result['textures'])
+    except OSError as e:
+        result['error'] = f"Не удалось прочитать {mat_path.name}: {e}"
+    return result
+
+
+def write_mat(mat_path: Path, original_header: dict, original_mat_path: Path, textures: list[tuple[int, int, list[bytes]]]):
+    """
+    Пишет MAT v0x32 без matool: заголовок, формат цвета и записи текстур копируются из исходного
+    MAT байт в байт, заголовки текстур - с новыми размерами и числом mip-уровней.
+    textures - (width, height, [данные mip-уровней от большего к меньшему]) для каждой текстуры.
+    Файл пишется во временный и переименовывается, поэтому недописанный MAT не появляется.
+    """
+    prefix_size = original_header['textures'][0]['data_offset'] - _TEXTURE_HEADER.size
+    with open(original_mat_path, 'rb') as f:
+        prefix = f.read(prefix_size)
+    part_path = mat_path.with_name(mat_path.name + ".part")
+    try:
+        with open(part_path, 'wb') as f:
+            f.write(prefix)
+            for original, (width, height, levels) in zip(original_header['textures'], textures):
+                f.write(_TEXTURE_HEADER.pack(width, height, int(original['transparent']),
+                                             *original['unknown_fields'], len(levels)))
+                for level in levels:
+                    f.write(level)
+        part_path.replace(mat_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+
+def write_new_mat(mat_path: Path, std_format: str, textures: list[tuple[int, int, list[bytes]]], transparent: bool = False):
+    """
+    Пишет новый MAT v0x32 без исходного (аналог matool create): формат цвета std_format
+    (rgb565, rgba4444, rgba5551, indexed), textures - (width, height, [данные mip-уровней]).
+    Файл пишется через временный.
+    """
+    if std_format not in _NEW_COLOR_FORMATS:
+        raise ValueError(f"Неподдерживаемый формат для нового MAT: {std_format}")
+    part_path = mat_path.with_name(mat_path.name + ".part")
+    try:
+        with open(part_path, 'wb') as f:
+            f.write(_HEADER.pack(MAT_MAGIC, MAT_VERSION, MAT_TYPE_TEXTURE, len(textures), len(textures)))
+            f.write(_COLOR_FORMAT.pack(*_NEW_COLOR_FORMATS[std_format]))
+            for index in range(len(textures)):
+                f.write(_TEXTURE_RECORD.pack(8, 0, 0, 0, 0, 0, 4, 0, 0, index))
+            for width, height, levels in textures:
+                f.write(_TEXTURE_HEADER.pack(width, height, int(transparent), 0, 0, len(levels)))
+                for level in levels:
+                    f.write(level)
+        part_path.replace(mat_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+
+def splice_mat(mat_path: Path, header: dict, replacements: dict[int, tuple[int, int, list[bytes]]],
+               output_path: Path | None = None):
+    """
+    Заменяет в MAT отдельные текстуры (кадры CEL): replacements - индекс -> (width, height, [данные
+    mip-уровней]). Остальные текстуры копируются байт в байт вместе с заголовками, поэтому время
+    зависит от числа замененных кадров, а не от их общего количества. Файл пишется через временный
+    в output_path (по умолчанию - на место mat_path). Размер нового кадра должен совпадать с заменяемым:
+    кадры CEL одного MAT - одного размера.
+    """
+    textures = header['textures']
+    for index, (width, height, _) in replacements.items():
+        if (width, height) != (textures[index]['width'], textures[index]['height']):
+            raise ValueError(f"кадр #{index}: размер {width}x{height}, в MAT {textures[index]['width']}x{textures[index]['height']}")
+    output_path = output_path or mat_path
+    part_path = output_path.with_name(output_path.name + ".part")
+    try:
+        with open(mat_path, 'rb') as src, open(part_path, 'wb') as f:
+            f.write(src.read(textures[0]['data_offset'] - _TEXTURE_HEADER.size))
+            for index, texture in enumerate(textures):
+                if index in replacements:
+                    width, height, levels = replacements[index]
+                    f.write(_TEXTURE_HEADER.pack(width, height, int(texture['transparent']),
+                                                 *texture['unknown_fields'], len(levels)))
+                    for level in levels:
+                        f.write(level)
+                else:
+                    src.seek(texture['data_offset'] - _TEXTURE_HEADER.size)
+                    f.write(src.read(_TEXTURE_HEADER.size + texture['data_size']))
+        part_path.replace(output_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+
+def decode_pixel_16(value: int, color_format: dict) -> tuple[int, int, int, int]:
+    """Декодирует один 16-битный пиксель в RGBA (0-255) по сдвигам из заголовка MAT."""
+    def channel(bits, shl):
+        if bits == 0:
+            return 255
+        max_value = (1 << bits) - 1
+        return ((value >> shl) & max_value) * 255 // max_value
+    return (channel(color_format['red_bpp'], color_format['red_shl']),
+            channel(color_format['green_bpp'], color_format['green_shl']),
+            channel(color_format['blue_bpp'], color_format['blue_shl']),
+            channel(color_format['alpha_bpp'], color_format['alpha_shl']))
+
+
+def _indexed_mismatch(index: int, reference_pixel, texture: dict, alpha_threshold: int) -> bool:
+    # Цвет палитры здесь неизвестен (палитру задает уровень): сверяется только прозрачный индекс
+    if not texture['transparent']:
+        return False
+    return (index == INDEXED_TRANSPARENT_INDEX) != (reference_pixel[3] < alpha_threshold)
+
+
+def _pixel_16_mismatch(value: int, reference_pixel, color_format: dict) -> bool:
+    decoded = decode_pixel_16(value, color_format)
+    has_alpha = color_format['alpha_bpp'] > 0
+    for channel, name in enumerate(('red', 'green', 'blue', 'alpha')):
+        bits = color_format[f'{name}_bpp']
+        if bits == 0 or (has_alpha and channel < 3 and reference_pixel[3] == 0):
+            continue  # Цвет полностью прозрачного пикселя не важен
+        # Допуск - один шаг квантования канала (округление или отсечение младших бит при кодировании)
+        if abs(decoded[channel] - reference_pixel[channel]) > 255 // ((1 << bits) - 1) + 1:
+            return True
+    return False
+
+
+def spot_check_texture(mat_path: Path, header: dict, texture_index: int = 0, rows: int = 4, reference=None,
+                       alpha_threshold: int = 128, max_mismatch: float = 0.01) -> str | None:
+    """
+    Выборочная проверка верхнего mip-уровня текстуры по rows строкам (первая, последняя и равномерно между ними).
+    Без reference проверяется только, что данные этих строк есть в файле. reference - пиксели PNG,
+    из которого запакована текстура (H x W x 4, RGBA): 16-битные пиксели декодируются и сравниваются
+    с ним с допуском в шаг квантования, в палитровых с флагом transparent прозрачный индекс должен
+    стоять ровно в пикселях с альфой ниже alpha_threshold. Ошибка - если не совпало больше max_mismatch
+    проверенных пикселей. reference другого размера не используется.
+    Возвращает текст ошибки или None.
+    """
+    texture = header['textures'][texture_index]
+    color_format = header['color_format']
+    bytes_per_pixel = color_format['bpp'] // 8
+    if bytes_per_pixel not in (1, 2, 4):
+        return f"Неподдерживаемая глубина цвета для проверки: {color_format['bpp']} bpp"
+    if reference is not None and (len(reference) != texture['height'] or len(reference[0]) != texture['width']):
+        reference = None
+    indexed = color_format['mode'] == COLOR_MODE_INDEXED
+    row_size = texture['width'] * bytes_per_pixel
+    last_row = texture['height'] - 1
+    row_indices = sorted({last_row * step // max(1, rows - 1) for step in range(rows)})
+    checked = mismatched = 0
+    try:
+        with open(mat_path, 'rb') as f:
+            for row in row_indices:
+                f.seek(texture['data_offset'] + row * row_size)
+                raw = f.read(row_size)
+                if len(raw) != row_size:
+                    return f"Строка {row} текстуры #{texture_index} обрезана ({len(raw)}/{row_size} байт)"
+                if reference is None:
+                    continue
+                reference_row = reference[row]
+                reference_row = reference_row.tolist() if hasattr(reference_row, 'tolist') else reference_row
+                if bytes_per_pixel == 2:
+                    values = [value for (value,) in struct.iter_unpack('<H', raw)]
+                    mismatched += sum(_pixel_16_mismatch(value, pixel, color_format)
+                                      for value, pixel in zip(values, reference_row))
+                elif indexed:
+                    mismatched += sum(_indexed_mismatch(index, pixel, texture, alpha_threshold)
+                                      for index, pixel in zip(raw, reference_row))
+                else:
+                    continue
+                checked += texture['width']
+    except OSError as e:
+        return f"Ошибка чтения данных текстуры #{texture_index}: {e}"
+    if checked and mismatched > checked * max_mismatch:
+        return (f"Текстура #{texture_index}: {mismatched} из {checked} проверенных пикселей "
+                f"не совпадают с исходным PNG")
+    return None
@@ -3,9 +3,10 @@ import re
 from pathlib import Path
 
 class Tool:
-    def __init__(self, primary_exe_path: Path, cwd: Path, alternative_exe_path: Path | None = None):
+    def __init__(self, primary_exe_path: Path, cwd: Path, alternative_exe_path: Path | None = None, runner=None):
         self.cwd = cwd
         self.executable_path = None
+        self.runner = runner  # WineRunner на Linux (None - прямой запуск)
 
         if primary_exe_path.exists() and primary_exe_path.is_file():
             self.executable_path = primary_exe_path
@@ -28,21 +29,25 @@ class Tool:
              cmd_str_display += ' '.join(f"'{Path(p).name if isinstance(p, Path) else str(p)}'"
                                         if isinstance(p, Path) or ' ' in str(p) else str(p) for p in args)
 
-        print(f"  Matool Запуск: {cmd_str_display} (в {self.cwd.name})")
+        print(f"  Matool Запуск: {cmd_str_display} (в {self.cwd.name}{', wine' if self.runner else ''})")
 
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, check=False,
-                                    encoding='utf-8', errors='ignore', cwd=self.cwd)
+            if self.runner is not None:
+                returncode, raw_stdout, raw_stderr = self.runner.run(self.executable_path, (command,) + args)
+            else:
+                result = subprocess.run(cmd, capture_output=True, text=True, check=False,
+                                        encoding='utf-8', errors='ignore', cwd=self.cwd)
+                returncode, raw_stdout, raw_stderr = result.returncode, result.stdout, result.stderr
 
-            stdout = result.stdout.strip() if result.stdout else None
-            stderr = result.stderr.strip() if result.stderr else None
+            stdout = raw_stdout.strip() if raw_stdout else None
+            stderr = raw_stderr.strip() if raw_stderr else None
 
             if command.lower() in ['create', 'info']:
                 if stdout: print(f"    Matool Stdout:\n      {stdout.replace(chr(10), chr(10)+'      ')}")
                 if stderr: print(f"    Matool Stderr:\n      {stderr.replace(chr(10), chr(10)+'      ')}")
 
-            if result.returncode != 0:
-                error_msg = f"Команда matool {command} завершилась с кодом {result.returncode}."
+            if returncode != 0:
+                error_msg = f"Команда matool {command} завершилась с кодом {returncode}."
                 print(f"  Matool ОШИБКА: {error_msg}")
                 if stderr: print(f"    Matool Stderr: {stderr}")
                 return stdout, stderr, error_msg
@@ -0,0 +1,121 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from conf import Config
+from imageutil import build_mip_chain
+from mat_format import read_mat_header, mip_sizes, write_mat, splice_mat, FORMATS_16BIT
+
+config = Config()
+
+# Запаковка 16-битных MAT (rgb565, rgba4444, rgba5551) без matool, когда у исходного MAT есть mip-уровни.
+# Апскейлится только основной уровень; остальные строятся локально (imageutil.build_mip_chain)
+# и кодируются по битности и сдвигам каналов из заголовка исходного MAT.
+# Здесь же - замена отдельных кадров CEL в готовом MAT (16-битном или палитровом) без пересборки остальных
+# и декодирование 16-битных текстур (native_tool.NativeTool).
+_CHANNELS = ('red', 'green', 'blue', 'alpha')
+
+
+def encode_pixels_16(pixels: np.ndarray, color_format: dict) -> bytes:
+    """RGB/RGBA (H x W x C, uint8) -> 16-битные пиксели MAT (little-endian) с округлением каналов."""
+    values = np.zeros(pixels.shape[:2], dtype=np.uint32)
+    for index, name in enumerate(_CHANNELS):
+        bits = color_format[f'{name}_bpp']
+        if bits == 0:
+            continue
+        channel = pixels[..., index].astype(np.uint32) if index < pixels.shape[2] else np.full(pixels.shape[:2], 255, np.uint32)
+        max_value = (1 << bits) - 1
+        values |= ((channel * (2 * max_value) + 255) // 510) << color_format[f'{name}_shl']
+    return values.astype('<u2').tobytes()
+
+
+def decode_texture_16(mat_path: Path, texture: dict, color_format: dict) -> np.ndarray:
+    """Верхний mip-уровень 16-битной текстуры -> RGB (H x W x 3) или RGBA (H x W x 4), как в decode_pixel_16."""
+    width, height = texture['width'], texture['height']
+    values = np.fromfile(mat_path, dtype='<u2', count=width * height, offset=texture['data_offset'])
+    if values.size != width * height:
+        raise ValueError(f"данные текстуры обрезаны ({values.size}/{width * height} пикселей)")
+    values = values.astype(np.uint32).reshape(height, width)
+    names = _CHANNELS if color_format['alpha_bpp'] > 0 else _CHANNELS[:3]
+    pixels = np.empty((height, width, len(names)), dtype=np.uint8)
+    for index, name in enumerate(names):
+        bits = color_format[f'{name}_bpp']
+        if bits == 0:
+            pixels[..., index] = 255
+            continue
+        max_value = (1 << bits) - 1
+        pixels[..., index] = ((values >> color_format[f'{name}_shl']) & max_value) * 255 // max_value
+    return pixels
+
+
+def encode_texture_16(color_format: dict, texture: dict, png_path: Path) -> tuple[int, int, list[bytes]]:
+    """PNG -> (width, height, [16-битные mip-уровни]) с числом уровней как у texture."""
+    # 1-битная альфа: бинаризация с сохранением покрытия, иначе - обычное усреднение с учетом альфы
+    coverage_threshold = config.ALPHA_BINARY_THRESHOLD if color_format['alpha_bpp'] == 1 else None
+    with Image.open(png_path) as img:
+        pixels = np.asarray(img.convert("RGBA" if color_format['alpha_bpp'] > 0 else "RGB"))
+    height, width = pixels.shape[:2]
+    levels = build_mip_chain(pixels, mip_sizes(width, height, texture['mipmap_count']), coverage_threshold)
+    return width, height, [encode_pixels_16(level, color_format) for level in levels]
+
+
+def write_mat_with_mips(original_mat_path: Path, final_mat_path: Path, png_paths: list[Path]) -> bool:
+    """
+    Запаковывает PNG (по одному на текстуру) в 16-битный MAT с полной цепочкой mip-уровней,
+    построенной локально из основного уровня. Число mip-уровней - как в исходном MAT.
+    """
+    header = read_mat_header(original_mat_path)
+    if header['error']:
+        print(f"  ОШИБКА: {header['error']}")
+        return False
+    if len(png_paths) != len(header['textures']):
+        print(f"  ОШИБКА: Передано {len(png_paths)} PNG, в исходном {original_mat_path.name} текстур: {len(header['textures'])}.")
+        return False
+
+    try:
+        textures = [encode_texture_16(header['color_format'], texture, png_path)
+                    for texture, png_path in zip(header['textures'], png_paths)]
+        final_mat_path.parent.mkdir(parents=True, exist_ok=True)
+        write_mat(final_mat_path, header, original_mat_path, textures)
+    except (OSError, ValueError) as e:
+        print(f"  ОШИБКА: Не удалось запаковать {final_mat_path.name}: {e}")
+        return False
+    mip_counts = sorted({texture['mipmap_count'] for texture in header['textures']})
+    print(f"  Успех: {final_mat_path.name} ({header['format_standardized']}) запакован без matool, "
+          f"mip-уровни построены локально ({'/'.join(map(str, mip_counts))}).")
+    return True
+
+
+def splice_cel_frames(mat_path: Path, frames: dict[int, Path], output_path: Path | None = None) -> bool:
+    """
+    Заменяет в готовом MAT только кадры frames (индекс -> PNG), остальные копируются как есть.
+    Кодируются только новые кадры, с числом mip-уровней и прозрачностью заменяемого кадра.
+    Результат пишется в output_path (по умолчанию - на место mat_path).
+    """
+    header = read_mat_header(mat_path)
+    if header['error']:
+        print(f"  ОШИБКА: {header['error']}")
+        return False
+    std_format = header['format_standardized']
+    if std_format not in FORMATS_16BIT and std_format != "indexed":
+        print(f"  ОШИБКА: Замена отдельных кадров не поддерживается для формата {std_format}.")
+        return False
+    try:
+        if std_format == "indexed":
+            from indexed_mat import load_palette_for, encode_indexed_texture
+            palette = load_palette_for(mat_path)
+            if palette is None:
+                return False
+            replacements = {index: encode_indexed_texture(palette, header['textures'][index], png_path)
+                            for index, png_path in frames.items()}
+        else:
+            replacements = {index: encode_texture_16(header['color_format'], header['textures'][index], png_path)
+                            for index, png_path in frames.items()}
+        splice_mat(mat_path, header, replacements, output_path)
+    except (OSError, ValueError) as e:
+        print(f"  ОШИБКА: Не удалось заменить кадры в {mat_path.name}: {e}")
+        return False
+    print(f"  Успех: в {(output_path or mat_path).name} заменено кадров {len(frames)} из {len(header['textures'])} "
+          f"({', '.join(map(str, sorted(frames)))}).")
+    return True
@@ -0,0 +1,77 @@
+from pathlib import Path
+from mat_format import read_mat_header, new_color_format, write_new_mat, FORMATS_16BIT
+
+
+class NativeTool:
+    """
+    Замена matool.Tool без matool.exe и Wine (MAT_TOOL_BACKEND = "python"): info, extract и create
+    для 16-битных и палитровых MAT на mat_format/native_pack/indexed_mat. Те же методы и результаты,
+    что у Tool: PNG извлекаются в output_dir с именами {имя}.png или {имя}__cel_{N}.png,
+    create пишет MAT с одним mip-уровнем. Нужны NumPy и Pillow; используется и для прогона
+    конвейера целиком без Windows (bench_e2e.py).
+    """
+    executable_path = "встроенный (mat_format, без matool)"
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.runner = None
+        print(f"Matool: Используется {self.executable_path}")
+
+    def info(self, mat_path: Path) -> dict:
+        result = read_mat_header(mat_path)
+        result.update(format_raw=result['format_standardized'], stdout=None, stderr=None)
+        if result['error']:
+            print(f"  Matool ОШИБКА: {result['error']}")
+        return result
+
+    def extract(self, mat_path: Path) -> bool:
+        header = read_mat_header(mat_path)
+        if header['error']:
+            print(f"  Matool ОШИБКА: {header['error']}")
+            return False
+        if header['format_standardized'] == "indexed":
+            from indexed_mat import extract_indexed_mat
+            return extract_indexed_mat(mat_path, self.output_dir)
+        if header['format_standardized'] not in FORMATS_16BIT:
+            print(f"  Matool ОШИБКА: Встроенное извлечение не поддерживает формат {header['format_standardized']} ({mat_path.name}).")
+            return False
+
+        from PIL import Image
+        from native_pack import decode_texture_16
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        textures = header['textures']
+        try:
+            for index, texture in enumerate(textures):
+                name = f"{mat_path.stem}.png" if len(textures) == 1 else f"{mat_path.stem}__cel_{index}.png"
+                Image.fromarray(decode_texture_16(mat_path, texture, header['color_format'])).save(self.output_dir / name, "PNG")
+        except (OSError, ValueError) as e:
+            print(f"  Matool ОШИБКА: Не удалось извлечь {mat_path.name}: {e}")
+            return False
+        return True
+
+    def create(self, format_str: str, output_mat_path: Path, *input_png_paths: Path) -> bool:
+        if not input_png_paths:
+            print("  Matool ОШИБКА: Для команды create не переданы входные PNG файлы.")
+            return False
+        if format_str not in FORMATS_16BIT:
+            print(f"  Matool ОШИБКА: Встроенный create не поддерживает формат {format_str}.")
+            return False
+
+        import numpy as np
+        from PIL import Image
+        from native_pack import encode_pixels_16
+        color_format = new_color_format(format_str)
+        has_alpha = color_format['alpha_bpp'] > 0
+        try:
+            textures = []
+            for png_path in input_png_paths:
+                with Image.open(png_path) as img:
+                    pixels = np.asarray(img.convert("RGBA" if has_alpha else "RGB"))
+                textures.append((pixels.shape[1], pixels.shape[0], [encode_pixels_16(pixels, color_format)]))
+            output_mat_path.parent.mkdir(parents=True, exist_ok=True)
+            write_new_mat(output_mat_path, format_str, textures, transparent=has_alpha)
+        except (OSError, ValueError) as e:
+            print(f"  Matool ОШИБКА: Не удалось создать {output_mat_path.name}: {e}")
+            return False
+        print(f"  Matool (встроенный): создан {output_mat_path.name} ({format_str}, текстур: {len(textures)})")
+        return True
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import math
+import time
+from conf import Config
+from mat_format import read_mat_header
+from throughput import ThroughputHistory
+from usage_index import apply_usage
+from used_store import used_png_stems
+
+config = Config()
+
+STAGES = ["extract", "cel-extract", "upscale", "pack", "cel-pack"]
+PACKABLE_FORMATS = {"rgb565", "rgba4444", "rgba5551", "indexed"}
+
+
+def scan_stems(directory, suffix):
+    """Один проход по папке: stem -> путь для файлов с расширением suffix."""
+    stems = {}
+    if not directory.is_dir():
+        return stems
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(suffix) and entry.name.lower() != config.MATOOL_FILENAME.lower():
+                stems[entry.name[:-len(suffix)]] = directory / entry.name
+    return stems
+
+def get_base_name(stem):
+    return stem.split('__cel_')[0] if '__cel_' in stem else stem
+
+def group_by_base(stems):
+    groups = {}
+    for stem in stems:
+        groups.setdefault(get_base_name(stem), set()).add(stem)
+    return groups
+
+def describe_asset(base_name, mat_path, location):
+    """Базовое описание ассета по заголовку MAT: размеры, формат, кол-во кадров."""
+    header = read_mat_header(mat_path)
+    asset = {'base': base_name, 'location': location, 'pending': [], 'upscale_frames': 0}
+    if header['error']:
+        asset['error'] = header['error']
+        return asset, 0
+    texture = header['textures'][0] if header['textures'] else {'width': 0, 'height': 0}
+    cels = header['texture_count'] or 0
+    asset.update(format=header['format_standardized'], width=texture['width'], height=texture['height'],
+                 cels=cels, packable=header['format_standardized'] in PACKABLE_FORMATS)
+    return asset, cels
+
+def collect_pending_assets():
+    """Один проход по всем папкам конвейера: для каждого ассета - оставшиеся стадии."""
+    mat_dir = scan_stems(config.MAT_DIR, '.mat')
+    manual_cel = scan_stems(config.MANUAL_CEL_DIR, '.mat')
+    used_mat = scan_stems(config.USED_MAT_DIR, '.mat')
+    used_manual_mat = scan_stems(config.USED_MANUAL_MAT_DIR, '.mat')
+    final_mat = scan_stems(config.FINAL_MAT_DIR, '.mat')
+    used_png_bases = set(group_by_base(used_png_stems()))
+    processed = set(scan_stems(config.PROCESSED_PNG_DIR, '.png'))
+    extracted = {}
+    for fmt_dir in config.FORMAT_DIRS.values():
+        extracted.update(scan_stems(fmt_dir, '.png'))
+    extracted_groups = group_by_base(extracted)
+
+    assets = []
+    skip_bases = used_png_bases | set(used_mat) | set(manual_cel)
+    for base_name, mat_path in sorted(mat_dir.items()):
+        if base_name in skip_bases:
+            continue
+        asset, cels = describe_asset(base_name, mat_path, config.MAT_DIR.name)
+        if cels > 1:
+            asset['pending'] = ["extract", "cel-extract", "upscale", "cel-pack"]
+        elif cels == 1:
+            asset['pending'] = ["extract", "upscale", "pack"]
+        asset['upscale_frames'] = cels
+        assets.append(asset)
+
+    for base_name, mat_path in sorted(manual_cel.items()):
+        asset, cels = describe_asset(base_name, mat_path, config.MANUAL_CEL_DIR.name)
+        asset['pending'] = ["cel-extract", "upscale", "cel-pack"] if cels else []
+        asset['upscale_frames'] = cels
+        assets.append(asset)
+
+    for used_dict, pack_stage in ((used_mat, "pack"), (used_manual_mat, "cel-pack")):
+        for base_name, mat_path in sorted(used_dict.items()):
+            if base_name in final_mat:
+                continue
+            frames = extracted_groups.get(base_name, set())
+            to_upscale = [stem for stem in frames if stem not in processed]
+            has_processed = any(get_base_name(stem) == base_name for stem in processed)
+            if not to_upscale and not has_processed:
+                continue
+            asset, _ = describe_asset(base_name, mat_path, mat_path.parent.name)
+            asset['pending'] = (["upscale"] if to_upscale else []) + [pack_stage]
+            asset['upscale_frames'] = len(to_upscale)
+            assets.append(asset)
+    return assets
+
+def estimate_run(assets, history):
+    """Оценивает время по стадиям, кол-во вызовов API и секунды GPU по истории производительности."""
+    estimates = {}
+    for stage in STAGES:
+        if stage == "upscale":
+            continue
+        count = sum(1 for a in assets if stage in a['pending'])
+        seconds_per_item = history.seconds_per_item(stage)
+        source = "history" if seconds_per_item is not None else "default"
+        if seconds_per_item is None:
+            seconds_per_item = config.PLAN_DEFAULT_STAGE_SECONDS.get(stage, 1.0)
+        estimates[stage] = {'items': count, 'seconds_per_item': round(seconds_per_item, 3),
+                            'seconds': round(count * seconds_per_item, 1), 'source': source}
+
+    api_calls = sum(a['upscale_frames'] for a in assets if "upscale" in a['pending'])
+    megapixels = sum(a['upscale_frames'] * a.get('width', 0) * a.get('height', 0) / 1e6
+                     for a in assets if "upscale" in a['pending'])
+    seconds_per_mp = history.seconds_per_megapixel("upscale_api")
+    source = "history" if seconds_per_mp is not None else "default"
+    if seconds_per_mp is None:
+        seconds_per_mp = config.PLAN_DEFAULT_UPSCALE_SECONDS_PER_MP
+    gpu_seconds = megapixels * seconds_per_mp  # Верхняя оценка: время ответа API, включая очередь Space
+    estimates["upscale"] = {
+        'items': api_calls,
+        'api_calls': api_calls,
+        'megapixels': round(megapixels, 3),
+        'seconds_per_megapixel': round(seconds_per_mp, 3),
+        'gpu_seconds': round(gpu_seconds, 1),
+        'seconds': round(gpu_seconds + api_calls * config.API_PAUSE_DURATION, 1),
+        'source': source,
+    }
+    if config.GPU_QUOTA_SECONDS_PER_WINDOW:
+        estimates["upscale"]['quota_windows'] = math.ceil(gpu_seconds / config.GPU_QUOTA_SECONDS_PER_WINDOW)
+    return estimates
+
+def print_run_plan(assets, estimates):
+    print("\n--- План запуска (без выполнения) ---")
+    print(f"Ассетов с незавершенными стадиями: {len(assets)}")
+    not_packable = [a['base'] for a in assets if a.get('packable') is False]
+    if not_packable:
+        print(f"  Из них формат не поддерживается для запаковки: {len(not_packable)} (например: {not_packable[:5]})")
+    broken = [a['base'] for a in assets if 'error' in a]
+    if broken:
+        print(f"  Не удалось прочитать заголовок MAT: {len(broken)} (например: {broken[:5]})")
+
+    total_seconds = 0.0
+    print("\nСтадия        Элементов   Оценка времени   Источник")
+    for stage in STAGES:
+        estimate = estimates[stage]
+        total_seconds += estimate['seconds']
+        print(f"  {stage:<11} {estimate['items']:>9}   {estimate['seconds'] / 60:>10.1f} мин   {estimate['source']}")
+    print(f"Итого (последовательно): {total_seconds / 3600:.2f} ч")
+
+    upscale = estimates["upscale"]
+    print(f"\nВызовов API апскейла: {upscale['api_calls']} ({upscale['megapixels']:.1f} Мп входа)")
+    print(f"Оценка GPU квоты: {upscale['gpu_seconds'] / 60:.1f} мин")
+    if 'quota_windows' in upscale:
+        print(f"Окон квоты по {config.GPU_QUOTA_SECONDS_PER_WINDOW} сек.: {upscale['quota_windows']}")
+    other_seconds = total_seconds - upscale['seconds']
+    print("Время при параллельном апскейле (по числу воркеров/Space):")
+    for workers in (1, 2, 4, 8):
+        print(f"  {workers} воркер(а): {(other_seconds + upscale['seconds'] / workers) / 3600:.2f} ч")
+
+def main():
+    print("\n--- Планирование запуска: оставшиеся стадии и оценки ---")
+    if not config.BASE_DIR.is_dir():
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: Базовая папка ({config.BASE_DIR}) не найдена!")
+        sys.exit(1)
+
+    assets = apply_usage(collect_pending_assets(), "ассетов", key=lambda asset: asset['base'])
+    history = ThroughputHistory(config.THROUGHPUT_HISTORY_PATH)
+    estimates = estimate_run(assets, history)
+    print_run_plan(assets, estimates)
+
+    run_plan = {'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'estimates': estimates, 'assets': assets}
+    config.RUN_PLAN_PATH.write_text(json.dumps(run_plan, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"\nПлан сохранен в: {config.RUN_PLAN_PATH}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import struct
+from pathlib import Path
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+_PNG_COLOR_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+
+def read_png_header(png_path: Path) -> dict | None:
+    """Читает размеры и тип цвета из заголовка IHDR, не декодируя изображение."""
+    try:
+        with open(png_path, 'rb') as f:
+            head = f.read(33)
+    except OSError:
+        return None
+    if len(head) < 33 or head[:8] != PNG_SIGNATURE or head[12:16] != b'IHDR':
+        return None
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', head[16:26])
+    return {
+        'width': width,
+        'height': height,
+        'bit_depth': bit_depth,
+        'channels': _PNG_COLOR_CHANNELS.get(color_type, 4),
+        'has_alpha': color_type in (4, 6),
+    }
+
+
+def read_png_size(png_path: Path) -> tuple[int, int] | None:
+    header = read_png_header(png_path)
+    return (header['width'], header['height']) if header else None
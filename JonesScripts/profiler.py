@@ -0,0 +1,131 @@
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from pathlib import Path
+
+
+class PhaseProfiler:
+    """
+    Профилировщик для jones.py --profile: поток-сэмплер раз в interval секунд снимает стеки
+    (sys._current_frames) потоков, обрабатывающих ассет, и считает свернутые стеки
+    (формат flamegraph.pl / speedscope). Фазы сообщают о начале обработки ассета через
+    track_asset(); для каждого ассета считаются время, число сэмплов, CPU потока и пик памяти
+    (tracemalloc). Пик памяти общий для процесса: при нескольких потоках он приблизителен.
+    """
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.lock = threading.Lock()
+        self.phase = None
+        self.current = {}  # id потока -> запись текущего ассета
+        self.assets = []  # завершенные записи
+        self.folded = {}  # "фаза;модуль:функция;..." -> число сэмплов
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.main_thread_id = threading.get_ident()
+
+    def start_phase(self, phase: str):
+        self.phase = phase
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self.thread.start()
+
+    def end_phase(self):
+        with self.lock:
+            for thread_id in list(self.current):
+                self._close(thread_id)
+        self.phase = None
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def track_asset(self, name: str):
+        """Текущий поток начинает обработку ассета name (предыдущий ассет потока завершается)."""
+        if self.phase is None:
+            return
+        thread_id = threading.get_ident()
+        with self.lock:
+            self._close(thread_id)
+            tracemalloc.reset_peak()
+            self.current[thread_id] = {
+                'phase': self.phase, 'asset': name, 'samples': 0,
+                'started': time.perf_counter(), 'cpu_started': time.thread_time(),
+                'memory_started': tracemalloc.get_traced_memory()[0],
+            }
+
+    def _close(self, thread_id):
+        record = self.current.pop(thread_id, None)
+        if record is None:
+            return
+        record['seconds'] = round(time.perf_counter() - record.pop('started'), 4)
+        cpu_started = record.pop('cpu_started')
+        # CPU потока можно измерить, только если запись закрывает тот же поток
+        record['cpu_seconds'] = round(time.thread_time() - cpu_started, 4) if thread_id == threading.get_ident() else None
+        record['peak_memory_mb'] = round(max(0, tracemalloc.get_traced_memory()[1] - record.pop('memory_started')) / 2**20, 3)
+        self.assets.append(record)
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                phase = self.phase
+                if phase is None:
+                    continue
+                for thread_id, frame in frames.items():
+                    record = self.current.get(thread_id)
+                    # Простаивающие потоки пулов не сэмплируем: только главный поток и потоки с ассетом
+                    if thread_id == own_id or (record is None and thread_id != self.main_thread_id):
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.max_depth:
+                        label = f"{Path(frame.f_code.co_filename).stem}:{frame.f_code.co_name}"
+                        stack.append(label.replace(' ', '_').replace(';', '_'))  # Пробел и ';' - разделители формата
+                        frame = frame.f_back
+                    key = ";".join([phase] + stack[::-1])
+                    self.folded[key] = self.folded.get(key, 0) + 1
+                    if record is not None:
+                        record['samples'] += 1
+
+    def write_reports(self, directory: Path, top_n: int = 20) -> tuple[Path, Path]:
+        """Сохраняет свернутые стеки и отчет по ассетам, печатает самые медленные ассеты."""
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+        folded_path = directory / f"profile_{stamp}.folded"
+        report_path = directory / f"profile_{stamp}_assets.json"
+        with self.lock:
+            folded = sorted(self.folded.items())
+            assets = sorted(self.assets, key=lambda a: a['seconds'], reverse=True)
+        folded_path.write_text("".join(f"{stack} {count}\n" for stack, count in folded), encoding='utf-8')
+
+        stages = {}
+        for record in assets:
+            stage = stages.setdefault(record['phase'], {'assets': 0, 'seconds': 0.0, 'peak_memory_mb': 0.0})
+            stage['assets'] += 1
+            stage['seconds'] = round(stage['seconds'] + record['seconds'], 4)
+            stage['peak_memory_mb'] = max(stage['peak_memory_mb'], record['peak_memory_mb'])
+        report = {'interval': self.interval, 'stages': stages, 'slowest_assets': assets[:top_n], 'assets': assets}
+        report_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+
+        print("\n--- Профиль запуска ---")
+        for phase, stage in stages.items():
+            print(f"  {phase:<12} ассетов: {stage['assets']:>6}   время: {stage['seconds']:>9.1f} сек.   "
+                  f"пик памяти ассета: {stage['peak_memory_mb']:.1f} МБ")
+        if assets:
+            print(f"\nСамые медленные ассеты (топ {min(top_n, len(assets))}):")
+            for record in assets[:top_n]:
+                cpu = f"{record['cpu_seconds']:.2f}" if record['cpu_seconds'] is not None else "-"
+                print(f"  {record['seconds']:>8.2f} сек. (CPU {cpu}, пик {record['peak_memory_mb']:.1f} МБ)  "
+                      f"{record['phase']}: {record['asset']}")
+        print(f"\nСвернутые стеки (flamegraph.pl / speedscope): {folded_path}")
+        print(f"Отчет по ассетам: {report_path}")
+        return folded_path, report_path
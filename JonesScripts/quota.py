@@ -0,0 +1,116 @@
+import json
+import re
+import time
+import threading
+from pathlib import Path
+
+# Примеры сообщений ZeroGPU:
+#   "You have exceeded your GPU quota (60s requested vs. 12s left). Try again in 0:14:27"
+#   "... exceeded your gpu quota ... retry in 95 seconds"
+_HMS_RE = re.compile(r"(?:try again|retry)\s+in\s+(?:(\d+)\s*day[s]?,?\s*)?(\d+):(\d{1,2}):(\d{1,2})", re.IGNORECASE)
+_UNIT_RE = re.compile(r"(?:try again|retry)\s+in\s+(\d+(?:\.\d+)?)\s*(seconds?|secs?|s|minutes?|mins?|m|hours?|h)\b", re.IGNORECASE)
+_UNIT_SECONDS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_quota_reset_seconds(message: str) -> float | None:
+    """Извлекает из сообщения об ошибке квоты время (в сек.) до её восстановления."""
+    if not message:
+        return None
+    hms_match = _HMS_RE.search(message)
+    if hms_match:
+        days, hours, minutes, seconds = hms_match.groups()
+        return int(days or 0) * 86400 + int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+    unit_match = _UNIT_RE.search(message)
+    if unit_match:
+        value, unit = unit_match.groups()
+        return float(value) * _UNIT_SECONDS[unit[0].lower()]
+    return None
+
+
+class QuotaState:
+    """
+    Состояние квоты GPU, сохраняемое между запусками Скрипта 2.
+    Хранит время сброса квоты для каждого Space и позицию в очереди PNG,
+    чтобы после ожидания (или перезапуска) продолжить с того же файла.
+    """
+    def __init__(self, state_path: Path, default_wait: float):
+        self.state_path = state_path
+        self.default_wait = default_wait
+        self.endpoints = {}
+        self.next_file = None
+        self.total_hits = 0
+        self.lock = threading.RLock()  # Скрипт 2 может фиксировать квоту из нескольких потоков (--workers)
+        self.load()
+
+    def load(self):
+        if not self.state_path.exists():
+            return
+        try:
+            data = json.loads(self.state_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать состояние квоты {self.state_path.name}: {e}")
+            return
+        self.endpoints = data.get('endpoints', {})
+        self.next_file = data.get('next_file')
+        self.total_hits = data.get('total_hits', 0)
+
+    def save(self):
+        with self.lock:
+            data = {'endpoints': self.endpoints, 'next_file': self.next_file, 'total_hits': self.total_hits}
+            try:
+                self.state_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.state_path.with_suffix('.tmp')
+                tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+                tmp_path.replace(self.state_path)
+            except OSError as e:
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось сохранить состояние квоты {self.state_path.name}: {e}")
+
+    def record_hit(self, endpoint: str, message: str, now: float | None = None) -> float:
+        """Фиксирует исчерпание квоты для endpoint и возвращает время (epoch) её сброса."""
+        now = time.time() if now is None else now
+        reset_seconds = parse_quota_reset_seconds(message)
+        parsed = reset_seconds is not None
+        if not parsed:
+            reset_seconds = self.default_wait
+        reset_at = now + reset_seconds
+        with self.lock:
+            self.endpoints[endpoint] = {
+                'hit_at': now,
+                'reset_at': reset_at,
+                'reset_parsed': parsed,
+                'message': message,
+            }
+            self.total_hits += 1
+            self.save()
+        return reset_at
+
+    def seconds_until_reset(self, endpoint: str, now: float | None = None) -> float:
+        now = time.time() if now is None else now
+        entry = self.endpoints.get(endpoint)
+        if not entry:
+            return 0.0
+        return max(0.0, entry['reset_at'] - now)
+
+    def earliest_available(self, endpoints: list[str], now: float | None = None) -> tuple[str, float]:
+        """Возвращает endpoint, квота которого восстановится раньше всех, и время ожидания в сек."""
+        now = time.time() if now is None else now
+        waits = [(self.seconds_until_reset(ep, now), i, ep) for i, ep in enumerate(endpoints)]
+        wait, _, endpoint = min(waits)
+        return endpoint, wait
+
+    def set_position(self, file_name: str | None):
+        self.next_file = file_name
+        self.save()
+
+
+def sleep_until_reset(wait_seconds: float, margin: float, report_every: float = 300):
+    """Спит до восстановления квоты, периодически печатая оставшееся время."""
+    remaining = wait_seconds + margin
+    resume_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() + remaining))
+    print(f"  Ожидание восстановления квоты: {remaining / 60:.1f} мин (до {resume_at})...")
+    while remaining > 0:
+        step = min(report_every, remaining)
+        time.sleep(step)
+        remaining -= step
+        if remaining > 0:
+            print(f"    Осталось ждать: {remaining / 60:.1f} мин")
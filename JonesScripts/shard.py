@@ -0,0 +1,178 @@
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+import importlib
+from pathlib import Path
+from conf import Config
+
+config = Config()
+
+# Шардирование: --shard i/n делит базовые имена текстур на n непересекающихся частей по хэшу имени.
+# Разбиение не зависит от содержимого папок и машины, поэтому шарды можно запускать на разных
+# машинах без координатора. Все кадры CEL ({имя}__cel_N) попадают в шард своего базового имени.
+# Итоги фаз шарда сохраняются в SHARD_SUMMARY_DIR и объединяются командой jones.py shards.
+
+# Фаза -> (модуль, функция итогового отчета)
+SUMMARY_REPORTS = {
+    'extract': ('1_extract_sort', 'print_summary_report'),
+    'cel-extract': ('cel_extract', 'print_summary_report_cel_extract'),
+    'upscale': ('2_convert_webp_ai', 'print_summary_report_phase2'),
+    'pack': ('3_repack_mat', 'print_summary_report_phase3'),
+    'cel-pack': ('cel_pack', 'print_summary_report_cel_pack'),
+    'export': ('export_gpu', 'print_summary_report_export'),
+}
+
+# Исходные пути файлов состояния процесса (до добавления суффикса шарда)
+_STATE_FILES = {attr: getattr(Config, attr) for attr in ('RUN_MANIFEST_PATH', 'QUOTA_STATE_FILE', 'TEXTURE_PLAN_PATH',
+                                                          'THROUGHPUT_HISTORY_PATH', 'VERIFY_REPORT_PATH')}
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """'i/n' (i от 1 до n) -> (i, n). Используется как type= в argparse."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text)
+    if not match:
+        raise argparse.ArgumentTypeError(f"ожидается i/n, например 1/4, получено '{text}'")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"номер шарда должен быть от 1 до {count}: '{text}'")
+    return index, count
+
+
+def add_shard_argument(parser: argparse.ArgumentParser):
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="i/n",
+                        help="Обрабатывать только i-ю из n частей текстур (разбиение по хэшу базового имени).")
+
+
+def shard_base_name(name: str) -> str:
+    """Базовое имя для шардирования: без расширения и суффикса __cel_N, в нижнем регистре."""
+    stem = Path(name).stem
+    return re.split(r'__cel_\d+', stem, maxsplit=1, flags=re.IGNORECASE)[0].lower()
+
+
+def shard_of(name: str, count: int) -> int:
+    """Номер шарда (от 1 до count) для имени файла или базового имени."""
+    digest = hashlib.blake2b(shard_base_name(name).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % count + 1
+
+
+def in_shard(name: str, shard: tuple[int, int] | None) -> bool:
+    if shard is None:
+        return True
+    index, count = shard
+    return shard_of(name, count) == index
+
+
+def filter_shard(paths, shard, label="файлов"):
+    """Оставляет пути своего шарда (без шарда - все) и печатает, сколько отобрано."""
+    paths = list(paths)
+    if shard is None:
+        return paths
+    selected = [path for path in paths if in_shard(path.name, shard)]
+    print(f"   Шард {shard[0]}/{shard[1]}: отобрано {len(selected)} из {len(paths)} {label}.")
+    return selected
+
+
+def shard_suffix(shard) -> str:
+    return "" if shard is None else f"_shard{shard[0]}of{shard[1]}"
+
+
+def use_shard_state_files(shard):
+    """
+    Файлы состояния, которые пишет каждый процесс (манифест запуска, состояние квоты, план текстур,
+    история производительности, отчет проверки), получают суффикс шарда, чтобы параллельные шарды не перезаписывали их друг у друга.
+    Без шарда возвращаются исходные пути: в jones.py фазы выполняются в одном процессе, и фаза без --shard
+    не должна писать в файлы предыдущей фазы с --shard.
+    """
+    suffix = shard_suffix(shard)
+    for attr, path in _STATE_FILES.items():
+        setattr(Config, attr, path.with_name(f"{path.stem}{suffix}{path.suffix}"))
+
+
+def shard_state_files(path: Path) -> list[Path]:
+    """Файлы состояния шардов для общего пути (texture_plan.json -> texture_plan_shard1of4.json, ...)."""
+    if not path.parent.is_dir():
+        return []
+    return sorted(path.parent.glob(f"{path.stem}_shard*of*{path.suffix}"))
+
+
+def save_shard_summary(phase: str, shard, summary: dict, module_state: dict | None = None):
+    """
+    Сохраняет аргументы итогового отчета фазы для шарда. module_state - глобальные счетчики модуля,
+    которые отчет читает напрямую (например, трафик API фазы 2).
+    """
+    if shard is None:
+        return
+    config.SHARD_SUMMARY_DIR.mkdir(parents=True, exist_ok=True)
+    path = config.SHARD_SUMMARY_DIR / f"{phase}{shard_suffix(shard)}.json"
+    record = {
+        'phase': phase, 'shard': list(shard), 'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'summary': summary, 'module_state': module_state or {},
+    }
+    path.write_text(json.dumps(record, ensure_ascii=False, indent=2, default=str), encoding='utf-8')
+    print(f"\nИтоги шарда {shard[0]}/{shard[1]} сохранены: {path.name} (объединение: jones.py shards)")
+
+
+def merge_values(a, b):
+    """Складывает числа и словари счетчиков, объединяет списки."""
+    if isinstance(a, dict):
+        merged = dict(a)
+        for key, value in b.items():
+            merged[key] = merge_values(merged[key], value) if key in merged else value
+        return merged
+    if isinstance(a, list):
+        return a + b
+    if isinstance(a, (int, float)) and not isinstance(a, bool):
+        return a + b
+    return a
+
+
+def merge_shard_summaries(records: list[dict]) -> tuple[dict, dict]:
+    summary, module_state = {}, {}
+    for record in records:
+        summary = merge_values(summary, record['summary'])
+        module_state = merge_values(module_state, record['module_state'])
+    return summary, module_state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Объединение итогов фаз, выполненных шардами (--shard i/n).")
+    parser.add_argument("--phase", choices=list(SUMMARY_REPORTS), help="Только эта фаза.")
+    args = parser.parse_args(argv)
+
+    records = []
+    for path in sorted(config.SHARD_SUMMARY_DIR.glob('*.json')):
+        try:
+            records.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, ValueError) as e:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать {path.name}: {e}")
+    if not records:
+        print(f"Итоги шардов не найдены в {config.SHARD_SUMMARY_DIR}.")
+        sys.exit(1)
+
+    for phase, (module_name, report_name) in SUMMARY_REPORTS.items():
+        if args.phase and phase != args.phase:
+            continue
+        by_count = {}
+        for record in records:
+            if record['phase'] == phase:
+                by_count.setdefault(record['shard'][1], []).append(record)
+        for count, phase_records in sorted(by_count.items()):
+            done = sorted(record['shard'][0] for record in phase_records)
+            missing = sorted(set(range(1, count + 1)) - set(done))
+            print(f"\n===== {phase}: объединено шардов {len(done)} из {count} =====")
+            if missing:
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Нет итогов шардов {', '.join(f'{i}/{count}' for i in missing)} - отчет неполный.")
+            summary, module_state = merge_shard_summaries(phase_records)
+            module = importlib.import_module(module_name)
+            for name, value in module_state.items():
+                setattr(module, name, value)
+            if 'files_to_upscale_paths' in summary:
+                summary['files_to_upscale_paths'] = [Path(p) for p in summary['files_to_upscale_paths']]
+            getattr(module, report_name)(**summary)
+
+
+if __name__ == "__main__":
+    main()
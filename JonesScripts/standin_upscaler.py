@@ -0,0 +1,202 @@
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Адрес эндпоинта, который Скрипт 2 подключает как StandInHttpClient вместо gradio_client
+STANDIN_URL_PREFIX = "standin+http://"
+
+
+class StandInClient:
+    """
+    Локальная замена gradio_client.Client для тестов без Hugging Face:
+    тот же метод predict(), ответ в формате ImageSlider ([вход, результат]).
+    Увеличивает изображение обычной интерполяцией и умеет имитировать
+    задержку, разброс задержки, зависание в очереди Space (stall), ошибки API и ошибку квоты GPU.
+    """
+    accepts_plain_paths = True  # predict() принимает путь к файлу без gradio_client.handle_file
+
+    def __init__(self, scale: int = 4, latency: float = 0.0, jitter: float = 0.0,
+                 failure_rate: float = 0.0, quota_rate: float = 0.0, quota_reset_seconds: int = 60,
+                 seed: int | None = None, name: str = "stand-in", stall_rate: float = 0.0, stall_seconds: float = 0.0):
+        self.scale = scale
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.quota_rate = quota_rate
+        self.quota_reset_seconds = quota_reset_seconds
+        self.random = random.Random(seed)
+        self.name = name
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.calls = 0
+
+    def predict(self, file, model_name=None, *extra_args, api_name=None):
+        from PIL import Image
+        self.calls += 1
+        source_path = file['path'] if isinstance(file, dict) else str(file)
+
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if self.stall_rate and self.random.random() < self.stall_rate:
+            delay = self.stall_seconds
+        if delay:
+            time.sleep(delay)
+        roll = self.random.random()
+        if roll < self.quota_rate:
+            reset = time.strftime('%H:%M:%S', time.gmtime(self.quota_reset_seconds))
+            raise RuntimeError(f"You have exceeded your GPU quota (60s requested vs. 0s left). Try again in {reset}")
+        if roll < self.quota_rate + self.failure_rate:
+            raise RuntimeError(f"{self.name}: simulated upstream error")
+
+        with Image.open(source_path) as img:
+            upscaled = img.resize((img.width * self.scale, img.height * self.scale), Image.Resampling.BICUBIC)
+        handle, result_path = tempfile.mkstemp(suffix=".webp", prefix="standin_")
+        with open(handle, 'wb') as f:
+            upscaled.save(f, "WEBP", lossless=True)
+        return [source_path, result_path]
+
+
+def make_standin_client(spec: str) -> StandInClient:
+    """
+    Создает StandInClient из строки вида "latency=0.2,jitter=0.1,failure_rate=0.05,quota_rate=0,seed=1".
+    """
+    kwargs = {}
+    for part in filter(None, (p.strip() for p in spec.split(','))):
+        key, _, value = part.partition('=')
+        if key in ('seed', 'scale', 'quota_reset_seconds'):
+            kwargs[key] = int(value)
+        elif key == 'name':
+            kwargs[key] = value
+        else:
+            kwargs[key] = float(value)
+    return StandInClient(**kwargs)
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        suffix = Path(self.headers.get('X-Filename', 'input.png')).suffix or '.png'
+        handle, source_path = tempfile.mkstemp(suffix=suffix, prefix="standin_in_")
+        with open(handle, 'wb') as f:
+            f.write(body)
+        try:
+            _, result_path = self.server.client.predict(source_path, self.headers.get('X-Model'))
+            result = Path(result_path).read_bytes()
+            Path(result_path).unlink()
+            self.server.count('success', len(body), len(result))
+            self._reply(200, result, 'image/webp')
+        except Exception as e:
+            message = str(e)
+            self.server.count('quota' if 'quota' in message.lower() else 'error', len(body), 0)
+            self._reply(500, message.encode('utf-8'), 'text/plain; charset=utf-8')
+        finally:
+            Path(source_path).unlink(missing_ok=True)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self._reply(404, b'not found', 'text/plain')
+            return
+        with self.server.lock:
+            self._reply(200, json.dumps(self.server.stats).encode('utf-8'), 'application/json')
+
+    def _reply(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Локальный HTTP-сервер замены API: POST /predict (тело - изображение, заголовки X-Filename и X-Model)
+    отвечает увеличенным изображением (WEBP) или ошибкой 500 с текстом ошибки, как у Space
+    (в том числе сообщением о квоте GPU). Задержки и ошибки - от StandInClient.
+    GET /stats - счетчики запросов. В отличие от StandInClient в том же процессе, запросы
+    проходят через сокет, поэтому в замерах участвуют передача и чтение результата.
+    """
+    daemon_threads = True
+
+    def __init__(self, client: StandInClient, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _StandInHandler)
+        self.client = client
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'success': 0, 'error': 0, 'quota': 0, 'upload_bytes': 0, 'download_bytes': 0}
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{STANDIN_URL_PREFIX}{host}:{port}"
+
+    def count(self, outcome, upload_bytes, download_bytes):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats[outcome] += 1
+            self.stats['upload_bytes'] += upload_bytes
+            self.stats['download_bytes'] += download_bytes
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="standin-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StandInHttpClient:
+    """Клиент StandInServer с тем же predict(), что у gradio_client.Client (ответ [вход, результат])."""
+    accepts_plain_paths = True
+
+    def __init__(self, url: str, timeout: float = 300.0):
+        self.base_url = "http://" + url[len(STANDIN_URL_PREFIX):].rstrip('/')
+        self.timeout = timeout
+
+    def predict(self, file, model_name=None, *extra_args, api_name=None):
+        source_path = file['path'] if isinstance(file, dict) else str(file)
+        request = urllib.request.Request(
+            f"{self.base_url}/predict", data=Path(source_path).read_bytes(), method='POST',
+            headers={'X-Filename': Path(source_path).name, 'X-Model': str(model_name or '')})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = response.read()
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(e.read().decode('utf-8', 'ignore')) from None
+        handle, result_path = tempfile.mkstemp(suffix=".webp", prefix="standin_")
+        with open(handle, 'wb') as f:
+            f.write(result)
+        return [source_path, result_path]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный HTTP-сервер замены API апскейла (задержки, ошибки, квота).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--standin", default="",
+                        help='Параметры, например "latency=0.5,jitter=0.2,failure_rate=0.1,quota_rate=0.01,seed=1".')
+    args = parser.parse_args(argv)
+    server = StandInServer(make_standin_client(args.standin), args.host, args.port)
+    print(f"Замена API запущена: {server.url} (UPSCALE_ENDPOINTS = [{{'url': '{server.url}'}}]). Ctrl+C - остановка.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Запросов: {server.stats}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
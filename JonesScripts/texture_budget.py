@@ -0,0 +1,256 @@
+import sys
+import json
+import time
+import heapq
+import argparse
+from fnmatch import fnmatch
+from conf import Config
+from mat_format import read_mat_header, mip_sizes
+from png_header import read_png_size
+from usage_index import usage_refs
+from shard import add_shard_argument, in_shard, use_shard_state_files, shard_state_files
+
+config = Config()
+
+# Байт на тексель в финальном MAT
+TEXEL_BYTES = {"rgb565": 2, "rgba4444": 2, "rgba5551": 2, "indexed": 1, "rgba": 4}
+
+
+def get_base_name(png_stem):
+    return png_stem.split('__cel_')[0] if '__cel_' in png_stem else png_stem
+
+def find_original_mat(base_name):
+    for directory in (config.USED_MAT_DIR, config.USED_MANUAL_MAT_DIR):
+        original_mat_path = directory / f"{base_name}.mat"
+        if original_mat_path.exists():
+            return original_mat_path
+    return None
+
+def texture_memory(width, height, frames, mipmap_count, texel_bytes):
+    """Память текселей текстуры (все кадры и mip-уровни) в байтах."""
+    texels = sum(w * h for w, h in mip_sizes(width, height, max(1, mipmap_count)))
+    return texels * frames * texel_bytes
+
+def floor_pow2(value):
+    return 1 << (max(1, value).bit_length() - 1)
+
+def get_priority(base_name):
+    """Приоритет текстуры по шаблонам из конфига (по умолчанию 0)."""
+    priority = 0
+    for pattern, pattern_priority in config.TEXTURE_PRIORITY_PATTERNS.items():
+        if fnmatch(base_name.lower(), pattern.lower()):
+            priority = max(priority, pattern_priority)
+    return priority
+
+def cap_size(width, height):
+    """Применяет ограничение максимальной стороны и округление до степени двойки."""
+    if config.TEXTURE_MAX_DIM and max(width, height) > config.TEXTURE_MAX_DIM:
+        scale = config.TEXTURE_MAX_DIM / max(width, height)
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+    if config.TEXTURE_POW2:
+        width, height = floor_pow2(width), floor_pow2(height)
+    return width, height
+
+def collect_pending_textures(shard=None):
+    """Группирует PNG из PROCESSED_PNG_DIR по базовому имени (кадры __cel_ - одна текстура), только своего шарда."""
+    groups = {}
+    for png_path in sorted(config.PROCESSED_PNG_DIR.glob('*.png')):
+        if not in_shard(png_path.name, shard):
+            continue
+        groups.setdefault(get_base_name(png_path.stem), []).append(png_path)
+
+    textures = {}
+    for base_name, png_paths in groups.items():
+        size = read_png_size(png_paths[0])
+        if size is None:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать заголовок PNG {png_paths[0].name}, пропускаем в плане.")
+            continue
+        original_mat_path = find_original_mat(base_name)
+        original_info = read_mat_header(original_mat_path) if original_mat_path else None
+        if not original_info or original_info['error'] or not original_info['textures']:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Исходный MAT для {base_name} не найден или не читается, пропускаем в плане.")
+            continue
+        original_texture = original_info['textures'][0]
+        textures[base_name] = {
+            'pngs': [p.name for p in png_paths],
+            'format': original_info['format_standardized'],
+            'frames': len(png_paths),
+            'mipmap_count': original_texture['mipmap_count'],
+            'original_size': [original_texture['width'], original_texture['height']],
+            'source_size': list(size),
+            'priority': get_priority(base_name),
+            'usage_refs': usage_refs(base_name) or 0,
+        }
+    return textures
+
+def collect_packed_memory(pending_bases, shard=None):
+    """Память уже запакованных финальных MAT своего шарда (фиксированная часть бюджета) по форматам."""
+    fixed = {}
+    for final_mat_path in config.FINAL_MAT_DIR.glob('*.mat'):
+        if final_mat_path.stem in pending_bases or not in_shard(final_mat_path.name, shard):
+            continue
+        info = read_mat_header(final_mat_path)
+        if info['error']:
+            continue
+        texel_bytes = TEXEL_BYTES.get(info['format_standardized'], 4)
+        memory = sum(texture_memory(t['width'], t['height'], 1, t['mipmap_count'], texel_bytes)
+                     for t in info['textures'])
+        fixed[info['format_standardized']] = fixed.get(info['format_standardized'], 0) + memory
+    return fixed
+
+def build_texture_plan(shard=None):
+    """
+    Рассчитывает целевые размеры текстур с учетом ограничений и общего бюджета памяти.
+    Шард планирует только свои текстуры и получает долю бюджета 1/n (шарды делят имена по хэшу
+    примерно поровну), чтобы параллельные шарды не трогали чужие PNG.
+    """
+    textures = collect_pending_textures(shard)
+    fixed = collect_packed_memory(set(textures), shard)
+
+    def memory_of(entry, size):
+        return texture_memory(size[0], size[1], entry['frames'], entry['mipmap_count'],
+                              TEXEL_BYTES.get(entry['format'], 4))
+
+    for entry in textures.values():
+        entry['target_size'] = list(cap_size(*entry['source_size']))
+        entry['bytes_before'] = memory_of(entry, entry['source_size'])
+
+    budget_bytes = int(config.TEXTURE_BUDGET_MB * 1024 * 1024) if config.TEXTURE_BUDGET_MB else None
+    if budget_bytes is not None and shard is not None:
+        budget_bytes //= shard[1]
+    total = sum(fixed.values()) + sum(memory_of(e, e['target_size']) for e in textures.values())
+    budget_reached = True
+    if budget_bytes is not None and total > budget_bytes:
+        # Уменьшаем вдвое текстуры с наименьшим приоритетом (при равном - реже используемые в игре,
+        # затем самые большие), но не меньше исходного размера MAT
+        heap = [(e['priority'], e['usage_refs'], -memory_of(e, e['target_size']), base) for base, e in textures.items()]
+        heapq.heapify(heap)
+        while total > budget_bytes and heap:
+            _, _, _, base_name = heapq.heappop(heap)
+            entry = textures[base_name]
+            width, height = entry['target_size']
+            new_size = [width // 2, height // 2]
+            if new_size[0] < entry['original_size'][0] or new_size[1] < entry['original_size'][1]:
+                continue
+            total -= memory_of(entry, entry['target_size']) - memory_of(entry, new_size)
+            entry['target_size'] = new_size
+            heapq.heappush(heap, (entry['priority'], entry['usage_refs'], -memory_of(entry, new_size), base_name))
+        budget_reached = total <= budget_bytes
+
+    totals = {fmt: {'before': memory, 'after': memory} for fmt, memory in fixed.items()}
+    for entry in textures.values():
+        entry['bytes_after'] = memory_of(entry, entry['target_size'])
+        fmt_totals = totals.setdefault(entry['format'], {'before': 0, 'after': 0})
+        fmt_totals['before'] += entry['bytes_before']
+        fmt_totals['after'] += entry['bytes_after']
+
+    return {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'limits': {'max_dim': config.TEXTURE_MAX_DIM, 'pow2': config.TEXTURE_POW2, 'budget_bytes': budget_bytes},
+        'budget_reached': budget_reached,
+        'packed_bytes': sum(fixed.values()),
+        'totals': totals,
+        'textures': textures,
+    }
+
+def read_plan_file(plan_path):
+    if not plan_path.exists():
+        return {}
+    try:
+        return json.loads(plan_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError) as e:
+        print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать план текстур {plan_path.name}: {e}")
+        return {}
+
+def load_texture_plan():
+    """План текстур; без шарда к нему добавляются записи планов шардов (их пишет запаковка с --shard)."""
+    plan = read_plan_file(config.TEXTURE_PLAN_PATH)
+    for shard_plan_path in shard_state_files(config.TEXTURE_PLAN_PATH):
+        shard_textures = read_plan_file(shard_plan_path).get('textures', {})
+        if shard_textures:
+            plan = dict(plan)
+            plan['textures'] = {**plan.get('textures', {}), **shard_textures}
+    return plan
+
+def planned_size(plan, base_name):
+    """Целевой размер текстуры из плана (или None, если её нет в плане)."""
+    entry = plan.get('textures', {}).get(base_name)
+    return tuple(entry['target_size']) if entry else None
+
+def save_texture_plan(plan):
+    """Сохраняет план, сохраняя записи уже запакованных текстур для последующей проверки."""
+    previous = read_plan_file(config.TEXTURE_PLAN_PATH).get('textures', {})
+    merged = dict(plan)
+    merged['textures'] = {**previous, **plan['textures']}
+    config.TEXTURE_PLAN_PATH.write_text(json.dumps(merged, ensure_ascii=False, indent=2), encoding='utf-8')
+
+def apply_texture_plan(plan):
+    """Уменьшает PNG в PROCESSED_PNG_DIR до целевых размеров плана."""
+    # NumPy/PIL нужны только если что-то действительно уменьшается
+    from imageutil import resize_png_file
+    resized_count = 0
+    for base_name, entry in plan['textures'].items():
+        if entry['target_size'] == entry['source_size']:
+            continue
+        width, height = entry['target_size']
+        for png_name in entry['pngs']:
+            png_path = config.PROCESSED_PNG_DIR / png_name
+            try:
+                resize_png_file(png_path, width, height, binary_alpha=entry['format'] in ('rgba5551', 'indexed'))
+                resized_count += 1
+            except Exception as e:
+                print(f"  ОШИБКА: Не удалось уменьшить {png_name} до {width}x{height}: {e}")
+        entry['source_size'] = entry['target_size']
+    return resized_count
+
+def print_texture_plan_summary(plan):
+    mb = 1024 * 1024
+    print("\n--- План памяти текстур ---")
+    limits = plan['limits']
+    budget_str = f"{limits['budget_bytes'] / mb:.1f} МБ" if limits['budget_bytes'] else "нет"
+    print(f"Ограничения: макс. сторона={limits['max_dim']}, степень двойки={limits['pow2']}, бюджет={budget_str}")
+    for fmt, fmt_totals in sorted(plan['totals'].items()):
+        print(f"  {fmt}: {fmt_totals['before'] / mb:.1f} МБ -> {fmt_totals['after'] / mb:.1f} МБ")
+    total_before = sum(t['before'] for t in plan['totals'].values())
+    total_after = sum(t['after'] for t in plan['totals'].values())
+    print(f"Итого: {total_before / mb:.1f} МБ -> {total_after / mb:.1f} МБ (из них уже запаковано: {plan['packed_bytes'] / mb:.1f} МБ)")
+    reduced = [base for base, e in plan['textures'].items() if e['target_size'] != e['source_size']]
+    print(f"Текстур к уменьшению: {len(reduced)}")
+    if not plan['budget_reached']:
+        print("ПРЕДУПРЕЖДЕНИЕ: Бюджет недостижим без уменьшения ниже исходного размера MAT.")
+
+def limits_configured():
+    return bool(config.TEXTURE_MAX_DIM or config.TEXTURE_POW2 or config.TEXTURE_BUDGET_MB)
+
+def prepare_texture_budget(shard=None):
+    """
+    Этап перед запаковкой: строит план и уменьшает PNG (только своего шарда).
+    Ничего не делает без ограничений в конфиге.
+    """
+    if not limits_configured():
+        return
+    print("\n   Планирование памяти текстур перед запаковкой...")
+    plan = build_texture_plan(shard)
+    print_texture_plan_summary(plan)
+    resized_count = apply_texture_plan(plan)
+    save_texture_plan(plan)
+    print(f"   Уменьшено PNG: {resized_count}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="План памяти текстур финального пака и ограничение разрешения.")
+    parser.add_argument("--apply", action="store_true", help="Уменьшить PNG в PROCESSED_PNG_DIR согласно плану.")
+    add_shard_argument(parser)
+    args = parser.parse_args(argv)
+    use_shard_state_files(args.shard)
+
+    if not config.PROCESSED_PNG_DIR.is_dir():
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: Папка с обработанными PNG ({config.PROCESSED_PNG_DIR}) не найдена!")
+        sys.exit(1)
+    plan = build_texture_plan(args.shard)
+    print_texture_plan_summary(plan)
+    if args.apply:
+        print(f"Уменьшено PNG: {apply_texture_plan(plan)}")
+        save_texture_plan(plan)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import json
+import time
+from pathlib import Path
+from shard import shard_state_files
+
+
+class ThroughputHistory:
+    """
+    История производительности фаз: для каждой стадии хранятся последние замеры
+    (кол-во обработанных элементов, секунды, мегапиксели). Используется планировщиком
+    (plan_run.py) для оценки времени и квоты следующего запуска.
+    """
+    def __init__(self, history_path: Path, max_samples: int = 50):
+        self.history_path = history_path
+        self.max_samples = max_samples
+        self.stages = {}
+        self.load()
+
+    def load(self):
+        """Читает историю; к общему файлу добавляются замеры шардов (их файлы с суффиксом шарда)."""
+        for path in [self.history_path, *shard_state_files(self.history_path)]:
+            if not path.exists():
+                continue
+            try:
+                stages = json.loads(path.read_text(encoding='utf-8')).get('stages', {})
+            except (OSError, ValueError) as e:
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать историю производительности {path.name}: {e}")
+                continue
+            for stage, samples in stages.items():
+                merged = self.stages.setdefault(stage, [])
+                merged.extend(sample for sample in samples if sample not in merged)
+        for stage, samples in self.stages.items():
+            samples.sort(key=lambda sample: sample['at'])
+            del samples[:-self.max_samples]
+
+    def save(self):
+        try:
+            self.history_path.parent.mkdir(parents=True, exist_ok=True)
+            self.history_path.write_text(json.dumps({'stages': self.stages}, ensure_ascii=False, indent=2), encoding='utf-8')
+        except OSError as e:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось сохранить историю производительности {self.history_path.name}: {e}")
+
+    def record(self, stage: str, items: int, seconds: float, megapixels: float | None = None):
+        if items <= 0 or seconds <= 0:
+            return
+        sample = {'at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'items': items, 'seconds': round(seconds, 3)}
+        if megapixels is not None:
+            sample['megapixels'] = round(megapixels, 4)
+        samples = self.stages.setdefault(stage, [])
+        samples.append(sample)
+        del samples[:-self.max_samples]
+        self.save()
+
+    def seconds_per_item(self, stage: str) -> float | None:
+        samples = self.stages.get(stage, [])
+        items = sum(s['items'] for s in samples)
+        return sum(s['seconds'] for s in samples) / items if items else None
+
+    def seconds_per_megapixel(self, stage: str) -> float | None:
+        samples = [s for s in self.stages.get(stage, []) if s.get('megapixels')]
+        megapixels = sum(s['megapixels'] for s in samples)
+        return sum(s['seconds'] for s in samples) / megapixels if megapixels else None
@@ -0,0 +1,323 @@
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from fnmatch import fnmatch
+from pathlib import Path
+from conf import Config
+from mat_format import read_mat_header
+from png_header import read_png_size
+
+config = Config()
+
+# Маршрутизация апскейла: вместо одной модели с UPSCALE_FACTOR для всех текстур каждая получает
+# модель, масштаб и бэкенд по дешевым признакам (размер, формат и альфа из заголовков, UI по имени,
+# доля краев по прореженной копии). Решение хранится в SQLite по базовому имени: первый кадр CEL
+# решает за все остальные (INSERT OR IGNORE - в том числе между шардами и воркерами на разных машинах),
+# а проверка финальных MAT берет из него ожидаемый масштаб.
+
+BACKENDS = ("api", "local")
+CONDITIONS = {"min_side", "max_side", "formats", "alpha", "ui", "min_edge_density", "max_edge_density"}
+ROUTE_FIELDS = CONDITIONS | {"name", "model", "scale", "backend"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS routes (
+    base TEXT PRIMARY KEY,
+    route TEXT NOT NULL,
+    model TEXT,
+    scale INTEGER NOT NULL,
+    backend TEXT NOT NULL,
+    features TEXT NOT NULL,
+    decided_at REAL NOT NULL
+);
+"""
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_base_name(png_stem):
+    return png_stem.split('__cel_')[0] if '__cel_' in png_stem else png_stem
+
+
+def default_route() -> dict:
+    return {'name': "default", 'model': config.TARGET_MODEL_NAME, 'scale': config.UPSCALE_FACTOR, 'backend': "api"}
+
+
+def validate_routes(routes=None) -> list[str]:
+    """Проверяет UPSCALE_ROUTES. Возвращает список ошибок (пустой, если правила корректны)."""
+    problems = []
+    for index, rule in enumerate(config.UPSCALE_ROUTES if routes is None else routes):
+        label = f"правило #{index + 1} ({rule.get('name', 'без имени')})" if isinstance(rule, dict) else f"правило #{index + 1}"
+        if not isinstance(rule, dict):
+            problems.append(f"{label}: ожидается словарь")
+            continue
+        unknown = set(rule) - ROUTE_FIELDS
+        if unknown:
+            problems.append(f"{label}: неизвестные поля {', '.join(sorted(unknown))}")
+        if rule.get('backend', "api") not in BACKENDS:
+            problems.append(f"{label}: backend должен быть одним из {', '.join(BACKENDS)}")
+        scale = rule.get('scale', config.UPSCALE_FACTOR)
+        if not isinstance(scale, int) or scale < 1:
+            problems.append(f"{label}: scale должен быть целым числом >= 1")
+    return problems
+
+
+def route_list() -> list[dict]:
+    """Правила с подставленными значениями по умолчанию (последнее - маршрут по умолчанию)."""
+    routes = []
+    for index, rule in enumerate(config.UPSCALE_ROUTES):
+        route = {**default_route(), 'name': f"route{index + 1}", **rule}
+        if route['backend'] == "local":
+            route['model'] = None
+        routes.append(route)
+    return routes + [default_route()]
+
+
+def max_scale() -> int:
+    """Наибольший масштаб среди маршрутов (оценка памяти до выбора маршрута)."""
+    return max(route['scale'] for route in route_list())
+
+
+def is_ui_texture(base_name: str) -> bool:
+    return any(fnmatch(base_name.lower(), pattern.lower()) for pattern in config.UPSCALE_UI_PATTERNS)
+
+
+def needs_edge_density() -> bool:
+    return any('min_edge_density' in rule or 'max_edge_density' in rule for rule in config.UPSCALE_ROUTES)
+
+
+def measure_edge_density(png_path: Path) -> float | None:
+    """Доля пикселей-краев PNG (None, если NumPy недоступен или файл не читается)."""
+    try:
+        import numpy as np
+        from PIL import Image
+        from imageutil import edge_density
+    except ImportError:
+        return None
+    try:
+        with Image.open(png_path) as img:
+            pixels = np.asarray(img.convert('RGBA' if 'A' in img.getbands() else 'RGB'))
+    except OSError:
+        return None
+    return round(edge_density(pixels, config.UPSCALE_EDGE_THRESHOLD), 4)
+
+
+def texture_features(png_path: Path, mat_info: dict) -> dict:
+    """Признаки текстуры для выбора маршрута. Пиксели читаются только для доли краев."""
+    size = read_png_size(png_path)
+    features = {
+        'width': size[0] if size else 0,
+        'height': size[1] if size else 0,
+        'format': mat_info['format_standardized'],
+        'alpha': bool(mat_info['has_alpha']),
+        'ui': is_ui_texture(get_base_name(png_path.stem)),
+    }
+    if needs_edge_density():
+        features['edge_density'] = measure_edge_density(png_path)
+    return features
+
+
+def route_matches(rule: dict, features: dict) -> bool:
+    side = max(features['width'], features['height'])
+    if 'min_side' in rule and side < rule['min_side']:
+        return False
+    if 'max_side' in rule and side > rule['max_side']:
+        return False
+    if 'formats' in rule and features['format'] not in rule['formats']:
+        return False
+    if 'alpha' in rule and features['alpha'] != rule['alpha']:
+        return False
+    if 'ui' in rule and features['ui'] != rule['ui']:
+        return False
+    density = features.get('edge_density')
+    if ('min_edge_density' in rule or 'max_edge_density' in rule) and density is None:
+        return False  # Без NumPy условие по краям не проверить - правило пропускается
+    if 'min_edge_density' in rule and density < rule['min_edge_density']:
+        return False
+    if 'max_edge_density' in rule and density > rule['max_edge_density']:
+        return False
+    return True
+
+
+def choose_route(features: dict) -> dict:
+    """Первое подходящее правило UPSCALE_ROUTES или маршрут по умолчанию."""
+    for rule, route in zip(config.UPSCALE_ROUTES, route_list()):
+        if route_matches(rule, features):
+            return route
+    return default_route()
+
+
+class RoutingDB:
+    """
+    Решения маршрутизации по базовому имени. Соединение - на каждую операцию, как в UsedStore:
+    потоки Скрипта 2 и несколько процессов пишут в одну базу.
+    """
+    def __init__(self, db_path: Path, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_path), timeout=self.timeout, isolation_level=None)
+
+    def get(self, base_name: str) -> dict | None:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT route, model, scale, backend, features FROM routes WHERE base = ?",
+                               (base_name.lower(),)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        route, model, scale, backend, features = row
+        return {'name': route, 'model': model, 'scale': scale, 'backend': backend, 'features': json.loads(features)}
+
+    def decide(self, base_name: str, route: dict, features: dict) -> dict:
+        """Сохраняет решение, если для базы его еще нет. Возвращает действующее (возможно, чужое) решение."""
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR IGNORE INTO routes (base, route, model, scale, backend, features, decided_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (base_name.lower(), route['name'], route['model'], route['scale'], route['backend'],
+                          json.dumps(features, ensure_ascii=False), time.time()))
+        finally:
+            conn.close()
+        return self.get(base_name)
+
+    def forget(self, base_name: str) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("DELETE FROM routes WHERE base = ?", (base_name.lower(),)).rowcount
+        finally:
+            conn.close()
+
+    def counts(self) -> dict:
+        conn = self._connect()
+        try:
+            return dict(conn.execute("SELECT route, COUNT(*) FROM routes GROUP BY route").fetchall())
+        finally:
+            conn.close()
+
+
+def get_routing_db() -> RoutingDB:
+    global _db
+    with _db_lock:
+        if _db is None or _db.db_path != config.UPSCALE_ROUTING_DB:
+            _db = RoutingDB(config.UPSCALE_ROUTING_DB)
+        return _db
+
+
+def route_for_png(png_path: Path, mat_info: dict) -> dict:
+    """
+    Маршрут апскейла PNG: сохраненное решение для базы или новое по признакам этого кадра.
+    Без правил в конфиге новые решения не сохраняются (маршрут по умолчанию).
+    """
+    if not config.UPSCALE_ROUTES and not config.UPSCALE_ROUTING_DB.exists():
+        return default_route()
+    base_name = get_base_name(png_path.stem)
+    db = get_routing_db()
+    decision = db.get(base_name)
+    if decision is None and not config.UPSCALE_ROUTES:
+        return default_route()
+    if decision is None:
+        features = texture_features(png_path, mat_info)
+        decision = db.decide(base_name, choose_route(features), features)
+    return decision
+
+
+def routed_scale(base_name: str) -> int:
+    """Масштаб, с которым апскейлилась база (UPSCALE_FACTOR, если решения нет)."""
+    if not config.UPSCALE_ROUTING_DB.exists():
+        return config.UPSCALE_FACTOR
+    decision = get_routing_db().get(base_name)
+    return decision['scale'] if decision else config.UPSCALE_FACTOR
+
+
+def forget_route(base_name: str) -> int:
+    """Удаляет решение для базы (исходный MAT изменился - признаки могли поменяться)."""
+    if not config.UPSCALE_ROUTING_DB.exists():
+        return 0
+    return get_routing_db().forget(base_name)
+
+
+def preview_routes(png_paths: list[Path]) -> tuple[dict, list]:
+    """
+    Маршруты для PNG без сохранения новых решений (для баз с решением - сохраненное).
+    Возвращает (счетчики по маршрутам, строки для вывода).
+    """
+    status_counts = {}
+    rows = []
+    db = get_routing_db() if config.UPSCALE_ROUTING_DB.exists() else None
+    for png_path in png_paths:
+        base_name = get_base_name(png_path.stem)
+        decision = db.get(base_name) if db is not None else None
+        if decision is not None:
+            status_counts[decision['name']] = status_counts.get(decision['name'], 0) + 1
+            rows.append((png_path.name, decision, decision['features']))
+            continue
+        mat_dir = config.USED_MANUAL_MAT_DIR if '__cel_' in png_path.stem else config.USED_MAT_DIR
+        mat_info = read_mat_header(mat_dir / f"{base_name}.mat")
+        if mat_info['error']:
+            status_counts['error_mat_info_failed'] = status_counts.get('error_mat_info_failed', 0) + 1
+            continue
+        features = texture_features(png_path, mat_info)
+        route = choose_route(features)
+        status_counts[route['name']] = status_counts.get(route['name'], 0) + 1
+        rows.append((png_path.name, route, features))
+    return status_counts, rows
+
+
+def print_summary_report_routing(total_files, status_counts, rows, verbose=False):
+    print("\n--- Маршруты апскейла ---")
+    print(f"PNG к апскейлу: {total_files}, правил в UPSCALE_ROUTES: {len(config.UPSCALE_ROUTES)}")
+    routes = {route['name']: route for route in route_list()}
+    for name, count in sorted(status_counts.items(), key=lambda item: -item[1]):
+        route = routes.get(name)
+        if route is None:
+            print(f"  {name}: {count}" + ("" if name.startswith("error_") else " (правила с таким именем больше нет)"))
+            continue
+        target = f"модель {route['model']}" if route['backend'] == "api" else "локально (Lanczos)"
+        print(f"  {name}: {count} - {target}, x{route['scale']}")
+    if verbose:
+        for png_name, route, features in rows:
+            density = features.get('edge_density')
+            density_str = f", края {density:.3f}" if density is not None else ""
+            print(f"    {png_name}: {route['name']} ({features['width']}x{features['height']}, {features['format']}"
+                  f"{', альфа' if features['alpha'] else ''}{', UI' if features['ui'] else ''}{density_str})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Маршрутизация апскейла: какие текстуры на какую модель и масштаб.")
+    parser.add_argument("--verbose", action="store_true", help="Печатать маршрут и признаки каждого PNG.")
+    parser.add_argument("--forget", nargs='+', metavar="BASE", help="Удалить сохраненные решения для баз.")
+    args = parser.parse_args(argv)
+
+    problems = validate_routes()
+    if problems:
+        print("КРИТИЧЕСКАЯ ОШИБКА: Некорректные правила UPSCALE_ROUTES:")
+        for problem in problems:
+            print(f"  - {problem}")
+        sys.exit(1)
+    if args.forget:
+        removed = sum(forget_route(base_name) for base_name in args.forget)
+        print(f"Удалено решений маршрутизации: {removed}")
+        return
+
+    png_paths = sorted(path for fmt_dir in config.FORMAT_DIRS.values() if fmt_dir.exists() for path in fmt_dir.glob('*.png'))
+    status_counts, rows = preview_routes(png_paths)
+    print_summary_report_routing(len(png_paths), status_counts, rows, args.verbose)
+    if config.UPSCALE_ROUTING_DB.exists():
+        print(f"\nСохраненные решения ({config.UPSCALE_ROUTING_DB.name}): "
+              + (", ".join(f"{name} {count}" for name, count in sorted(get_routing_db().counts().items())) or "нет"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import importlib
+import threading
+from pathlib import Path
+from conf import Config
+from context import get_context
+from quota import QuotaState, sleep_until_reset
+from endpoint_pool import Endpoint
+from work_queue import WorkQueue
+from usage_index import apply_usage
+
+config = Config()
+
+# Фаза 2 (имя модуля начинается с цифры, поэтому импорт через importlib)
+phase2 = importlib.import_module("2_convert_webp_ai")
+
+
+def parse_args_worker(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Воркер общей очереди апскейла: берет PNG из FORMAT_DIRS, апскейлит и пишет в PROCESSED_PNG_DIR. "
+                    "Можно запускать несколько воркеров на разных машинах с общей папкой.")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}",
+                        help="Имя воркера в очереди (по умолчанию host-pid).")
+    parser.add_argument("--backend", choices=["gradio", "standin"], default="gradio",
+                        help="gradio - Hugging Face Space; standin - локальная замена API для проверки очереди.")
+    parser.add_argument("--space", default=config.HF_SPACE_URL, help="Space этого воркера.")
+    parser.add_argument("--token", default=None,
+                        help=f"Токен Hugging Face этого воркера (по умолчанию из переменной {config.HF_TOKEN_ENV}).")
+    parser.add_argument("--standin", default="",
+                        help='Параметры локальной замены API, например "latency=0.5,jitter=0.2,failure_rate=0.1,seed=1".')
+    parser.add_argument("--lease", type=float, default=config.WORK_QUEUE_LEASE_SECONDS, help="Время аренды задачи, сек.")
+    parser.add_argument("--queue-db", default=str(config.WORK_QUEUE_DB), help="Путь к файлу очереди (SQLite).")
+    parser.add_argument("--single-host", action="store_true",
+                        help="Все воркеры на этой машине: EXTRACTED_DIR и PROCESSED_PNG_DIR могут быть вне DURABLE_DIR.")
+    return parser.parse_args(argv)
+
+def find_unshared_dirs(queue_db):
+    """
+    Папки очереди, которых не видят воркеры других машин: входные PNG (EXTRACTED_DIR) и результаты
+    (PROCESSED_PNG_DIR) должны лежать на общей папке DURABLE_DIR, как и файл очереди.
+    """
+    shared = config.DURABLE_DIR.resolve()
+    dirs = {"EXTRACTED_DIR": config.EXTRACTED_DIR, "PROCESSED_PNG_DIR": config.PROCESSED_PNG_DIR, "--queue-db": queue_db}
+    return [f"{name} = {path}" for name, path in dirs.items() if not path.resolve().is_relative_to(shared)]
+
+def collect_tasks():
+    """Задачи очереди: извлеченные PNG без результата в PROCESSED_PNG_DIR (имя файла, путь от EXTRACTED_DIR)."""
+    tasks = []
+    for fmt_dir in config.FORMAT_DIRS.values():
+        if not fmt_dir.exists():
+            continue
+        for png_path in sorted(fmt_dir.glob('*.png')):
+            if not (config.PROCESSED_PNG_DIR / png_path.name).exists():
+                tasks.append((png_path.name, png_path.relative_to(config.EXTRACTED_DIR).as_posix()))
+    return apply_usage(tasks, "PNG", key=lambda task: task[0])
+
+def connect_backend(args):
+    """Возвращает пул из одного эндпоинта этого воркера (повторы и вывод из ротации - как в Скрипте 2)."""
+    if args.backend == "standin":
+        from standin_upscaler import make_standin_client
+        client = make_standin_client(args.standin)
+        print(f"\n3. Используется локальная замена API ({args.standin or 'параметры по умолчанию'}).")
+        endpoint = Endpoint(f"standin ({args.worker_id})", client=client)
+    else:
+        token = args.token or os.environ.get(config.HF_TOKEN_ENV)
+        client = phase2.initialize_gradio_client(args.space, token=token)
+        # У каждого воркера свой аккаунт, поэтому квота учитывается отдельно для пары Space+воркер
+        endpoint = Endpoint(f"{args.space} ({args.worker_id})", client=client)
+    return phase2.make_endpoint_pool([endpoint])
+
+def start_heartbeat(queue, worker_id, task_name, lease_seconds):
+    """Поток, продлевающий аренду задачи. Возвращает (stop_event, lost_event)."""
+    stop_event, lost_event = threading.Event(), threading.Event()
+
+    def beat():
+        while not stop_event.wait(max(1.0, lease_seconds / 3)):
+            try:
+                if not queue.heartbeat(worker_id, task_name, lease_seconds):
+                    lost_event.set()
+                    return
+            except Exception as e:
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось продлить аренду {task_name}: {e}")
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop_event, lost_event
+
+def process_task(queue, args, pool, task_name, source, staging_dir):
+    """Обрабатывает одну задачу из очереди. Возвращает статус."""
+    original_png_path = config.EXTRACTED_DIR / source
+    processed_png_path = config.PROCESSED_PNG_DIR / task_name
+    if processed_png_path.exists():
+        print(f"\nПропуск: {task_name} уже существует в {config.PROCESSED_PNG_DIR.name}.")
+        queue.complete(args.worker_id, task_name)
+        return "skipped"
+    if not original_png_path.exists():
+        print(f"\nОШИБКА: Исходный PNG {source} не найден в {config.EXTRACTED_DIR.name}.")
+        queue.fail(args.worker_id, task_name, "source_not_found", 1)
+        return "error_source_not_found"
+
+    staged_png_path = staging_dir / task_name
+    # Остаток прерванной попытки: без удаления process_single_png вернул бы "skipped" и задача ушла бы в fail
+    staged_png_path.unlink(missing_ok=True)
+    stop_event, lost_event = start_heartbeat(queue, args.worker_id, task_name, args.lease)
+    try:
+        status = phase2.process_single_png(original_png_path, pool, staging_dir)
+    finally:
+        stop_event.set()
+
+    if lost_event.is_set():
+        # Аренда истекла, и задачу мог взять другой воркер - результат не публикуем
+        print(f"  ПРЕДУПРЕЖДЕНИЕ: Аренда {task_name} потеряна, результат отброшен.")
+        staged_png_path.unlink(missing_ok=True)
+        return "lease_lost"
+
+    if status in ("success", "success_local", "success_routed_local"):
+        # Сначала завершаем задачу в очереди: если аренда уже у другого воркера, его результат не перезаписывается
+        if not queue.complete(args.worker_id, task_name):
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Аренда {task_name} истекла до завершения, результат отброшен.")
+            staged_png_path.unlink(missing_ok=True)
+            return "lease_lost"
+        os.replace(staged_png_path, processed_png_path)  # Атомарно: другие воркеры не увидят недописанный PNG
+        return status
+
+    staged_png_path.unlink(missing_ok=True)
+    if status == "quota_exceeded":
+        queue.release(args.worker_id, task_name)
+    else:
+        queue.fail(args.worker_id, task_name, status, config.WORK_QUEUE_MAX_ATTEMPTS)
+    return status
+
+def print_summary_report_worker(worker_id, status_counts, queue_counts):
+    print(f"\n--- Воркер {worker_id} завершен ---")
+    print(f"Успешно обработано: {status_counts.get('success', 0)}")
+    if status_counts.get('success_local', 0) > 0:
+        print(f"Простые текстуры обработаны локально (сэкономлено вызовов API): {status_counts['success_local']}")
+    if status_counts.get('success_routed_local', 0) > 0:
+        print(f"Обработано локально по маршрутам UPSCALE_ROUTES (без API): {status_counts['success_routed_local']}")
+    print(f"Пропущено (результат уже существовал): {status_counts.get('skipped', 0)}")
+    if status_counts.get('quota_exceeded', 0) > 0:
+        print(f"Срабатываний лимита квоты GPU: {status_counts['quota_exceeded']}")
+    if status_counts.get('lease_lost', 0) > 0:
+        print(f"Потеряно аренд (результат отброшен): {status_counts['lease_lost']}")
+    errors_total = sum(v for k, v in status_counts.items() if k.startswith("error_"))
+    print(f"Ошибок при обработке: {errors_total}")
+    for status, count in status_counts.items():
+        if status.startswith("error_"):
+            print(f"  - {status}: {count}")
+    print("\nСостояние очереди: " + ", ".join(f"{state}: {count}" for state, count in sorted(queue_counts.items())))
+    if queue_counts.get('failed', 0):
+        print("  Задачи 'failed' исчерпали попытки; подробности в колонке last_error файла очереди.")
+
+def main(argv=None):
+    args = parse_args_worker(argv)
+    start_time = time.time()
+    print(f"\n--- Воркер апскейла {args.worker_id} ({args.backend}) ---")
+    unshared = [] if args.single_host else find_unshared_dirs(Path(args.queue_db))
+    if unshared:
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: Очередь общая для нескольких машин, но эти пути вне общей папки DURABLE_DIR "
+              f"({config.DURABLE_DIR}):")
+        for line in unshared:
+            print(f"  - {line}")
+        print("  Укажите JONES_SCRATCH_DIR (scratch_dir в jones.ini) на общей папке или запускайте воркеры "
+              "только на этой машине с --single-host.")
+        sys.exit(1)
+
+    phase2.setup_directories_phase2()
+    queue = WorkQueue(Path(args.queue_db))
+    added = queue.populate(collect_tasks())
+    queue.register_worker(args.worker_id)
+    print(f"\n2. Очередь: {args.queue_db} (добавлено новых задач: {added})")
+
+    # Отдельный файл состояния квоты на воркер: несколько процессов не перезаписывают друг друга
+    phase2.quota_state = QuotaState(
+        config.QUOTA_STATE_FILE.with_name(f"{config.QUOTA_STATE_FILE.stem}_{args.worker_id}.json"), config.QUOTA_DEFAULT_WAIT)
+    pool = connect_backend(args)
+    endpoint = pool.endpoints[0].url
+    staging_dir = config.PROCESSED_PNG_DIR / f".staging_{args.worker_id}"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+
+    print("\n4. Обработка задач из очереди...")
+    status_counts = {}
+    while True:
+        wait = phase2.quota_state.seconds_until_reset(endpoint)
+        if wait > 0:
+            sleep_until_reset(wait, config.QUOTA_WAIT_MARGIN)
+
+        task = queue.claim(args.worker_id, args.lease, config.WORK_QUEUE_MAX_ATTEMPTS)
+        if task is None:
+            counts = queue.counts()
+            if counts.get('leased', 0) == 0 and counts.get('pending', 0) == 0:
+                break
+            # Задачи в аренде у других воркеров: ждем, пока они завершатся или их аренда истечет
+            time.sleep(config.WORK_QUEUE_POLL_SECONDS)
+            continue
+
+        task_name, source = task
+        status = process_task(queue, args, pool, task_name, source, staging_dir)
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    try:
+        staging_dir.rmdir()
+    except OSError:
+        pass
+
+    phase2.print_endpoint_stats(pool)
+    print_summary_report_worker(args.worker_id, status_counts, queue.counts())
+    get_context().record_phase("upscale", status_counts, time.time() - start_time)
+    get_context().history.record("upscale_api", phase2.api_stats['calls'], phase2.api_stats['seconds'],
+                                 phase2.api_stats['megapixels'])
+
+if __name__ == "__main__":
+    main()
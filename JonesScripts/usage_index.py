@@ -0,0 +1,226 @@
+import re
+import sys
+import json
+import time
+import struct
+import argparse
+from fnmatch import fnmatch
+from pathlib import Path
+from conf import Config
+from shard import shard_base_name
+
+config = Config()
+
+# Индекс использования текстур: какие MAT загружает игра и на скольких уровнях.
+# Уровни (JKL/NDY/CND), модели (3DO), скрипты и исполняемые файлы просматриваются как байты
+# на имена вида name.mat / name.3do - так читаются и текстовые, и скомпилированные форматы.
+# Текстура модели считается использованной на всех уровнях, где используется модель.
+# Файлы внутри GOB архивов просматриваются без распаковки.
+# Индекс (USAGE_INDEX_PATH) строится командой jones.py usage; если он есть, фазы пропускают
+# текстуры без ссылок и обрабатывают первыми самые используемые.
+
+REFERENCE = re.compile(rb'[\w\-]+\.(mat|3do)\b', re.IGNORECASE)
+LEVEL_EXTENSIONS = {'.jkl', '.ndy', '.cnd'}
+MODEL_EXTENSIONS = {'.3do'}
+GOB_MAGIC = b'GOB '
+_GOB_HEADER = struct.Struct('<4sII')  # 'GOB ', версия, смещение каталога
+_GOB_ENTRY = struct.Struct('<II128s')  # смещение, размер, имя
+
+_index = None  # Загруженный индекс (None - еще не загружен, {} - индекса нет)
+
+
+def scan_references(data: bytes) -> dict:
+    """Имена MAT и 3DO (в нижнем регистре, с расширением) -> кол-во упоминаний в данных файла."""
+    references = {}
+    for match in REFERENCE.finditer(data):
+        name = match.group(0).decode('ascii', 'ignore').lower()
+        references[name] = references.get(name, 0) + 1
+    return references
+
+
+def iter_gob_entries(gob_path: Path):
+    """(имя внутри архива, данные) для каждого файла GOB; пусто, если формат не распознан."""
+    with open(gob_path, 'rb') as f:
+        raw = f.read()
+    if len(raw) < _GOB_HEADER.size:
+        return
+    magic, _, directory_offset = _GOB_HEADER.unpack_from(raw, 0)
+    if magic != GOB_MAGIC or directory_offset + 4 > len(raw):
+        return
+    (count,) = struct.unpack_from('<I', raw, directory_offset)
+    for index in range(count):
+        position = directory_offset + 4 + index * _GOB_ENTRY.size
+        if position + _GOB_ENTRY.size > len(raw):
+            break
+        offset, size, name = _GOB_ENTRY.unpack_from(raw, position)
+        yield name.split(b'\0', 1)[0].decode('ascii', 'ignore'), raw[offset:offset + size]
+
+
+def iter_sources():
+    """(имя источника, расширение, данные) для файлов уровней, моделей и скриптов из USAGE_SOURCE_DIRS."""
+    extensions = {ext.lower() for ext in config.USAGE_SOURCE_EXTENSIONS}
+    for source_dir in config.USAGE_SOURCE_DIRS:
+        source_dir = Path(source_dir)
+        if not source_dir.is_dir():
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Папка источников {source_dir} не найдена, пропускаем.")
+            continue
+        for path in sorted(source_dir.rglob('*')):
+            suffix = path.suffix.lower()
+            if not path.is_file():
+                continue
+            try:
+                if suffix in ('.gob', '.goo'):
+                    for name, data in iter_gob_entries(path):
+                        inner_suffix = Path(name.replace('\\', '/')).suffix.lower()
+                        if inner_suffix in extensions:
+                            yield f"{path.name}:{name}", inner_suffix, data
+                elif suffix in extensions:
+                    yield str(path.relative_to(source_dir)), suffix, path.read_bytes()
+            except OSError as e:
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать {path}: {e}")
+
+
+def build_usage_index() -> dict:
+    """
+    Обратный индекс: текстура -> {'refs': упоминаний, 'levels': [...], 'models': [...], 'other': [...]}.
+    'other' - скрипты и исполняемые файлы, которые могут загрузить текстуру на любом уровне.
+    """
+    level_refs, model_refs, other_refs = {}, {}, {}
+    for source, suffix, data in iter_sources():
+        references = scan_references(data)
+        if suffix in LEVEL_EXTENSIONS:
+            level_refs[source] = references
+        elif suffix in MODEL_EXTENSIONS:
+            model_refs[Path(source.replace('\\', '/').split(':')[-1]).stem.lower() + '.3do'] = references
+        else:
+            other_refs[source] = references
+
+    textures = {}
+
+    def add(mat_ref, count, key, source):
+        entry = textures.setdefault(mat_ref[:-len('.mat')], {'refs': 0, 'levels': set(), 'models': set(), 'other': set()})
+        entry['refs'] += count
+        entry[key].add(source)
+
+    # Модель на уровне или в скрипте: ее текстуры используются там же (столько раз, сколько упомянута модель)
+    for sources, key in ((level_refs, 'levels'), (other_refs, 'other')):
+        for source, references in sources.items():
+            for name, count in references.items():
+                if name.endswith('.mat'):
+                    add(name, count, key, source)
+                elif name in model_refs:
+                    for mat_name, mat_count in model_refs[name].items():
+                        if mat_name.endswith('.mat'):
+                            add(mat_name, mat_count * count, key, source)
+                            textures[mat_name[:-len('.mat')]]['models'].add(name)
+    # Модели, которые не упоминает ни один уровень или скрипт, ссылок не добавляют
+    for model, references in model_refs.items():
+        for name in references:
+            if name.endswith('.mat'):
+                add(name, 0, 'models', model)
+
+    return {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sources': {'levels': len(level_refs), 'models': len(model_refs), 'other': len(other_refs)},
+        'textures': {name: {'refs': entry['refs'], 'levels': sorted(entry['levels']),
+                            'models': sorted(entry['models']), 'other': sorted(entry['other'])}
+                     for name, entry in sorted(textures.items())},
+    }
+
+
+def load_usage_index() -> dict:
+    """Текстуры индекса (пустой словарь, если индекс не построен или USAGE_FILTER выключен)."""
+    global _index
+    if _index is None:
+        _index = {}
+        if config.USAGE_FILTER and config.USAGE_INDEX_PATH.exists():
+            try:
+                data = json.loads(config.USAGE_INDEX_PATH.read_text(encoding='utf-8'))
+                if data['sources']['levels']:
+                    _index = data['textures']
+                else:
+                    print("  ПРЕДУПРЕЖДЕНИЕ: В индексе использования нет уровней - фильтр по использованию отключен.")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось прочитать индекс использования {config.USAGE_INDEX_PATH.name}: {e}")
+    return _index
+
+
+def usage_refs(name: str) -> int | None:
+    """Кол-во ссылок на текстуру (по имени файла или базовому имени); None, если индекса нет."""
+    index = load_usage_index()
+    if not index:
+        return None
+    base_name = shard_base_name(name)
+    if any(fnmatch(base_name, pattern.lower()) for pattern in config.USAGE_KEEP_PATTERNS):
+        return max(1, index.get(base_name, {}).get('refs', 0))
+    entry = index.get(base_name)
+    if entry is None:
+        return 0
+    return entry['refs']
+
+
+def apply_usage(items, label="файлов", key=lambda path: path.name):
+    """
+    Убирает текстуры, на которые не ссылается ни один уровень, модель или скрипт, и сортирует
+    остальные по убыванию ссылок (самые используемые - первыми). Без индекса - возвращает как есть.
+    """
+    items = list(items)
+    if not load_usage_index():
+        return items
+    refs = {id(item): usage_refs(key(item)) for item in items}
+    used = [item for item in items if refs[id(item)] > 0]
+    used.sort(key=lambda item: -refs[id(item)])
+    if len(used) != len(items):
+        print(f"   Индекс использования: пропущено {len(items) - len(used)} из {len(items)} {label} "
+              f"(не используются в игре).")
+    return used
+
+
+def print_usage_summary(index, mat_names):
+    textures = index['textures']
+    used = [name for name in mat_names if textures.get(name, {}).get('refs', 0) > 0]
+    unused = sorted(set(mat_names) - set(used))
+    print("\n--- Индекс использования текстур построен ---")
+    print(f"Просмотрено: уровней {index['sources']['levels']}, моделей {index['sources']['models']}, "
+          f"прочих файлов {index['sources']['other']}")
+    print(f"Текстур со ссылками: {sum(1 for entry in textures.values() if entry['refs'] > 0)}")
+    print(f"MAT в ресурсах: {len(mat_names)}, используются: {len(used)}, не используются: {len(unused)}")
+    for name in unused[:20]:
+        print(f"  - {name}.mat")
+    if len(unused) > 20:
+        print(f"  ... и еще {len(unused) - 20}")
+    top = sorted(used, key=lambda name: -textures[name]['refs'])[:10]
+    if top:
+        print("Самые используемые:")
+        for name in top:
+            print(f"  {name}.mat: ссылок {textures[name]['refs']}, уровней {len(textures[name]['levels'])}")
+    missing = sorted(set(textures) - set(mat_names))
+    if missing:
+        print(f"Ссылок на MAT, которых нет в ресурсах: {len(missing)} (например, {', '.join(missing[:5])})")
+    print(f"\nИндекс сохранен в: {config.USAGE_INDEX_PATH}")
+
+
+def main(argv=None):
+    global _index
+    parser = argparse.ArgumentParser(description="Индекс использования текстур по файлам уровней и моделей.")
+    parser.parse_args(argv)
+    print("\n--- Индекс использования текстур (уровни, модели, скрипты) ---")
+    print(f"Источники: {', '.join(str(d) for d in config.USAGE_SOURCE_DIRS)}")
+    start_time = time.time()
+    index = build_usage_index()
+    if not index['sources']['levels']:
+        print("ОШИБКА: Не найдено ни одного файла уровня - проверьте USAGE_SOURCE_DIRS. Индекс не сохранен.")
+        sys.exit(1)
+    config.USAGE_INDEX_PATH.write_text(json.dumps(index, ensure_ascii=False, indent=1), encoding='utf-8')
+    _index = None
+
+    mat_names = set()
+    for directory in (config.MAT_DIR, config.MANUAL_CEL_DIR, config.USED_MAT_DIR, config.USED_MANUAL_MAT_DIR):
+        if directory.is_dir():
+            mat_names.update(path.stem.lower() for path in directory.glob('*.mat'))
+    print_usage_summary(index, sorted(mat_names))
+    print(f"Время: {time.time() - start_time:.2f} сек.")
+
+
+if __name__ == "__main__":
+    main()
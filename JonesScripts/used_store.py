@@ -0,0 +1,365 @@
+import io
+import os
+import re
+import sys
+import time
+import zlib
+import struct
+import sqlite3
+import zipfile
+import argparse
+import warnings
+from pathlib import Path
+from conf import Config
+from fsutil import safe_move, display_path
+from shard import shard_base_name
+
+config = Config()
+
+# Архив использованных PNG: вместо десятков тысяч отдельных файлов в USED_DIR - несколько больших
+# ZIP (used_NNNN.zip), в которые файлы только дописываются. Индекс SQLite (имя -> архив, смещение данных,
+# размер, CRC) отвечает на вопрос "есть ли результат для базы" без просмотра папки и позволяет читать
+# один файл из середины архива без разбора его каталога. Удаление (watch) убирает запись из индекса,
+# данные остаются в архиве до его пересоздания. Отдельные файлы, уже лежащие в USED_DIR, по-прежнему
+# учитываются; jones.py used-store --migrate переносит их в архив.
+
+CHUNK_NAME = re.compile(r'^used_(\d{4,})\.zip$', re.IGNORECASE)
+COMPRESSION = {"stored": zipfile.ZIP_STORED, "deflated": zipfile.ZIP_DEFLATED, "lzma": zipfile.ZIP_LZMA}
+_LOCAL_HEADER = struct.Struct('<4s22xHH')  # сигнатура локального заголовка ZIP, длины имени и extra
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    base TEXT NOT NULL,
+    chunk TEXT NOT NULL,
+    data_offset INTEGER NOT NULL,
+    compress_size INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    compress_type INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_base ON entries(base);
+"""
+
+_store = None
+
+
+class UsedStore:
+    """
+    Архив использованных файлов в папке directory с индексом index_path.
+    Запись в архив и индекс идет под блокировкой записи SQLite (BEGIN IMMEDIATE), поэтому
+    несколько процессов (шарды) могут дописывать одновременно. Соединение - на каждую операцию,
+    как в WorkQueue: чтение безопасно из нескольких потоков (экспорт).
+    """
+    def __init__(self, directory: Path, index_path: Path, timeout: float = 30.0):
+        self.directory = directory
+        self.index_path = index_path
+        self.timeout = timeout
+        self.directory.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(str(self.index_path), timeout=self.timeout, isolation_level=None)
+
+    def _current_chunk(self) -> Path:
+        """Архив для записи: последний, если он не заполнен и читается как ZIP, иначе следующий по номеру."""
+        chunks = sorted((int(match.group(1)), path) for path in self.directory.glob('used_*.zip')
+                        if (match := CHUNK_NAME.match(path.name)))
+        if chunks:
+            number, path = chunks[-1]
+            size = path.stat().st_size
+            if size < config.USED_STORE_CHUNK_MB * 1024 * 1024 and (size == 0 or zipfile.is_zipfile(path)):
+                return path
+            if size and not zipfile.is_zipfile(path):
+                print(f"  ПРЕДУПРЕЖДЕНИЕ: Каталог архива {path.name} поврежден (прерванная запись?), "
+                      f"новые файлы пишутся в следующий архив.")
+            return self.directory / f"used_{number + 1:04d}.zip"
+        return self.directory / "used_0000.zip"
+
+    def _append(self, chunk_path: Path, name: str, data: bytes, mtime: float) -> tuple[int, int, int, int]:
+        """Дописывает файл в архив и сбрасывает его на диск. Возвращает (смещение данных, размер в архиве, тип сжатия, CRC)."""
+        info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+        info.compress_type = COMPRESSION[config.USED_STORE_COMPRESSION]
+        exists = chunk_path.exists() and chunk_path.stat().st_size > 0
+        with open(chunk_path, 'r+b' if exists else 'w+b') as f:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)  # Повторное имя (обновленный кадр) - новая запись в конце
+                with zipfile.ZipFile(f, 'a' if exists else 'w', allowZip64=True) as archive:
+                    archive.writestr(info, data)
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+        if signature != b'PK\x03\x04':
+            raise OSError(f"Не найден локальный заголовок {name} в {chunk_path.name}")
+        data_offset = info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+        return data_offset, info.compress_size, info.compress_type, info.CRC
+
+    def add(self, src_path: Path):
+        """
+        Переносит файл в архив: запись в архив, затем в индекс, затем удаление исходного.
+        При сбое до записи индекса файл остается на месте, а в архиве - недостижимая копия.
+        """
+        src_path = Path(src_path)
+        data = src_path.read_bytes()
+        mtime = src_path.stat().st_mtime
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                chunk_path = self._current_chunk()
+                data_offset, compress_size, compress_type, crc = self._append(chunk_path, src_path.name, data, mtime)
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (src_path.name.lower(), src_path.name, shard_base_name(src_path.name), chunk_path.name,
+                              data_offset, compress_size, len(data), compress_type, crc, mtime, time.time()))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        loose_copy = self.directory / src_path.name
+        if loose_copy != src_path:
+            loose_copy.unlink(missing_ok=True)  # Устаревшая отдельная копия не должна заслонять архивную
+        src_path.unlink()
+
+    def _entry(self, name: str):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT name, chunk, data_offset, compress_size, size, compress_type, crc, mtime "
+                                "FROM entries WHERE key = ?", (name.lower(),)).fetchone()
+        finally:
+            conn.close()
+
+    def contains(self, name: str) -> bool:
+        return self._entry(name) is not None
+
+    def has_base(self, base_name: str) -> bool:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT 1 FROM entries WHERE base = ? LIMIT 1", (base_name.lower(),)).fetchone() is not None
+        finally:
+            conn.close()
+
+    def entries(self) -> list[tuple[str, float]]:
+        """(имя, mtime исходного файла) для всех файлов архива."""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT name, mtime FROM entries ORDER BY key").fetchall()
+        finally:
+            conn.close()
+
+    def read_bytes(self, name: str) -> bytes | None:
+        """Содержимое файла (None, если его нет в архиве). Читаются только его данные, без каталога ZIP."""
+        entry = self._entry(name)
+        if entry is None:
+            return None
+        stored_name, chunk, data_offset, compress_size, size, compress_type, crc, _ = entry
+        chunk_path = self.directory / chunk
+        if compress_type == zipfile.ZIP_LZMA:
+            with zipfile.ZipFile(chunk_path) as archive:
+                return archive.read(stored_name)
+        with open(chunk_path, 'rb') as f:
+            f.seek(data_offset)
+            data = f.read(compress_size)
+        if compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise OSError(f"Повреждены данные {stored_name} в {chunk}")
+        return data
+
+    def extract(self, name: str, dst_path: Path) -> bool:
+        data = self.read_bytes(name)
+        if data is None:
+            return False
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        dst_path.write_bytes(data)
+        return True
+
+    def forget_base(self, base_name: str) -> int:
+        """Убирает из индекса все файлы базы (PNG и кадры CEL). Возвращает кол-во записей."""
+        conn = self._connect()
+        try:
+            return conn.execute("DELETE FROM entries WHERE base = ?", (base_name.lower(),)).rowcount
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            count, live_bytes, size_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(compress_size), 0), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        finally:
+            conn.close()
+        chunks = [path for path in self.directory.glob('used_*.zip') if CHUNK_NAME.match(path.name)]
+        return {'files': count, 'live_bytes': live_bytes, 'size_bytes': size_bytes, 'chunks': len(chunks),
+                'chunk_bytes': sum(path.stat().st_size for path in chunks)}
+
+
+class ArchivedFile:
+    """Файл из архива USED_DIR там, где ожидается путь: имя, stem, mtime и чтение в память."""
+    def __init__(self, store: UsedStore, name: str, mtime: float):
+        self.store = store
+        self.name = name
+        self.stem = Path(name).stem
+        self.mtime = mtime
+
+    def open(self):
+        data = self.store.read_bytes(self.name)
+        if data is None:
+            raise FileNotFoundError(f"{self.name} нет в архиве {display_path(self.store.directory)}")
+        return io.BytesIO(data)
+
+
+def get_used_store() -> UsedStore | None:
+    """Архив USED_DIR (None, если USED_STORE_ENABLED выключен)."""
+    global _store
+    if not config.USED_STORE_ENABLED:
+        return None
+    if _store is None or _store.index_path != config.USED_STORE_INDEX_PATH:
+        _store = UsedStore(config.USED_DIR, config.USED_STORE_INDEX_PATH)
+    return _store
+
+
+def move_to_used(png_path: Path):
+    """Переносит использованный PNG в архив (или отдельным файлом в USED_DIR, если архив выключен)."""
+    store = get_used_store()
+    if store is None:
+        config.USED_DIR.mkdir(parents=True, exist_ok=True)
+        safe_move(png_path, config.USED_DIR / png_path.name)
+    else:
+        store.add(png_path)
+
+
+def used_png_stems() -> set:
+    """Имена (stem) использованных PNG: отдельные файлы в USED_DIR и файлы архива."""
+    stems = {path.stem for path in config.USED_DIR.glob('*.png')} if config.USED_DIR.is_dir() else set()
+    store = get_used_store()
+    if store is not None:
+        stems.update(Path(name).stem for name, _ in store.entries() if name.lower().endswith('.png'))
+    return stems
+
+
+def used_file_names() -> list[str]:
+    """Имена всех архивных файлов (для подсчета вместе с отдельными файлами USED_DIR)."""
+    store = get_used_store()
+    return [name for name, _ in store.entries()] if store is not None else []
+
+
+def used_png_sources() -> list:
+    """Использованные PNG для чтения: Path для отдельных файлов, ArchivedFile для архивных."""
+    sources = {}
+    store = get_used_store()
+    if store is not None:
+        for name, mtime in store.entries():
+            if name.lower().endswith('.png'):
+                sources[name.lower()] = ArchivedFile(store, name, mtime)
+    if config.USED_DIR.is_dir():
+        for path in config.USED_DIR.glob('*.png'):
+            sources[path.name.lower()] = path
+    return list(sources.values())
+
+
+def open_used_source(source):
+    """Путь или файловый объект для Image.open."""
+    return source.open() if isinstance(source, ArchivedFile) else source
+
+
+def used_source_mtime(source) -> float:
+    return source.mtime if isinstance(source, ArchivedFile) else source.stat().st_mtime
+
+
+def read_used_bytes(name: str) -> bytes | None:
+    """Содержимое использованного файла (отдельного или из архива); None, если его нет."""
+    loose_path = config.USED_DIR / name
+    if loose_path.exists():
+        return loose_path.read_bytes()
+    store = get_used_store()
+    return store.read_bytes(name) if store is not None else None
+
+
+def forget_used(base_name: str) -> int:
+    """Удаляет использованные PNG базы (отдельные файлы и записи архива). Возвращает кол-во."""
+    removed = 0
+    for path in [config.USED_DIR / f"{base_name}.png", *config.USED_DIR.glob(f"{base_name}__cel_*.png")]:
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+    store = get_used_store()
+    if store is not None:
+        removed += store.forget_base(base_name)
+    return removed
+
+
+def migrate_loose_files(store: UsedStore) -> dict:
+    """Переносит отдельные файлы (VALID_EXTENSIONS) из USED_DIR в архив."""
+    status_counts = {}
+    loose = sorted(path for path in config.USED_DIR.iterdir()
+                   if path.is_file() and path.suffix.lower() in config.VALID_EXTENSIONS)
+    print(f"Отдельных файлов для переноса в архив: {len(loose)}")
+    for index, path in enumerate(loose, 1):
+        try:
+            store.add(path)
+            status = 'success'
+        except OSError as e:
+            print(f"  ОШИБКА: Не удалось перенести {path.name}: {e}")
+            status = 'error_archive'
+        status_counts[status] = status_counts.get(status, 0) + 1
+        if index % 500 == 0:
+            print(f"  Перенесено {index} из {len(loose)}...")
+    return status_counts
+
+
+def print_summary_report_used_store(stats, status_counts=None):
+    print("\n--- Архив использованных PNG ---")
+    if status_counts is not None:
+        print(f"Перенесено в архив: {status_counts.get('success', 0)}, ошибок: {status_counts.get('error_archive', 0)}")
+    print(f"Файлов в архиве: {stats['files']} ({stats['size_bytes'] / 1024 ** 2:.1f} МБ, "
+          f"в архиве {stats['live_bytes'] / 1024 ** 2:.1f} МБ)")
+    garbage = stats['chunk_bytes'] - stats['live_bytes']
+    print(f"Архивов: {stats['chunks']}, на диске {stats['chunk_bytes'] / 1024 ** 2:.1f} МБ "
+          f"(из них удаленные/замененные и заголовки: {max(0, garbage) / 1024 ** 2:.1f} МБ)")
+    loose = sum(1 for path in config.USED_DIR.iterdir() if path.is_file() and path.suffix.lower() in config.VALID_EXTENSIONS)
+    if loose:
+        print(f"Отдельных файлов в {config.USED_DIR.name}: {loose} (перенести: jones.py used-store --migrate)")
+    print(f"Индекс: {display_path(config.USED_STORE_INDEX_PATH)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Архив использованных PNG (USED_DIR): перенос, статистика, извлечение.")
+    parser.add_argument("--migrate", action="store_true", help="Перенести отдельные файлы из USED_DIR в архив.")
+    parser.add_argument("--extract", nargs="+", metavar="NAME", help="Извлечь файлы из архива по имени.")
+    parser.add_argument("--to", type=Path, default=Path.cwd(), help="Папка для извлеченных файлов.")
+    args = parser.parse_args(argv)
+
+    store = get_used_store()
+    if store is None:
+        print("Архив использованных PNG выключен (USED_STORE_ENABLED = False).")
+        sys.exit(1)
+    start_time = time.time()
+    status_counts = None
+    if args.extract:
+        missing = [name for name in args.extract if not store.extract(name, args.to / name)]
+        print(f"Извлечено {len(args.extract) - len(missing)} из {len(args.extract)} в {args.to}")
+        for name in missing:
+            print(f"  - {name}: нет в архиве")
+    if args.migrate:
+        status_counts = migrate_loose_files(store)
+    print_summary_report_used_store(store.stats(), status_counts)
+    print(f"Время: {time.time() - start_time:.2f} сек.")
+    if args.extract and missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
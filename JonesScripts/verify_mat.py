@@ -0,0 +1,152 @@
+import io
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from conf import Config
+from fsutil import display_path
+from context import get_context
+from mat_format import read_mat_header, spot_check_texture
+from used_store import read_used_bytes
+from texture_budget import load_texture_plan, planned_size
+from upscale_routing import routed_scale
+
+config = Config()
+
+def find_original_mat(base_name):
+    """Ищет исходный MAT для финального файла в USED_MAT_DIR / USED_MANUAL_MAT_DIR."""
+    for directory in (config.USED_MAT_DIR, config.USED_MANUAL_MAT_DIR):
+        original_mat_path = directory / f"{base_name}.mat"
+        if original_mat_path.exists():
+            return original_mat_path
+    return None
+
+def compare_mat_to_original(final_info, original_info, scale=None, allowed_size=None):
+    """
+    Сравнивает заголовки финального и исходного MAT: формат, кол-во текстур и размеры (x scale,
+    по умолчанию UPSCALE_FACTOR; для текстур с маршрутом апскейла - его масштаб, см. routed_scale).
+    allowed_size - допустимый размер из плана памяти текстур (если текстура была уменьшена).
+    Возвращает список найденных проблем (пустой, если все совпадает).
+    """
+    scale = config.UPSCALE_FACTOR if scale is None else scale
+    problems = []
+    if final_info['format_standardized'] != original_info['format_standardized']:
+        problems.append(f"формат {final_info['format_standardized']} != {original_info['format_standardized']}")
+    if final_info['texture_count'] != original_info['texture_count']:
+        problems.append(f"текстур {final_info['texture_count']} != {original_info['texture_count']}")
+    for index, (final_tex, orig_tex) in enumerate(zip(final_info['textures'], original_info['textures'])):
+        expected = (orig_tex['width'] * scale, orig_tex['height'] * scale)
+        actual = (final_tex['width'], final_tex['height'])
+        if actual != expected and actual != allowed_size:
+            problems.append(f"текстура #{index}: размер {actual[0]}x{actual[1]}, ожидалось {expected[0]}x{expected[1]}")
+        if final_info['format_standardized'] == "indexed" and final_tex['transparent'] != orig_tex['transparent']:
+            problems.append(f"текстура #{index}: флаг прозрачности {final_tex['transparent']} != {orig_tex['transparent']}")
+    return problems
+
+def used_reference_pixels(base_name, texture_index, texture_count):
+    """Пиксели использованного PNG, из которого запакована текстура (None, если PNG нет или не читается)."""
+    name = f"{base_name}.png" if texture_count == 1 else f"{base_name}__cel_{texture_index}.png"
+    data = read_used_bytes(name)
+    if data is None:
+        return None
+    from imageutil import read_rgba_pixels  # NumPy и PIL нужны только для сверки с PNG
+    try:
+        return read_rgba_pixels(io.BytesIO(data))
+    except (OSError, ValueError):
+        return None
+
+def verify_single_mat(final_mat_path, texture_plan=None):
+    """Проверяет один финальный MAT относительно исходного: заголовки и выборочные строки пикселей."""
+    get_context().track_asset(final_mat_path.name)
+    base_name = final_mat_path.stem
+    entry = {'name': final_mat_path.name, 'status': 'ok', 'problems': []}
+
+    final_info = read_mat_header(final_mat_path)
+    if final_info['error']:
+        entry.update(status='error_final_unreadable', problems=[final_info['error']])
+        return entry
+    entry['format'] = final_info['format_standardized']
+    entry['texture_count'] = final_info['texture_count']
+    entry['sizes'] = [[t['width'], t['height']] for t in final_info['textures']]
+
+    original_mat_path = find_original_mat(base_name)
+    if original_mat_path is None:
+        entry['status'] = 'no_original'
+    else:
+        entry['original'] = str(display_path(original_mat_path))
+        original_info = read_mat_header(original_mat_path)
+        if original_info['error']:
+            entry.update(status='error_original_unreadable', problems=[original_info['error']])
+            return entry
+        entry['scale'] = routed_scale(base_name)
+        problems = compare_mat_to_original(final_info, original_info, scale=entry['scale'],
+                                           allowed_size=planned_size(texture_plan or {}, base_name))
+        if problems:
+            entry.update(status='error_mismatch', problems=problems)
+            return entry
+
+    if final_info['textures']:
+        # Выборочная проверка данных первой и последней текстуры (со сверкой с использованным PNG, если он есть)
+        texture_count = len(final_info['textures'])
+        for texture_index in sorted({0, texture_count - 1}):
+            reference = used_reference_pixels(base_name, texture_index, texture_count)
+            decode_error = spot_check_texture(final_mat_path, final_info, texture_index, reference=reference,
+                                              alpha_threshold=config.ALPHA_BINARY_THRESHOLD)
+            if decode_error:
+                entry['status'] = 'error_decode'
+                entry['problems'].append(decode_error)
+    return entry
+
+def write_verify_report(entries, elapsed):
+    """Сохраняет машиночитаемый отчет проверки в JSON."""
+    status_counts = {}
+    for entry in entries:
+        status_counts[entry['status']] = status_counts.get(entry['status'], 0) + 1
+    report = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'final_mat_dir': str(config.FINAL_MAT_DIR),
+        'upscale_factor': config.UPSCALE_FACTOR,
+        'elapsed_seconds': round(elapsed, 3),
+        'status_counts': status_counts,
+        'files': entries,
+    }
+    config.VERIFY_REPORT_PATH.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    return status_counts
+
+def print_summary_report_verify(total_files, status_counts, entries, elapsed):
+    """Печатает итоговый отчет проверки."""
+    print("\n--- Проверка финальных MAT Завершена ---")
+    print(f"Всего проверено MAT в {config.FINAL_MAT_DIR.name}: {total_files} за {elapsed:.2f} сек.")
+    print(f"Совпадают с исходными: {status_counts.get('ok', 0)}")
+    if status_counts.get('no_original', 0) > 0:
+        print(f"Исходный MAT не найден (проверены только заголовок и данные): {status_counts['no_original']}")
+    errors = [e for e in entries if e['status'].startswith('error_')]
+    print(f"Ошибок: {len(errors)}")
+    for entry in errors[:20]:
+        print(f"  - {entry['name']} [{entry['status']}]: {'; '.join(entry['problems'])}")
+    if len(errors) > 20:
+        print(f"  ... и еще {len(errors) - 20}")
+    print(f"\nОтчет сохранен в: {config.VERIFY_REPORT_PATH}")
+    return len(errors)
+
+def main():
+    print("\n--- Проверка финальных MAT относительно исходных ---")
+    if not config.FINAL_MAT_DIR.is_dir():
+        print(f"КРИТИЧЕСКАЯ ОШИБКА: Папка с финальными MAT ({config.FINAL_MAT_DIR}) не найдена!")
+        sys.exit(1)
+
+    final_mat_files = sorted(config.FINAL_MAT_DIR.glob('*.mat'))
+    print(f"Найдено {len(final_mat_files)} финальных MAT, потоков: {config.VERIFY_WORKERS}")
+    texture_plan = load_texture_plan()
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=config.VERIFY_WORKERS) as executor:
+        entries = list(executor.map(lambda path: verify_single_mat(path, texture_plan), final_mat_files))
+    elapsed = time.time() - start_time
+
+    status_counts = write_verify_report(entries, elapsed)
+    error_count = print_summary_report_verify(len(final_mat_files), status_counts, entries, elapsed)
+    if error_count:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import time
+import argparse
+import threading
+import importlib.util
+from pathlib import Path
+from conf import Config
+from context import get_context
+from used_store import forget_used
+from upscale_routing import forget_route
+
+config = Config()
+
+# Стадии конвейера в порядке запуска и проверка, есть ли у стадии входные файлы
+WATCH_STAGES = [
+    ('extract', lambda: any(config.MAT_DIR.glob('*.mat'))),
+    ('cel-extract', lambda: any(config.MANUAL_CEL_DIR.glob('*.mat'))),
+    ('upscale', lambda: any(png for fmt_dir in config.FORMAT_DIRS.values() for png in fmt_dir.glob('*.png'))),
+    ('pack', lambda: any(config.PROCESSED_PNG_DIR.glob('*.png'))),
+    ('cel-pack', lambda: any(config.PROCESSED_PNG_DIR.glob('*__cel_*.png'))),
+]
+
+
+class ChangeCollector:
+    """
+    Накопитель событий файловой системы: путь -> время последнего события.
+    Пакет готов, когда в папках нет событий debounce секунд (копирование закончилось,
+    серия файлов собрана вместе), или когда первое событие ждет дольше max_delay.
+    Повторные события по одному файлу схлопываются. Потокобезопасен: события приходят из потока наблюдателя.
+    """
+    def __init__(self, debounce: float, max_delay: float):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.first_event = None
+        self.wakeup = threading.Event()
+
+    def add(self, path: Path):
+        if path.suffix.lower() != '.mat':
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.pending[path] = now
+            if self.first_event is None:
+                self.first_event = now
+        self.wakeup.set()
+
+    def take_batch(self) -> tuple[list[Path], float | None]:
+        """Возвращает (пути готового пакета, время первого события) или ([], None), если ждать еще рано."""
+        with self.lock:
+            if not self.pending:
+                return [], None
+            now = time.monotonic()
+            quiet = now - max(self.pending.values()) >= self.debounce
+            overdue = now - self.first_event >= self.max_delay
+            if not quiet and not overdue:
+                return [], None
+            batch, first_event = sorted(self.pending), self.first_event
+            self.pending.clear()
+            self.first_event = None
+        return batch, first_event
+
+
+class PollingWatcher:
+    """Запасной наблюдатель без watchdog: раз в interval секунд сравнивает размер и время изменения *.mat."""
+    def __init__(self, directories: list[Path], collector: ChangeCollector, interval: float):
+        self.directories = directories
+        self.collector = collector
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.snapshot = self._scan()
+        self.thread = threading.Thread(target=self._loop, name="watch-poll", daemon=True)
+
+    def _scan(self):
+        snapshot = {}
+        for directory in self.directories:
+            for path in directory.glob('*.mat'):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            snapshot = self._scan()
+            for path, signature in snapshot.items():
+                if self.snapshot.get(path) != signature:
+                    self.collector.add(path)
+            self.snapshot = snapshot
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def start_watcher(directories, collector, force_polling, poll_interval):
+    """Подписка на события папок через watchdog (если установлен), иначе опрос."""
+    if not force_polling and importlib.util.find_spec('watchdog') is not None:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory: collector.add(Path(event.src_path))
+            def on_modified(self, event):
+                if not event.is_directory: collector.add(Path(event.src_path))
+            def on_moved(self, event):
+                if not event.is_directory: collector.add(Path(event.dest_path))
+
+        observer = Observer()
+        for directory in directories:
+            observer.schedule(Handler(), str(directory), recursive=False)
+        observer.start()
+        print(f"   Наблюдение через watchdog: {', '.join(d.name for d in directories)}")
+        return observer
+    watcher = PollingWatcher(directories, collector, poll_interval)
+    watcher.start()
+    print(f"   Наблюдение опросом раз в {poll_interval:.1f} сек. (watchdog не установлен или задан --polling): "
+          f"{', '.join(d.name for d in directories)}")
+    return watcher
+
+
+def invalidate_base(base_name):
+    """
+    Удаляет результаты прошлой обработки текстуры, чтобы измененный MAT прошел конвейер заново:
+    исходный MAT в used, извлеченные, обработанные и использованные PNG, финальный MAT.
+    """
+    candidates = [config.USED_MAT_DIR / f"{base_name}.mat", config.USED_MANUAL_MAT_DIR / f"{base_name}.mat",
+                  config.FINAL_MAT_DIR / f"{base_name}.mat"]
+    for directory in [config.PROCESSED_PNG_DIR, *config.FORMAT_DIRS.values()]:
+        candidates.append(directory / f"{base_name}.png")
+        candidates.extend(directory.glob(f"{base_name}__cel_*.png"))
+    removed = forget_used(base_name)
+    forget_route(base_name)  # Новое содержимое - признаки для маршрута апскейла считаются заново
+    for path in candidates:
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"  ПРЕДУПРЕЖДЕНИЕ: Не удалось удалить устаревший {path.name}: {e}")
+    if removed:
+        print(f"  {base_name}: MAT изменен, удалено {removed} результатов прошлой обработки.")
+
+
+def is_changed_texture(mat_path):
+    """MAT уже проходил конвейер (есть исходный в used или финальный), значит его заменили новой версией."""
+    used_copies = [config.USED_MANUAL_MAT_DIR / mat_path.name]
+    if mat_path.parent == config.MAT_DIR:
+        used_copies += [config.USED_MAT_DIR / mat_path.name, config.FINAL_MAT_DIR / mat_path.name]
+    return any(path.exists() for path in used_copies)
+
+
+def run_pipeline(upscale_args):
+    """Запускает стадии, у которых есть входные файлы. Возвращает False, если стадия завершилась с ошибкой."""
+    from jones import run_command
+    for stage, has_work in WATCH_STAGES:
+        if not has_work():
+            continue
+        print(f"\n===== watch: {stage} =====")
+        try:
+            run_command(stage, upscale_args if stage == 'upscale' else [])
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                print(f"\nСтадия '{stage}' завершилась с кодом {e.code}. Пакет прерван, наблюдение продолжается.")
+                return False
+    return True
+
+
+def process_batch(batch, first_event, upscale_args):
+    existing = [path for path in batch if path.exists()]  # Файлы, перемещенные самим конвейером, пропускаем
+    if not existing:
+        return
+    print(f"\n--- Пакет: {len(existing)} MAT ({', '.join(path.name for path in existing[:5])}"
+          f"{', ...' if len(existing) > 5 else ''}) ---")
+    for mat_path in existing:
+        if is_changed_texture(mat_path):
+            invalidate_base(mat_path.stem)
+    ok = run_pipeline(upscale_args)
+    latency = time.monotonic() - first_event
+    print(f"\n--- Пакет {'обработан' if ok else 'обработан с ошибками'}: {latency:.1f} сек. от первого события ---")
+    get_context().save_manifest()
+
+
+def parse_args_watch(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Режим наблюдения: новые и измененные MAT в MAT_DIR и MANUAL_CEL_DIR сразу проходят "
+                    "извлечение, апскейл и запаковку. Остановка - Ctrl+C.")
+    parser.add_argument("--polling", action="store_true", help="Опрашивать папки, даже если watchdog установлен.")
+    parser.add_argument("--poll-interval", type=float, default=config.WATCH_POLL_SECONDS,
+                        help="Интервал опроса папок, сек.")
+    parser.add_argument("--debounce", type=float, default=config.WATCH_DEBOUNCE_SECONDS,
+                        help="Сколько секунд без событий ждать перед запуском пакета.")
+    parser.add_argument("--wait-on-quota", action="store_true", help="Передается Скрипту 2.")
+    parser.add_argument("--workers", type=int, default=config.UPSCALE_WORKERS, help="Передается Скрипту 2.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args_watch(argv)
+    upscale_args = ["--workers", str(args.workers)] + (["--wait-on-quota"] if args.wait_on_quota else [])
+    print("\n--- Режим наблюдения: инкрементальная обработка новых MAT ---")
+    directories = [config.MAT_DIR, config.MANUAL_CEL_DIR]
+    for directory in directories:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    collector = ChangeCollector(args.debounce, config.WATCH_MAX_DELAY_SECONDS)
+    watcher = start_watcher(directories, collector, args.polling, args.poll_interval)
+    try:
+        if any(has_work() for _, has_work in WATCH_STAGES):
+            print("\nОбработка файлов, накопившихся до запуска...")
+            run_pipeline(upscale_args)
+            get_context().save_manifest()
+        print("\nОжидание новых MAT (Ctrl+C - выход)...")
+        while True:
+            collector.wakeup.wait(timeout=0.5)
+            collector.wakeup.clear()
+            batch, first_event = collector.take_batch()
+            if batch:
+                process_batch(batch, first_event, upscale_args)
+                print("\nОжидание новых MAT (Ctrl+C - выход)...")
+    except KeyboardInterrupt:
+        print("\nНаблюдение остановлено.")
+    finally:
+        watcher.stop()
+        if hasattr(watcher, 'join'):
+            watcher.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import os
+import time
+import queue
+import shutil
+import atexit
+import itertools
+import threading
+import subprocess
+from pathlib import Path, PureWindowsPath
+
+# Символы, которые cmd.exe раскрывает даже внутри кавычек (%VAR%, !VAR!) или которые нельзя
+# передать внутри аргумента в кавычках; такие команды идут мимо cmd обычным запуском wine
+_CMD_UNSAFE = set('%!"\r\n')
+
+
+def cmd_quote_args(args) -> str | None:
+    """
+    Командная строка для cmd.exe: каждый аргумент в кавычках, поэтому & | < > ^ ( ) внутри путей
+    не разбираются cmd. Обратные слэши перед закрывающей кавычкой удваиваются (разбор аргументов CRT).
+    None, если аргумент нельзя безопасно передать через cmd.
+    """
+    quoted = []
+    for arg in args:
+        if any(char in _CMD_UNSAFE for char in arg):
+            return None
+        trailing = len(arg) - len(arg.rstrip('\\'))
+        quoted.append('"' + arg + '\\' * trailing + '"')
+    return " ".join(quoted)
+
+
+class WineLauncher:
+    """
+    Предзапущенный wine cmd.exe: команды передаются через stdin, после команды печатается
+    маркер с кодом возврата. Запуск matool из уже работающего cmd не платит за старт
+    загрузчика wine и подключение к wineserver.
+    """
+    MARKER = "__JONES_MATOOL_DONE__"
+
+    def __init__(self, wine_exe: str, env: dict, cwd: Path, stderr_path: Path, stderr_wine_path: str):
+        self.stderr_path = stderr_path
+        self.stderr_wine_path = stderr_wine_path
+        self.process = subprocess.Popen(
+            [wine_exe, "cmd.exe", "/q", "/k"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, cwd=cwd, env=env, text=True, encoding='utf-8', errors='ignore', bufsize=1)
+        # Строки stdout читает отдельный поток: ожидание ответа ограничено сроком команды
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_stdout, name="wine-launcher-stdout", daemon=True).start()
+
+    def _read_stdout(self):
+        for line in self.process.stdout:
+            self.lines.put(line)
+        self.lines.put(None)
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, command_line: str, timeout: float | None = None) -> tuple[int, str, str]:
+        """
+        Выполняет командную строку Windows. Возвращает (код, stdout, stderr); OSError, если cmd завершился,
+        TimeoutError, если команда не завершилась за timeout сек. (launcher после этого непригоден).
+        """
+        self.stderr_path.unlink(missing_ok=True)
+        # Строки разбираются cmd по одной: %ERRORLEVEL% раскрывается уже после завершения команды
+        self.process.stdin.write(f'{command_line} 2>"{self.stderr_wine_path}"\r\n')
+        self.process.stdin.write(f'echo {self.MARKER} %ERRORLEVEL%\r\n')
+        self.process.stdin.flush()
+        stdout_lines = []
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.0, deadline - time.monotonic()) if deadline else None)
+            except queue.Empty:
+                raise TimeoutError(f"команда не завершилась за {timeout:.0f} сек.") from None
+            if line is None:
+                raise OSError("wine cmd.exe завершился во время выполнения команды")
+            # Если вывод команды не закончился переводом строки, маркер окажется в конце ее последней строки
+            output, marker, rest = line.partition(self.MARKER)
+            if marker:
+                if output:
+                    stdout_lines.append(output)
+                parts = rest.split()
+                code = int(parts[0]) if parts and parts[0].lstrip('-').isdigit() else 1
+                break
+            stdout_lines.append(line.rstrip('\r\n'))
+        try:
+            stderr = self.stderr_path.read_text(encoding='utf-8', errors='ignore')
+        except OSError:
+            stderr = ""
+        return code, "\n".join(stdout_lines), stderr
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait()
+
+    def close(self):
+        try:
+            if self.alive():
+                self.process.stdin.write("exit\r\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+class WineRunner:
+    """
+    Запуск matool.exe через Wine на Linux: wineserver держится запущенным (-p), префикс
+    инициализируется один раз, а команды выполняются в пуле предзапущенных wine cmd.exe.
+    Пути переводятся в пути Wine (диск Z: = корень Linux) без вызова winepath.
+    Если launcher недоступен или аргументы нельзя безопасно передать через cmd (% ! "),
+    команда выполняется обычным запуском wine. Команда, не завершившаяся за timeout сек.,
+    прерывается: launcher убивается и запускается заново.
+    """
+    def __init__(self, wine_exe: str, wineserver_exe: str, prefix: Path | None, launchers: int,
+                 server_linger: int, cwd: Path, timeout: float | None = None):
+        self.wine_exe = shutil.which(wine_exe) or wine_exe
+        self.wineserver_exe = shutil.which(wineserver_exe) or wineserver_exe
+        self.cwd = cwd
+        self.env = dict(os.environ)
+        self.env.setdefault('WINEDEBUG', '-all')
+        self.env.setdefault('WINEDLLOVERRIDES', 'mscoree,mshtml=')  # Без предложений установить Mono/Gecko
+        if prefix is not None:
+            self.env['WINEPREFIX'] = str(prefix)
+        self.prefix = Path(self.env.get('WINEPREFIX', Path.home() / '.wine'))
+        self.server_linger = server_linger
+        self.timeout = timeout
+        self.launcher_count = launchers
+        self.launchers = queue.LifoQueue()
+        self.stats = {'launcher_calls': 0, 'direct_calls': 0, 'launcher_restarts': 0, 'timeouts': 0}
+        self.stats_lock = threading.Lock()
+        self._path_cache = {}
+        self._launcher_ids = itertools.count()
+
+    @staticmethod
+    def available(wine_exe: str) -> bool:
+        return shutil.which(wine_exe) is not None
+
+    def start(self):
+        """Инициализирует префикс (один раз), поднимает wineserver и запускает launcher'ы."""
+        if not (self.prefix / 'system.reg').exists():
+            print(f"Wine: Инициализация префикса {self.prefix} (однократно)...")
+            subprocess.run([self.wine_exe, "wineboot", "-i"], env=self.env, capture_output=True, check=False)
+        subprocess.run([self.wineserver_exe, f"-p{self.server_linger}"], env=self.env, capture_output=True, check=False)
+        for _ in range(self.launcher_count):
+            self.launchers.put(self._spawn_launcher())
+        atexit.register(self.close)
+        print(f"Wine: wineserver запущен (префикс {self.prefix}), предзапущено launcher'ов: {self.launcher_count}")
+
+    def _spawn_launcher(self):
+        index = next(self._launcher_ids)
+        stderr_path = self.cwd / f".matool_wine_stderr_{os.getpid()}_{index}.txt"
+        return WineLauncher(self.wine_exe, self.env, self.cwd, stderr_path, self.to_wine_path(stderr_path))
+
+    def to_wine_path(self, path: Path) -> str:
+        """Путь Linux -> путь Wine через диск Z: (результат кэшируется)."""
+        cached = self._path_cache.get(path)
+        if cached is None:
+            cached = str(PureWindowsPath("Z:\\", *Path(path).resolve().parts[1:]))
+            self._path_cache[path] = cached
+        return cached
+
+    def translate_args(self, args) -> list[str]:
+        return [self.to_wine_path(arg) if isinstance(arg, Path) else str(arg) for arg in args]
+
+    def run(self, executable: Path, args) -> tuple[int, str, str]:
+        """Выполняет executable с аргументами (Path переводятся в пути Wine). Возвращает (код, stdout, stderr)."""
+        wine_args = [self.to_wine_path(executable)] + self.translate_args(args)
+        command_line = cmd_quote_args(wine_args)
+        launcher = None
+        if command_line is not None:
+            try:
+                launcher = self.launchers.get_nowait()
+            except queue.Empty:
+                pass
+        if launcher is not None:
+            try:
+                result = launcher.run(command_line, self.timeout)
+                self.launchers.put(launcher)
+                with self.stats_lock:
+                    self.stats['launcher_calls'] += 1
+                return result
+            except TimeoutError as e:
+                print(f"  Wine ОШИБКА: {executable.name}: {e} Launcher перезапускается.")
+                launcher.kill()
+                self.launchers.put(self._spawn_launcher())
+                with self.stats_lock:
+                    self.stats['timeouts'] += 1
+                    self.stats['launcher_restarts'] += 1
+                raise
+            except OSError as e:
+                print(f"  Wine ПРЕДУПРЕЖДЕНИЕ: launcher недоступен ({e}), запускаем заново.")
+                launcher.close()
+                self.launchers.put(self._spawn_launcher())
+                with self.stats_lock:
+                    self.stats['launcher_restarts'] += 1
+
+        with self.stats_lock:
+            self.stats['direct_calls'] += 1
+        try:
+            result = subprocess.run([self.wine_exe] + wine_args, capture_output=True, text=True, check=False,
+                                    encoding='utf-8', errors='ignore', cwd=self.cwd, env=self.env, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            with self.stats_lock:
+                self.stats['timeouts'] += 1
+            raise TimeoutError(f"{executable.name}: команда не завершилась за {self.timeout:.0f} сек.") from None
+        return result.returncode, result.stdout, result.stderr
+
+    def close(self):
+        while True:
+            try:
+                launcher = self.launchers.get_nowait()
+            except queue.Empty:
+                break
+            launcher.close()
+            launcher.stderr_path.unlink(missing_ok=True)
@@ -0,0 +1,174 @@
+import time
+import socket
+import sqlite3
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    name TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks(state, lease_until);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    host TEXT,
+    started_at REAL,
+    heartbeat_at REAL,
+    done_count INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class WorkQueue:
+    """
+    Общая очередь задач апскейла в SQLite (файл на общей папке).
+    Воркер берет задачу в аренду (lease) на ограниченное время и продлевает её
+    heartbeat'ами; задачи с истекшей арендой (упавший воркер) снова выдаются.
+    Соединение открывается на каждую операцию, чтобы корректно работать из
+    нескольких потоков/процессов/машин (журнал DELETE, без WAL - WAL не работает по сети).
+    """
+    def __init__(self, db_path: Path, timeout: float = 30.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_path), timeout=self.timeout, isolation_level=None)
+
+    def _transaction(self, conn):
+        # BEGIN IMMEDIATE сразу берет блокировку записи - два воркера не получат одну задачу
+        conn.execute("BEGIN IMMEDIATE")
+
+    def populate(self, items: list[tuple[str, str]]) -> int:
+        """Добавляет задачи (name, source); уже существующие не трогает. Возвращает кол-во новых."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO tasks(name, source, updated_at) VALUES (?, ?, ?)",
+                             [(name, source, now) for name, source in items])
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+            return added
+        finally:
+            conn.close()
+
+    def register_worker(self, worker_id: str):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO workers(worker_id, host, started_at, heartbeat_at, done_count) "
+                         "VALUES (?, ?, ?, ?, COALESCE((SELECT done_count FROM workers WHERE worker_id = ?), 0))",
+                         (worker_id, socket.gethostname(), now, now, worker_id))
+        finally:
+            conn.close()
+
+    def claim(self, worker_id: str, lease_seconds: float, max_attempts: int | None = None) -> tuple[str, str] | None:
+        """
+        Берет в аренду следующую свободную задачу (или с истекшей арендой).
+        Задача с истекшей арендой, исчерпавшая max_attempts попыток, помечается 'failed' и больше
+        не выдается: текстура, на которой воркер падает или зависает, не обходит по кругу все машины.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            if max_attempts is not None:
+                conn.execute("UPDATE tasks SET state = 'failed', owner = NULL, lease_until = NULL, "
+                             "last_error = 'lease_expired', updated_at = ? "
+                             "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, max_attempts))
+            row = conn.execute(
+                "SELECT name, source FROM tasks "
+                "WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?) "
+                "ORDER BY attempts, name LIMIT 1", (now,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE tasks SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1, "
+                         "updated_at = ? WHERE name = ?", (worker_id, now + lease_seconds, now, row[0]))
+            conn.execute("COMMIT")
+            return row[0], row[1]
+        finally:
+            conn.close()
+
+    def heartbeat(self, worker_id: str, name: str, lease_seconds: float) -> bool:
+        """Продлевает аренду. False - аренда потеряна (истекла и задачу взял другой воркер)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?", (now, worker_id))
+            cursor = conn.execute("UPDATE tasks SET lease_until = ?, updated_at = ? "
+                                  "WHERE name = ? AND owner = ? AND state = 'leased'",
+                                  (now + lease_seconds, now, name, worker_id))
+            return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def complete(self, worker_id: str, name: str) -> bool:
+        """Завершает задачу, если она все еще в аренде у worker_id. False - аренда потеряна."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            cursor = conn.execute("UPDATE tasks SET state = 'done', lease_until = NULL, updated_at = ? "
+                                  "WHERE name = ? AND owner = ? AND state = 'leased'", (now, name, worker_id))
+            completed = cursor.rowcount == 1
+            conn.execute("UPDATE workers SET done_count = done_count + ?, heartbeat_at = ? WHERE worker_id = ?",
+                         (int(completed), now, worker_id))
+            conn.execute("COMMIT")
+            return completed
+        finally:
+            conn.close()
+
+    def mark_done(self, name: str):
+        """Помечает задачу выполненной без аренды (результат уже существует)."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE tasks SET state = 'done', lease_until = NULL, updated_at = ? WHERE name = ?",
+                         (time.time(), name))
+        finally:
+            conn.close()
+
+    def fail(self, worker_id: str, name: str, error: str, max_attempts: int):
+        """Возвращает задачу в очередь или помечает 'failed' после max_attempts попыток."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                         "owner = NULL, lease_until = NULL, last_error = ?, updated_at = ? "
+                         "WHERE name = ? AND owner = ? AND state = 'leased'", (max_attempts, error, time.time(), name, worker_id))
+        finally:
+            conn.close()
+
+    def release(self, worker_id: str, name: str):
+        """Возвращает задачу в очередь без учета попытки (например, при исчерпании квоты)."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE tasks SET state = 'pending', owner = NULL, lease_until = NULL, "
+                         "attempts = MAX(0, attempts - 1), updated_at = ? WHERE name = ? AND owner = ? AND state = 'leased'",
+                         (time.time(), name, worker_id))
+        finally:
+            conn.close()
+
+    def counts(self) -> dict:
+        conn = self._connect()
+        try:
+            now = time.time()
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+            counts['expired'] = conn.execute("SELECT COUNT(*) FROM tasks WHERE state = 'leased' AND lease_until < ?",
+                                             (now,)).fetchone()[0]
+            return counts
+        finally:
+            conn.close()